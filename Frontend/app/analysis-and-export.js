@@ -41,27 +41,38 @@ const buildBackendOptions = () => {
         screenshot_width: +(captureWidthInput?.value || 200),
         screenshot_height: +(captureHeightInput?.value || 88),
         text_pos_x: +(positionXInput?.value || 50),
-        text_pos_y: +(positionYInput?.value || 50)
+        text_pos_y: +(positionYInput?.value || 50),
+        thumbnails: false // превью рендерятся по запросу (см. requestThumbnail)
     };
 };
 
+// Превью из хранилища бэкенда (image_path) загружаются через протокол appfile://
+const toAppFileUrl = (filePath) =>
+    `appfile://${encodeURI(String(filePath).replace(/\\/g, '/')).replace(/#/g, '%23')}`;
+
+const thumbnailSrc = (item) =>
+    item.image_path ? toAppFileUrl(item.image_path) : (item.image_png_b64 || '');
+
 // ВАЖНО: учитываем источник файла + поддержка OCR
 const adaptBackendItemToCaptured = (item, sourceFile) => {
     return {
-        dataUrl: item.image_png_b64 || '', // OCR может быть пусто
+        dataUrl: thumbnailSrc(item), // OCR может быть пусто
         gridCoord: item.grid || '',        // OCR может быть пусто
         text: item.text || '',
         composite_number: item.composite_number || item.text || '',
         page: item.page || 0,
         grid: item.grid || '',
         image_png_b64: item.image_png_b64 || '',
+        image_path: item.image_path || '',
         revision: typeof item.revision === 'number' ? item.revision : null,
         comment: item.comment || '',
         sourceFile: item.sourceFile || sourceFile || { name: '', path: '' },
         filePrefix: item.filePrefix,
+        // Область превью в пунктах PDF — по ней превью рендерится по запросу
+        clip: Array.isArray(item.clip) ? item.clip : null,
         excluded: false,
         // Новый флаг для UI — элемент из OCR (нет скрина)
-        isOcr: !item.image_png_b64
+        isOcr: !item.image_png_b64 && !item.image_path && !Array.isArray(item.clip)
     };
 };
 
@@ -83,6 +94,52 @@ const mergeAnalyzedItems = (existing, incoming) => {
     return out;
 };
 
+// Ленивая загрузка превью: видимые карточки собираются в пакет и рендерятся одним запросом
+const pendingThumbs = new Map();
+let thumbFlushTimer = null;
+
+const flushThumbnailRequests = async () => {
+    thumbFlushTimer = null;
+    const batch = Array.from(pendingThumbs.values());
+    pendingThumbs.clear();
+    if (batch.length === 0 || !window.electronAPI?.renderThumbnails) return;
+
+    try {
+        const result = await window.electronAPI.renderThumbnails(
+            batch.map(({ imgData }) => ({ path: imgData.sourceFile?.path, page: imgData.page, clip: imgData.clip }))
+        );
+        const images = result?.success ? result.data?.images || [] : [];
+        batch.forEach(({ imgData, img }, i) => {
+            if (!images[i]) return;
+            // Сохраняем в элемент состояния, чтобы экспорт не рендерил превью повторно
+            imgData.image_png_b64 = images[i].image_png_b64 || '';
+            imgData.image_path = images[i].image_path || '';
+            imgData.dataUrl = thumbnailSrc(imgData);
+            img.src = imgData.dataUrl;
+        });
+    } catch (e) {
+        console.error('Thumbnail rendering failed:', e);
+    }
+};
+
+const thumbObserver = typeof IntersectionObserver !== 'undefined'
+    ? new IntersectionObserver((entries) => {
+        for (const entry of entries) {
+            if (!entry.isIntersecting) continue;
+            thumbObserver.unobserve(entry.target);
+            const req = entry.target.__thumbRequest;
+            if (req && !req.imgData.dataUrl) pendingThumbs.set(entry.target, req);
+        }
+        if (pendingThumbs.size > 0 && !thumbFlushTimer) thumbFlushTimer = setTimeout(flushThumbnailRequests, 30);
+    }, { rootMargin: '400px' })
+    : null;
+
+const requestThumbnail = (imgData, img) => {
+    if (!thumbObserver) return;
+    img.__thumbRequest = { imgData, img };
+    thumbObserver.observe(img);
+};
+
 // Карточка результата (с поддержкой OCR и плашкой)
 const createResultCard = (imgData, index) => {
     const div = document.createElement('div');
@@ -115,6 +172,15 @@ const createResultCard = (imgData, index) => {
     if (imgData.dataUrl) {
         img.src = imgData.dataUrl;
         img.alt = `Screenshot of ${imgData.text}`;
+    } else if (imgData.clip) {
+        // Превью ещё не отрендерено — запросим, когда карточка станет видимой
+        img.src = 'data:image/svg+xml;base64,' + btoa(
+            `<svg xmlns="http://www.w3.org/2000/svg" width="200" height="60">
+                <rect width="100%" height="100%" fill="#eee"/>
+            </svg>`
+        );
+        img.alt = `Screenshot of ${imgData.text}`;
+        requestThumbnail(imgData, img);
     } else {
         // OCR fallback: заглушка
         img.src = 'data:image/svg+xml;base64,' + btoa(
@@ -205,6 +271,8 @@ const buildExportPayload = (format, options, flatItems) => {
             page: it.page,
             grid: it.grid || it.gridCoord || '',
             image_png_b64: it.image_png_b64 || '',
+            image_path: it.image_path || '',
+            clip: it.clip || null,
             revision: typeof it.revision === 'number' ? it.revision : null,
             comment: it.comment || '',
             sourceFile: { name: it?.sourceFile?.name || '', path: it?.sourceFile?.path || '' }
@@ -279,6 +347,14 @@ export const runAnalysis = async () => {
     processingSection.classList.remove('hidden');
     statusDisplay.textContent = t('processing') || 'Processing...';
 
+    // Потоковый режим: бэкенд присылает результаты по мере готовности файлов
+    const itemsByFile = new Map();
+    const unsubscribe = window.electronAPI.onAnalysisFile?.((evt) => {
+        if (!evt || evt.type !== 'file' || !Array.isArray(evt.items)) return;
+        itemsByFile.set(evt.index, evt.items);
+        statusDisplay.textContent = `${t('processing') || 'Processing...'} ${itemsByFile.size}/${filesToAnalyzePaths.length}`;
+    });
+
     try {
         const options = {
             prefix: currentSettings.prefix || 'W',
@@ -290,7 +366,9 @@ export const runAnalysis = async () => {
             screenshot_width: currentSettings.screenshot_width || 200,
             screenshot_height: currentSettings.screenshot_height || 88,
             text_pos_x: currentSettings.text_pos_x || 30,
-            text_pos_y: currentSettings.text_pos_y || 50
+            text_pos_y: currentSettings.text_pos_y || 50,
+            stream: unsubscribe ? 'file' : '',
+            thumbnails: false
         };
 
         const result = await window.electronAPI.runAnalysis(filesToAnalyzePaths, options);
@@ -301,8 +379,9 @@ export const runAnalysis = async () => {
 
         let images = [];
         if (result.data && Array.isArray(result.data.files)) {
-            images = result.data.files.flatMap(file =>
-                (file.items || []).map(item => adaptBackendItemToCaptured(item, file))
+            // Порядок файлов — как во входном списке, независимо от порядка готовности
+            images = result.data.files.flatMap((file, idx) =>
+                (file.items || itemsByFile.get(idx) || []).map(item => adaptBackendItemToCaptured(item, file))
             );
         }
 
@@ -324,6 +403,8 @@ export const runAnalysis = async () => {
         processingSection.classList.add('hidden');
         mainSection.classList.remove('hidden');
         resultsSection.classList.add('hidden');
+    } finally {
+        if (unsubscribe) unsubscribe();
     }
 };
 
@@ -4,6 +4,7 @@ const { app, BrowserWindow, ipcMain, dialog, shell, globalShortcut, session, pro
 const path = require("path");
 const url = require("url");
 const { spawn } = require("child_process");
+const { StringDecoder } = require("string_decoder");
 const fs = require("fs").promises;
 const fsSync = require("fs");
 const { autoUpdater } = require("electron-updater");
@@ -27,6 +28,8 @@ let settingsWindow;
 
 // ---------------- Paths ----------------
 const SETTINGS_PATH = path.join(app.getPath("userData"), "settings.json");
+// Файлы превью текущего сеанса: бэкенд пишет их сюда и возвращает пути вместо base64
+const THUMB_STORE_DIR = path.join(app.getPath("temp"), `pdf-extractor-thumbs-${process.pid}`);
 const RESOURCES_PATH = process.resourcesPath;
 
 const BACKEND_DIR = isProd
@@ -52,6 +55,7 @@ const PYTHON_EXECUTABLE_BACKEND_OCR = isProd
 
 
 const PYTHON_SCRIPT_PATH = isProd ? null : path.join(BACKEND_DIR, "process_pdfs.py"); // Этот путь для dev, и он останется прежним.
+const PYTHON_OCR_SCRIPT_PATH = isProd ? null : path.join(BACKEND_DIR, "process_pdfs_ocr.py");
 
 // ---------------- Settings Management ----------------
 const DEFAULT_SETTINGS = {
@@ -68,6 +72,11 @@ const DEFAULT_SETTINGS = {
   text_pos_x: 50,
   text_pos_y: 50,
   pdf_viewer_mode: "builtin",
+  // Кодирование превью: png | jpeg | webp; rgb | gray | mono | palette
+  thumb_format: "png",
+  thumb_colorspace: "rgb",
+  thumb_dpi: 150,
+  thumb_quality: 80,
 };
 
 
@@ -82,6 +91,18 @@ async function readSettings() {
   }
 }
 
+// Параметры кодирования превью из настроек (передаются бэкенду вместе с опциями)
+async function readThumbnailOptions() {
+  const settings = await readSettings();
+  return {
+    thumb_format: settings.thumb_format,
+    thumb_colorspace: settings.thumb_colorspace,
+    thumb_dpi: settings.thumb_dpi,
+    thumb_quality: settings.thumb_quality,
+    thumb_store: THUMB_STORE_DIR,
+  };
+}
+
 async function writeSettings(settings) {
   try {
     await fs.mkdir(path.dirname(SETTINGS_PATH), { recursive: true });
@@ -121,6 +142,24 @@ async function statIsFile(p) {
   }
 }
 
+/**
+ * Возвращает обработчик чанков stdout, вызывающий onLine для каждой полной непустой строки.
+ * Многобайтовые UTF-8 символы на границе чанков декодируются корректно.
+ */
+function createLineSplitter(onLine) {
+  const decoder = new StringDecoder("utf8");
+  let buffer = "";
+  return (chunk) => {
+    buffer += decoder.write(chunk);
+    let nl;
+    while ((nl = buffer.indexOf("\n")) >= 0) {
+      const line = buffer.slice(0, nl).trim();
+      buffer = buffer.slice(nl + 1);
+      if (line) onLine(line);
+    }
+  };
+}
+
 function isFilePath(p) {
   try {
     return !!p && typeof p === "string" && (p.startsWith("/") || /^[a-zA-Z]:[\\/]/.test(p));
@@ -194,15 +233,30 @@ ipcMain.handle("load-settings-translation", async (_event, lang) => {
 });
   
 // ---------------- Python Runner ----------------
+/**
+ * Формирует аргументы запуска бэкенда.
+ * В prod-режиме первым аргументом идет команда, т.к. сам .exe уже является программой.
+ * В dev-режиме первым аргументом идет путь к .py скрипту, затем команда.
+ * @param {string | undefined} scriptPath - Путь к .py скрипту (только в dev-режиме).
+ * @param {string} command - Команда бэкенда.
+ * @param {Array<string>} argsArray - Дополнительные аргументы.
+ * @returns {Array<string>}
+ */
+function buildBackendArgs(scriptPath, command, argsArray = []) {
+  return isProd ? [command, ...argsArray] : [scriptPath, command, ...argsArray];
+}
+
 /**
  * Запускает Python-скрипт или скомпилированный EXE-файл.
  * @param {string} command - Команда, передаваемая в Python-скрипт.
  * @param {Array<string>} argsArray - Дополнительные аргументы для Python-скрипта.
  * @param {object | null} stdinPayload - JSON-объект для передачи через stdin.
  * @param {boolean} useOCR - Флаг, указывающий, нужно ли использовать OCR-бэкенд.
+ * @param {function | null} onEvent - Для потокового вывода (NDJSON): вызывается для каждого события;
+ *   промис разрешается полем data итоговой строки {"type": "done"}.
  * @returns {Promise<any>} Промис, который разрешается с результатом работы Python-скрипта.
  */
-function runPythonScript(command, argsArray = [], stdinPayload = null, useOCR = false) {
+function runPythonScript(command, argsArray = [], stdinPayload = null, useOCR = false, onEvent = null) {
   return new Promise((resolve, reject) => {
     let executablePath; // Переменная для пути к исполняемому файлу (python.exe или .exe бэкенда)
     let scriptPath;     // Переменная для пути к .py скрипту (только в dev-режиме)
@@ -248,12 +302,7 @@ function runPythonScript(command, argsArray = [], stdinPayload = null, useOCR =
       cwdForPython = BACKEND_DIR;
     }
 
-    // Определяем аргументы для запуска процесса.
-    // В prod-режиме первым аргументом идет команда, т.к. сам .exe уже является программой.
-    // В dev-режиме первым аргументом идет путь к .py скрипту, затем команда.
-    const args = isProd
-      ? [command, ...argsArray]
-      : [scriptPath, command, ...argsArray];
+    const args = buildBackendArgs(scriptPath, command, argsArray);
 
     // Запускаем дочерний процесс Python (или PyInstaller EXE)
     const py = spawn(executablePath, args, {
@@ -263,8 +312,26 @@ function runPythonScript(command, argsArray = [], stdinPayload = null, useOCR =
     });
 
     let stdout = "", stderr = "";
+    // В потоковом режиме строки разбираются по мере поступления и не накапливаются.
+    // Строка без поля type (например, от бэкенда без поддержки stream) считается итоговой.
+    let streamResult = null;
+    const onStdoutLine = onEvent && createLineSplitter((line) => {
+      let msg;
+      try {
+        msg = JSON.parse(line);
+      } catch {
+        console.error(`[python:${command}] invalid JSON line:`, line.slice(0, 200));
+        return;
+      }
+      if (msg && msg.type && msg.type !== "done") onEvent(msg);
+      else streamResult = msg;
+    });
+
     // Собираем весь вывод из stdout и stderr
-    py.stdout.on("data", (d) => { stdout += d.toString("utf8"); });
+    py.stdout.on("data", (d) => {
+      if (onStdoutLine) onStdoutLine(d);
+      else stdout += d.toString("utf8");
+    });
     py.stderr.on("data", (d) => { stderr += d.toString("utf8"); });
 
     // Обработка завершения дочернего процесса
@@ -274,6 +341,11 @@ function runPythonScript(command, argsArray = [], stdinPayload = null, useOCR =
         console.error(`[python:${command}]`, stderr);
         return reject(new Error(stderr.trim() || `Python exited with code ${code}`));
       }
+      if (onStdoutLine) {
+        if (!streamResult) return reject(new Error(`No result from python (${command})`));
+        if (streamResult.error) return reject(new Error(streamResult.message || "Python error"));
+        return resolve(streamResult.data ?? streamResult);
+      }
       // Если все успешно, парсим вывод
       const out = stdout.trim();
       // Проверяем, является ли вывод просто путем к файлу
@@ -302,9 +374,128 @@ function runPythonScript(command, argsArray = [], stdinPayload = null, useOCR =
   });
 }
 
+// ---------------- Resident Backend Worker ----------------
+/**
+ * Долгоживущий процесс process_pdfs (команда "serve").
+ * Запросы и ответы — JSON по одной строке, сопоставляются по id.
+ * Это убирает повторные затраты на распаковку PyInstaller и импорт PyMuPDF при каждом клике.
+ */
+class ResidentBackend {
+  /**
+   * @param {string} executable - Интерпретатор Python (dev) или EXE бэкенда (prod).
+   * @param {string | null} scriptPath - .py скрипт в dev-режиме.
+   * @param {string} label - Метка для логов.
+   */
+  constructor(executable = PYTHON_EXECUTABLE_PROCESS_PDFS, scriptPath = PYTHON_SCRIPT_PATH, label = "python:serve") {
+    this.executable = executable;
+    this.scriptPath = scriptPath;
+    this.label = label;
+    this.proc = null;
+    this.seq = 0;
+    this.pending = new Map();
+  }
+
+  start() {
+    const cwd = isProd ? path.dirname(this.executable) : BACKEND_DIR;
+    if (isProd && !fsSync.existsSync(this.executable)) {
+      throw new Error(`Required executable not found: ${this.executable}`);
+    }
+
+    const proc = spawn(this.executable, buildBackendArgs(this.scriptPath, "serve"), {
+      windowsHide: true,
+      stdio: ["pipe", "pipe", "pipe"],
+      cwd,
+    });
+
+    proc.stdin.on("error", () => {}); // EPIPE при падении процесса обрабатывается в onExit
+    proc.stdout.on("data", createLineSplitter((line) => this.onLine(line)));
+    proc.stderr.on("data", (d) => console.log(`[${this.label}] ${d.toString("utf8").trim()}`));
+    proc.on("error", (err) => this.onExit(err));
+    proc.on("close", (code) => this.onExit(new Error(`Backend worker exited with code ${code}`)));
+
+    this.proc = proc;
+  }
+
+  onLine(line) {
+    let msg;
+    try {
+      msg = JSON.parse(line);
+    } catch {
+      console.error(`[${this.label}] invalid JSON line:`, line.slice(0, 200));
+      return;
+    }
+
+    const entry = this.pending.get(msg.id);
+    if (!entry) return;
+    if (msg.event) {
+      if (entry.onEvent) entry.onEvent(msg.event);
+      return;
+    }
+    this.pending.delete(msg.id);
+    if (msg.error) entry.reject(new Error(msg.message || "Python error"));
+    else entry.resolve(msg.data);
+  }
+
+  onExit(err) {
+    if (!this.proc) return;
+    this.proc = null;
+    for (const { reject } of this.pending.values()) reject(err);
+    this.pending.clear();
+  }
+
+  /**
+   * Отправляет запрос резидентному процессу, при необходимости запуская его.
+   * @param {string} command - "analyze" | "export" | "render" | "ping" | "shutdown"
+   * @param {object} body - Поля запроса (options/files для analyze, payload для export).
+   * @param {function | null} onEvent - Обработчик промежуточных событий (options.stream).
+   * @returns {Promise<any>} Поле data ответа.
+   */
+  request(command, body = {}, onEvent = null) {
+    return new Promise((resolve, reject) => {
+      try {
+        if (!this.proc) this.start();
+        const id = ++this.seq;
+        this.pending.set(id, { resolve, reject, onEvent });
+        this.proc.stdin.write(JSON.stringify({ id, command, ...body }) + "\n");
+      } catch (err) {
+        reject(err);
+      }
+    });
+  }
+
+  stop() {
+    if (!this.proc) return;
+    const proc = this.proc;
+    this.request("shutdown").catch(() => {});
+    try { proc.stdin.end(); } catch {}
+    setTimeout(() => { try { proc.kill(); } catch {} }, 2000).unref();
+  }
+}
+
+const residentBackend = new ResidentBackend();
+// Отдельный процесс для превью по запросу: serve() обрабатывает запросы по одному,
+// и рендер в общем процессе ждал бы конца потоковой пакетной обработки ("analyze")
+const residentRenderBackend = new ResidentBackend(PYTHON_EXECUTABLE_PROCESS_PDFS, PYTHON_SCRIPT_PATH, "python:render");
+// OCR-сервис: torch/EasyOCR и веса моделей загружаются один раз за сеанс
+const residentOcrBackend = new ResidentBackend(PYTHON_EXECUTABLE_BACKEND_OCR, PYTHON_OCR_SCRIPT_PATH, "python:ocr");
+
+/**
+ * Выполняет команду через резидентный процесс; при его сбое — через одноразовый запуск.
+ */
+async function runBackendCommand(command, argsArray, stdinPayload, residentBody, onEvent = null, useOCR = false) {
+  const backend = useOCR ? residentOcrBackend : command === "render" ? residentRenderBackend : residentBackend;
+  try {
+    return await backend.request(command, residentBody, onEvent);
+  } catch (err) {
+    if (!/Backend worker exited|not found|ENOENT/.test(err.message)) throw err;
+    console.warn(`[${backend.label}] falling back to one-shot process: ${err.message}`);
+    return runPythonScript(command, argsArray, stdinPayload, useOCR, onEvent);
+  }
+}
+
 // ---------------- IPC Handlers ----------------
 // --- Backend ---
-ipcMain.handle("run-analysis", async (_event, filePaths, options) => {
+ipcMain.handle("run-analysis", async (event, filePaths, options) => {
   try {
     if (!Array.isArray(filePaths) || filePaths.length === 0) throw new Error("No files provided.");
     if (filePaths.length > 200) throw new Error("Max 200 files at once.");
@@ -322,9 +513,19 @@ ipcMain.handle("run-analysis", async (_event, filePaths, options) => {
 
     if (absPaths.length === 0) throw new Error("No valid PDF files found.");
     options.app_version = app.getVersion();
+    Object.assign(options, { ...(await readThumbnailOptions()), ...options });
     // --- Новый код: передаём флаг OCR
     const useOCR = !!options.use_ocr;
-    const data = await runPythonScript("analyze", [JSON.stringify(options), ...absPaths], null, useOCR);
+    // При options.stream результаты по файлам сразу пересылаются в окно ("analysis-file"),
+    // а в ответе остаётся только сводка.
+    const onEvent = options.stream
+      ? (evt) => { if (!event.sender.isDestroyed()) event.sender.send("analysis-file", evt); }
+      : null;
+    // OCR-сервис не поддерживает потоковую выдачу: результат приходит одним ответом
+    const data = await runBackendCommand(
+      "analyze", [JSON.stringify(options), ...absPaths], null, { options, files: absPaths },
+      useOCR ? null : onEvent, useOCR
+    );
 
     return { success: true, data };
   } catch (error) {
@@ -344,7 +545,8 @@ ipcMain.handle("export-report", async (_event, payload) => {
       // Создаем объект options, если он вдруг отсутствует
       payload.options = { app_version: app.getVersion() };
       }    
-    const result = await runPythonScript("export", [], payload);
+    payload.options = { ...(await readThumbnailOptions()), ...payload.options };
+    const result = await runBackendCommand("export", [], payload, { payload });
     tempFile = result?.filePath;
     if (!tempFile || !fsSync.existsSync(tempFile)) throw new Error("No file returned by backend.");
 
@@ -375,6 +577,18 @@ ipcMain.handle("export-report", async (_event, payload) => {
   }
 });
 
+ipcMain.handle("render-thumbnails", async (_event, items) => {
+  try {
+    if (!Array.isArray(items)) throw new Error("Invalid thumbnail request.");
+    const options = await readThumbnailOptions();
+    const data = await runBackendCommand("render", [], { items, options }, { items, options });
+    return { success: true, data };
+  } catch (error) {
+    console.error("[render-thumbnails]", error);
+    return { success: false, error: error.message };
+  }
+});
+
 ipcMain.handle("get-app-version", () => app.getVersion());
 ipcMain.handle("get-app-name", () => app.getName());
 
@@ -656,6 +870,9 @@ function registerCustomProtocols() {
         ".mjs": "text/javascript",
         ".css": "text/css",
         ".json": "application/json",
+        ".png": "image/png",
+        ".jpg": "image/jpeg",
+        ".webp": "image/webp",
       };
       const ext = path.extname(finalPath).toLowerCase();
       const mimeType = mimeTypes[ext] || "application/octet-stream";
@@ -723,6 +940,17 @@ app.whenReady().then(async () => {
   applyProductionSettings();
 });
 
+app.on("will-quit", () => {
+  residentBackend.stop();
+  residentRenderBackend.stop();
+  residentOcrBackend.stop();
+  try {
+    fsSync.rmSync(THUMB_STORE_DIR, { recursive: true, force: true });
+  } catch (e) {
+    console.error("[thumbnails] failed to remove store:", e);
+  }
+});
+
 app.on("window-all-closed", () => {
   if (process.platform !== "darwin") app.quit();
 });
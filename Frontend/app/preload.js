@@ -65,7 +65,14 @@ if (!globalThis.__preloadInitialized__) {
         // --- Backend ---
         runAnalysis: (filePaths, options) =>
             safeInvoke("run-analysis", filePaths, options),
+        onAnalysisFile: (callback) => {
+            if (typeof callback !== "function") return () => {};
+            const handler = (_event, evt) => callback(evt);
+            ipcRenderer.on("analysis-file", handler);
+            return () => ipcRenderer.removeListener("analysis-file", handler);
+        },
         exportReport: (payload) => safeInvoke("export-report", payload),
+        renderThumbnails: (items) => safeInvoke("render-thumbnails", items),
 
         isOcrAvailable: () => safeInvoke("is-ocr-available"),
 
@@ -0,0 +1,138 @@
+import os
+import sys
+import json
+import hashlib
+import logging
+import tempfile
+from typing import List, Dict, Any, Optional, Callable
+
+logger = logging.getLogger(__name__)
+
+# Меняется при изменении формата результатов анализа — старые записи перестают совпадать
+CACHE_VERSION = 2
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+
+
+def default_cache_dir(name: str = "analysis_cache") -> str:
+    """Каталог кэша по умолчанию: %LOCALAPPDATA% в Windows, ~/.cache в остальных ОС."""
+    if sys.platform == "win32":
+        base = os.environ.get("LOCALAPPDATA") or os.path.expanduser("~")
+        return os.path.join(base, "PdfExtractor", name)
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(base, "pdf-extractor", name)
+
+
+def file_digest(path: str, chunk_size: int = 1024 * 1024) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class AnalysisCache:
+    """
+    Кэш результатов анализа на диске: одна JSON-запись на ключ
+    (хэш содержимого файла + значимые для результата опции).
+    Размер ограничен max_bytes; при превышении удаляются давно не использованные записи (LRU по mtime).
+    """
+
+    def __init__(self, cache_dir: Optional[str] = None, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.cache_dir = cache_dir or default_cache_dir()
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        # Объём записей: каталог обходится при первой записи и при превышении предела,
+        # в остальное время к нему прибавляются размеры новых записей
+        self._total_bytes: Optional[int] = None
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def key_for(self, file_path: str, result_options: Dict[str, Any]) -> Optional[str]:
+        """Ключ записи; None, если файл не читается (такие файлы не кэшируются)."""
+        try:
+            digest = file_digest(file_path)
+        except OSError:
+            return None
+        opts = json.dumps(result_options, sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(f"{CACHE_VERSION}|{digest}|{opts}".encode("utf-8")).hexdigest()
+
+    def _entry_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def get(self, key: str,
+            validate: Optional[Callable[[List[Dict[str, Any]]], bool]] = None) -> Optional[List[Dict[str, Any]]]:
+        """Запись по ключу; validate(items) == False (например, удалены файлы превью) считается промахом."""
+        path = self._entry_path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                items = json.load(f)
+            os.utime(path, None)  # отмечаем использование для LRU
+        except (OSError, ValueError):
+            self.misses += 1
+            return None
+        if validate is not None and not validate(items):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return items
+
+    def put(self, key: str, items: List[Dict[str, Any]]) -> None:
+        path = self._entry_path(key)
+        tmp_path = None
+        try:
+            fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(items, f, ensure_ascii=False)
+                size = f.tell()
+            # Перезапись записи: её прежний размер уходит из учтённого объёма
+            try:
+                size -= os.path.getsize(path)
+            except OSError:
+                pass
+            os.replace(tmp_path, path)
+        except (OSError, TypeError, ValueError) as e:
+            # TypeError/ValueError — результат не сериализуется в JSON; недописанный файл не оставляем
+            logger.warning(f"Failed to write analysis cache entry: {e}")
+            if tmp_path is not None:
+                try:
+                    os.remove(tmp_path)
+                except OSError:
+                    pass
+            return
+        if self._total_bytes is not None:
+            self._total_bytes += size
+            if self._total_bytes <= self.max_bytes:
+                return
+        self._total_bytes = self._evict()
+
+    def _evict(self) -> int:
+        """Удаляет давно не использованные записи сверх предела; возвращает оставшийся объём."""
+        entries = []
+        total = 0
+        for entry in os.scandir(self.cache_dir):
+            if not entry.name.endswith(".json"):
+                continue
+            try:
+                st = entry.stat()
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, entry.path))
+            total += st.st_size
+
+        if total <= self.max_bytes:
+            return total
+
+        # Удаляем самые старые записи с запасом, чтобы не чистить кэш на каждой записи
+        target = int(self.max_bytes * 0.9)
+        for _, size, path in sorted(entries):
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+        return total
+
+    def stats(self) -> Dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses}
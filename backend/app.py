@@ -17,7 +17,7 @@ except ImportError as e:
     print(f"Error: A required library is not installed. {e}\nPlease run 'pip install PyMuPDF fpdf2 Pillow'.", file=sys.stderr)
     sys.exit(1)
 
-from report_generator_pdf import generate_pdf_report
+from report_generator_pdf import write_pdf_report
 from report_generator_text import generate_txt_report, generate_csv_report
 
 logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
@@ -131,8 +131,11 @@ def main():
                 items_dict = all_items
 
             if file_format == "pdf":
-                content_bytes = generate_pdf_report(items_dict, options_dict)
-                suffix, mode, content = ".pdf", "wb", content_bytes
+                fd, path = tempfile.mkstemp(suffix=".pdf")
+                os.close(fd)
+                write_pdf_report(items_dict, options_dict, path)
+                print(path, flush=True)
+                return
             elif file_format == "txt":
                 content_text = generate_txt_report(items_dict, options_dict)
                 suffix, mode, content = ".txt", "w", content_text
@@ -20,6 +20,10 @@ if os.path.exists(torch_lib_dir):
             torch_binaries.append((os.path.join(torch_lib_dir, f), "torch/lib"))
 
 
+# Модели ONNX-движка (export_onnx_models.py); без каталога в сборке остаётся только EasyOCR
+onnx_data = [("onnx_models", "onnx_models")] if os.path.isdir("onnx_models") else []
+
+
 a = Analysis(
     ["process_pdfs_ocr.py"], 
     pathex=[os.path.abspath(".")],
@@ -27,7 +31,7 @@ a = Analysis(
     datas=[        
         ("easyocr_models/craft_mlt_25k.pth", "easyocr/model"),
         ("easyocr_models/english_g2.pth", "easyocr/model"),
-    ] + easyocr_data,
+    ] + easyocr_data + onnx_data,
     hiddenimports=[        
         "easyocr",
         "torch",           
@@ -39,6 +43,8 @@ a = Analysis(
         "win32ctypes.pywin32",        
         "report_generator_pdf",
         "report_generator_text",
+        "ocr_onnx",
+        "onnxruntime",
     ] + torch_hidden + easyocr_hidden,
     hookspath=[],
     hooksconfig={},
@@ -0,0 +1,438 @@
+# benchmark.py
+"""
+Замеры производительности на синтетических чертежах: генератор PDF (формат A4–A0, число листов,
+плотность номеров, повёрнутый текст, векторные и сканированные листы) и прогон анализа,
+OCR и экспорта в каждый формат с записью скорости (страниц/с, находок/с) и пикового RSS.
+
+    python benchmark.py generate out.pdf [--size A1] [--pages 4] [--tags 200] [--rotated 0.3] [--scanned 0.5]
+    python benchmark.py run [--cases a3_vector,a0_dense] [--quick] [--repeat 3] [--out results.json]
+                            [--baseline benchmark_baseline.json] [--save-baseline] [--tolerance 0.2]
+
+run пишет результаты в JSON (--out) и сравнивает их с базовым файлом (--baseline): рост времени
+или пикового RSS больше чем на --tolerance, а также изменение числа находок — регрессия
+(код возврата 1). --save-baseline записывает результаты как новый базовый файл.
+Каждый замер идёт в отдельном процессе, поэтому пиковый RSS относится только к нему; время —
+лучшее из --repeat прогонов. OCR замеряется, только если установлен движок (см. process_pdfs_ocr.py).
+"""
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import platform
+import tempfile
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Dict, Any, Optional, Iterator
+
+try:
+    import fitz  # PyMuPDF
+except ImportError as e:
+    print(f"Error: PyMuPDF is not installed. {e}\nPlease run 'pip install PyMuPDF'.", file=sys.stderr)
+    sys.exit(1)
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+logger = logging.getLogger(__name__)
+
+BENCH_VERSION = 1
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmark_baseline.json")
+DEFAULT_TOLERANCE = 0.2
+# Меньшие изменения — шум измерения, а не регрессия
+MIN_SECONDS_DELTA = 0.05
+MIN_RSS_DELTA_MB = 8.0
+
+PAGE_SIZES = ("A4", "A3", "A2", "A1", "A0")
+# DPI растра сканированных листов
+SCAN_DPI = 150
+EXPORT_FORMATS = ("txt", "csv", "pdf")
+
+# Сценарии run: параметры generate_drawing и замеры (analyze, ocr, export — все форматы)
+CASES: Dict[str, Dict[str, Any]] = {
+    "a4_text": {"size": "A4", "pages": 100, "tags": 20, "benches": ["analyze"]},
+    "a3_vector": {"size": "A3", "pages": 20, "tags": 80, "benches": ["analyze", "export"]},
+    "a1_rotated": {"size": "A1", "pages": 8, "tags": 300, "rotated": 0.5, "benches": ["analyze"]},
+    "a0_dense": {"size": "A0", "pages": 2, "tags": 2000, "benches": ["analyze", "export"]},
+    "a3_mixed": {"size": "A3", "pages": 10, "tags": 60, "scanned": 0.3, "benches": ["analyze", "ocr"]},
+    "a2_scanned": {"size": "A2", "pages": 4, "tags": 60, "scanned": 1.0, "benches": ["analyze", "ocr"]},
+}
+
+# -----------------------
+# Генератор чертежей
+# -----------------------
+
+def _draw_sheet(page: fitz.Page, rng: random.Random, tags: int, rotated: float, prefix: str,
+                title: str) -> int:
+    """Рамка, сетка, штамп, произвольная геометрия и номера; возвращает число номеров на листе."""
+    r = page.rect
+    margin = 20
+    frame = fitz.Rect(margin, margin, r.width - margin, r.height - margin)
+    shape = page.new_shape()
+    shape.draw_rect(frame)
+    step = 100
+    x = frame.x0 + step
+    while x < frame.x1:
+        shape.draw_line((x, frame.y0), (x, frame.y1))
+        x += step
+    y = frame.y0 + step
+    while y < frame.y1:
+        shape.draw_line((frame.x0, y), (frame.x1, y))
+        y += step
+    shape.finish(color=(0.8, 0.8, 0.8), width=0.3)
+    # геометрия чертежа: объём пропорционален площади листа
+    for _ in range(int(r.width * r.height / 20000)):
+        p = fitz.Point(rng.uniform(frame.x0, frame.x1), rng.uniform(frame.y0, frame.y1))
+        if rng.random() < 0.5:
+            shape.draw_line(p, p + (rng.uniform(-80, 80), rng.uniform(-80, 80)))
+        else:
+            shape.draw_circle(p, rng.uniform(2, 15))
+    shape.finish(color=(0, 0, 0), width=0.5)
+    shape.commit()
+
+    stamp = fitz.Rect(frame.x1 - 250, frame.y1 - 60, frame.x1, frame.y1)
+    page.draw_rect(stamp, color=(0, 0, 0), width=1)
+    page.insert_text(stamp.tl + (8, 20), title, fontsize=10)
+    page.insert_text(stamp.tl + (8, 40), "WALL SECTION / NOTE 12", fontsize=8)  # текст без номеров
+
+    # номера — в случайных ячейках сетки, без наложений
+    cell_w, cell_h = 70, 24
+    cols = int((frame.width - 260) // cell_w)
+    rows = int((frame.height - 80) // cell_h)
+    cells = rng.sample(range(cols * rows), min(tags, cols * rows))
+    for cell in cells:
+        cx = frame.x0 + 10 + (cell % cols) * cell_w
+        cy = frame.y0 + 20 + (cell // cols) * cell_h
+        label = f"{prefix}{rng.randint(1, 99999)}"
+        if rng.random() < rotated:
+            page.insert_text((cx + 12, cy - 12), label, fontsize=7, rotate=90)
+        else:
+            page.insert_text((cx, cy), label, fontsize=rng.choice((6, 7, 8, 10)))
+    return len(cells)
+
+
+def generate_drawing(path: str, size: str = "A3", pages: int = 10, tags: int = 50, rotated: float = 0.0,
+                     scanned: float = 0.0, prefix: str = "W", seed: int = 0) -> Dict[str, Any]:
+    """
+    Синтетический чертёж: pages листов формата size (альбомная ориентация) по tags номеров
+    (prefix + до 5 цифр) на лист; доля rotated номеров повёрнута на 90°, доля scanned листов —
+    растр SCAN_DPI без текстового слоя. Возвращает {"pages", "tags", "vector_tags", "scanned_pages"}:
+    vector_tags — сколько номеров должен найти анализ текстового слоя.
+    """
+    if size.upper() not in PAGE_SIZES:
+        raise ValueError(f"Unknown page size: {size} (expected one of {', '.join(PAGE_SIZES)})")
+    rng = random.Random(seed)
+    rect = fitz.paper_rect(f"{size.lower()}-l")
+    name = os.path.splitext(os.path.basename(path))[0]
+    stats = {"pages": pages, "tags": 0, "vector_tags": 0, "scanned_pages": 0}
+    scanned_pages = set(rng.sample(range(pages), round(pages * scanned)))
+    with fitz.open() as doc:
+        for pno in range(pages):
+            title = f"{name} SHEET {pno + 1}"
+            if pno not in scanned_pages:
+                count = _draw_sheet(doc.new_page(width=rect.width, height=rect.height), rng, tags, rotated,
+                                    prefix, title)
+                stats["vector_tags"] += count
+            else:
+                # лист рисуется во временном документе и вставляется картинкой
+                with fitz.open() as tmp:
+                    src = tmp.new_page(width=rect.width, height=rect.height)
+                    count = _draw_sheet(src, rng, tags, rotated, prefix, title)
+                    pix = src.get_pixmap(dpi=SCAN_DPI, colorspace=fitz.csGRAY)
+                page = doc.new_page(width=rect.width, height=rect.height)
+                page.insert_image(page.rect, stream=pix.tobytes("jpeg", jpg_quality=85))
+                stats["scanned_pages"] += 1
+            stats["tags"] += count
+        doc.save(path, garbage=3, deflate=True)
+    return stats
+
+# -----------------------
+# Замеры (каждый — в отдельном процессе)
+# -----------------------
+
+def _peak_rss_mb() -> float:
+    """Пиковый объём резидентной памяти текущего процесса, МБ."""
+    if sys.platform == "win32":
+        import ctypes
+        from ctypes import wintypes
+
+        class PROCESS_MEMORY_COUNTERS(ctypes.Structure):
+            _fields_ = [("cb", wintypes.DWORD), ("PageFaultCount", wintypes.DWORD)] + [
+                (f, ctypes.c_size_t) for f in ("PeakWorkingSetSize", "WorkingSetSize", "QuotaPeakPagedPoolUsage",
+                                               "QuotaPagedPoolUsage", "QuotaPeakNonPagedPoolUsage",
+                                               "QuotaNonPagedPoolUsage", "PagefileUsage", "PeakPagefileUsage")]
+
+        counters = PROCESS_MEMORY_COUNTERS()
+        counters.cb = ctypes.sizeof(counters)
+        kernel32 = ctypes.windll.kernel32
+        kernel32.GetCurrentProcess.restype = wintypes.HANDLE
+        ctypes.windll.psapi.GetProcessMemoryInfo(kernel32.GetCurrentProcess(), ctypes.byref(counters),
+                                                 counters.cb)
+        return counters.PeakWorkingSetSize / 2 ** 20
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 2 ** 20 if sys.platform == "darwin" else peak / 1024  # macOS — байты, Linux — КБ
+
+
+def _read_items(path: str) -> Iterator[Dict[str, Any]]:
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            yield json.loads(line)
+
+
+def _measure(bench: str, pdf_path: str, items_path: str, options: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Один замер в дочернем процессе: analyze (process_pdfs, без кэша), ocr (process_pdfs_ocr, без кэша OCR)
+    или export_<формат> (потоковый экспорт, как команда export, по находкам из items_path).
+    analyze сохраняет находки в items_path, если файла ещё нет.
+    """
+    logging.getLogger().setLevel(logging.WARNING)
+    pages = 0
+    if bench == "analyze":
+        import process_pdfs
+        opts = process_pdfs.AnalyzeOptions({"workers": 1, "use_cache": False, **options})
+        start = time.perf_counter()
+        items = process_pdfs.analyze_single_pdf(pdf_path, opts)
+        seconds = time.perf_counter() - start
+        pages = process_pdfs._page_count(pdf_path)
+        if not os.path.exists(items_path):
+            with open(items_path, "w", encoding="utf-8") as f:
+                for it in items:
+                    f.write(json.dumps(it, ensure_ascii=False) + "\n")
+        hits = len(items)
+    elif bench == "ocr":
+        try:
+            import process_pdfs_ocr
+            opts = process_pdfs_ocr.AnalyzeOptions({"ocr_cache": False, **options})
+            ocr = process_pdfs_ocr._engine_for(opts)  # загрузка моделей в замер не входит
+        except ImportError as e:
+            return {"skipped": f"OCR engine is not available: {e}. "
+                               f"Please run 'pip install -r requirements.txt'."}
+        start = time.perf_counter()
+        items = process_pdfs_ocr.analyze_single_pdf(pdf_path, opts, ocr)
+        seconds = time.perf_counter() - start
+        with fitz.open(pdf_path) as doc:
+            pages = len(doc)
+        hits = len(items)
+    elif bench.startswith("export_"):
+        import process_pdfs
+        hits = sum(1 for _ in _read_items(items_path))
+        payload = {"format": bench[len("export_"):], "options": {"workers": 1, **options}}
+        start = time.perf_counter()
+        out_path = process_pdfs._export_to_tempfile(payload, _read_items(items_path))
+        seconds = time.perf_counter() - start
+        os.remove(out_path)
+    else:
+        raise ValueError(f"Unknown benchmark: {bench}")
+
+    return {
+        "seconds": round(seconds, 4),
+        "pages": pages,
+        "hits": hits,
+        "pages_per_sec": round(pages / seconds, 2) if pages and seconds > 0 else None,
+        "hits_per_sec": round(hits / seconds, 2) if seconds > 0 else None,
+        "peak_rss_mb": round(_peak_rss_mb(), 1),
+    }
+
+
+def _run_isolated(bench: str, pdf_path: str, items_path: str, options: Dict[str, Any]) -> Dict[str, Any]:
+    ctx = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=1, mp_context=ctx) as pool:
+        return pool.submit(_measure, bench, pdf_path, items_path, options).result()
+
+
+def run_case(name: str, case: Dict[str, Any], work_dir: str, repeat: int = 3,
+             options: Optional[Dict[str, Any]] = None) -> Dict[str, Dict[str, Any]]:
+    """Генерирует чертёж сценария и выполняет его замеры; ключи результата — "<сценарий>/<замер>"."""
+    options = options or {}
+    pdf_path = os.path.join(work_dir, f"{name.upper()}_r01.pdf")
+    items_path = os.path.join(work_dir, f"{name}.items.jsonl")
+    gen = {k: v for k, v in case.items() if k != "benches"}
+    stats = generate_drawing(pdf_path, **gen)
+    logger.info(f"{name}: {stats['pages']} pages, {stats['tags']} tags, {stats['scanned_pages']} scanned")
+
+    benches: List[str] = []
+    for bench in case.get("benches", ["analyze"]):
+        benches += [f"export_{fmt}" for fmt in EXPORT_FORMATS] if bench == "export" else [bench]
+    if any(b.startswith("export_") for b in benches) and "analyze" not in benches:
+        benches.insert(0, "analyze")  # экспорт берёт находки анализа
+
+    results: Dict[str, Dict[str, Any]] = {}
+    for bench in benches:
+        runs = [_run_isolated(bench, pdf_path, items_path, options) for _ in range(max(1, repeat))]
+        if "skipped" in runs[0]:
+            logger.warning(f"{name}/{bench}: skipped ({runs[0]['skipped']})")
+            results[f"{name}/{bench}"] = runs[0]
+            continue
+        best = min(runs, key=lambda r: r["seconds"])
+        best["peak_rss_mb"] = max(r["peak_rss_mb"] for r in runs)
+        if bench == "analyze":
+            best["expected_hits"] = stats["vector_tags"]
+        elif bench == "ocr":
+            best["expected_hits"] = stats["tags"]
+        results[f"{name}/{bench}"] = best
+        if best.get("expected_hits", best["hits"]) != best["hits"]:
+            logger.warning(f"{name}/{bench}: found {best['hits']} of {best['expected_hits']} generated tags")
+        logger.info(f"{name}/{bench}: {best['seconds']:.3f} s, {best['hits']} hits, "
+                    f"{best['peak_rss_mb']} MB peak")
+    return results
+
+# -----------------------
+# Базовый файл и сравнение
+# -----------------------
+
+def machine_info() -> Dict[str, Any]:
+    return {
+        "platform": platform.platform(),
+        "python": platform.python_version(),
+        "cpu_count": os.cpu_count(),
+        "pymupdf": fitz.VersionBind,
+    }
+
+
+def compare(results: Dict[str, Dict[str, Any]], baseline: Dict[str, Dict[str, Any]],
+            tolerance: float = DEFAULT_TOLERANCE) -> List[Dict[str, Any]]:
+    """
+    Сравнение с базовыми результатами: строка на метрику (seconds, peak_rss_mb, hits) для замеров,
+    которые есть в обоих наборах. status — "regression" (время или RSS выросли больше чем на tolerance,
+    число находок изменилось), "improved" или "ok".
+    """
+    rows = []
+    for key in sorted(results):
+        cur, base = results[key], baseline.get(key)
+        if not base or "skipped" in cur or "skipped" in base:
+            continue
+        for metric, min_delta in (("seconds", MIN_SECONDS_DELTA), ("peak_rss_mb", MIN_RSS_DELTA_MB)):
+            old, new = base.get(metric), cur.get(metric)
+            if not old or new is None:
+                continue
+            change = (new - old) / old
+            status = "ok"
+            if change > tolerance and new - old > min_delta:
+                status = "regression"
+            elif change < -tolerance and old - new > min_delta:
+                status = "improved"
+            rows.append({"key": key, "metric": metric, "baseline": old, "current": new,
+                         "change": round(change, 4), "status": status})
+        if base.get("hits") != cur.get("hits"):
+            rows.append({"key": key, "metric": "hits", "baseline": base.get("hits"), "current": cur.get("hits"),
+                         "change": None, "status": "regression"})
+    return rows
+
+
+def _fmt(value: Optional[float]) -> str:
+    return "-" if value is None else str(value)
+
+
+def _print_report(results: Dict[str, Dict[str, Any]], rows: List[Dict[str, Any]]) -> None:
+    print(f"{'benchmark':<24} {'seconds':>9} {'pages/s':>9} {'hits/s':>10} {'peak MB':>8} {'hits':>6}")
+    for key, r in sorted(results.items()):
+        if "skipped" in r:
+            print(f"{key:<24} skipped: {r['skipped']}")
+            continue
+        print(f"{key:<24} {r['seconds']:>9.3f} {_fmt(r['pages_per_sec']):>9} {_fmt(r['hits_per_sec']):>10} "
+              f"{r['peak_rss_mb']:>8} {r['hits']:>6}")
+    flagged = [r for r in rows if r["status"] != "ok"]
+    if flagged:
+        print()
+        for r in flagged:
+            change = f"{r['change']:+.1%}" if r["change"] is not None else ""
+            print(f"{r['status'].upper():<11} {r['key']:<24} {r['metric']:<12} "
+                  f"{r['baseline']} -> {r['current']} {change}")
+
+
+def _load_json(path: str) -> Optional[Dict[str, Any]]:
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+# -----------------------
+# Точка входа
+# -----------------------
+
+def _cmd_generate(args: argparse.Namespace) -> int:
+    stats = generate_drawing(args.path, size=args.size, pages=args.pages, tags=args.tags, rotated=args.rotated,
+                             scanned=args.scanned, prefix=args.prefix, seed=args.seed)
+    print(json.dumps(stats))
+    return 0
+
+
+def _cmd_run(args: argparse.Namespace) -> int:
+    names = [n.strip() for n in args.cases.split(",") if n.strip()] if args.cases else list(CASES)
+    unknown = [n for n in names if n not in CASES]
+    if unknown:
+        raise ValueError(f"Unknown benchmark cases: {', '.join(unknown)} (available: {', '.join(CASES)})")
+
+    options = json.loads(args.options) if args.options else {}
+    work_dir = tempfile.mkdtemp(prefix="pdf_bench_")
+    results: Dict[str, Dict[str, Any]] = {}
+    try:
+        for name in names:
+            case = dict(CASES[name])
+            if args.quick:
+                case["pages"] = max(1, case["pages"] // 4)
+            results.update(run_case(name, case, work_dir, args.repeat, options))
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    report = {"version": BENCH_VERSION, "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+              "machine": machine_info(), "quick": args.quick, "repeat": args.repeat, "results": results}
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+
+    rows: List[Dict[str, Any]] = []
+    baseline = _load_json(args.baseline)
+    if baseline is not None and not args.save_baseline:
+        if baseline.get("machine") != report["machine"] or baseline.get("quick") != args.quick:
+            logger.warning("Baseline was recorded on a different machine or mode; comparison may be noisy")
+        rows = compare(results, baseline.get("results") or {}, args.tolerance)
+    _print_report(results, rows)
+
+    if args.save_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        logger.info(f"Baseline saved to {args.baseline}")
+        return 0
+    if baseline is None:
+        logger.info(f"No baseline at {args.baseline}; run with --save-baseline to create it")
+    return 1 if any(r["status"] == "regression" for r in rows) else 0
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Benchmarks on synthetic drawing PDFs")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    gen = sub.add_parser("generate", help="write a synthetic drawing PDF")
+    gen.add_argument("path")
+    gen.add_argument("--size", default="A3", choices=PAGE_SIZES + tuple(s.lower() for s in PAGE_SIZES))
+    gen.add_argument("--pages", type=int, default=10)
+    gen.add_argument("--tags", type=int, default=50, help="tag numbers per sheet")
+    gen.add_argument("--rotated", type=float, default=0.0, help="share of tags rotated by 90 degrees")
+    gen.add_argument("--scanned", type=float, default=0.0, help="share of sheets inserted as scans")
+    gen.add_argument("--prefix", default="W")
+    gen.add_argument("--seed", type=int, default=0)
+    gen.set_defaults(func=_cmd_generate)
+
+    run = sub.add_parser("run", help="run benchmark cases and compare with the baseline")
+    run.add_argument("--cases", default="", help=f"comma separated, default all: {','.join(CASES)}")
+    run.add_argument("--quick", action="store_true", help="a quarter of the pages in every case")
+    run.add_argument("--repeat", type=int, default=3, help="runs per benchmark, the fastest is kept")
+    run.add_argument("--options", default="", help="analyze/OCR/export options JSON")
+    run.add_argument("--out", default="", help="write results JSON here")
+    run.add_argument("--baseline", default=DEFAULT_BASELINE)
+    run.add_argument("--save-baseline", action="store_true", help="store results as the new baseline")
+    run.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE,
+                     help="allowed relative growth of time and peak RSS")
+    run.set_defaults(func=_cmd_run)
+
+    args = parser.parse_args()
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    multiprocessing.freeze_support()
+    sys.exit(main())
@@ -0,0 +1,192 @@
+# export_onnx_models.py
+"""
+Экспорт моделей EasyOCR (детектор CRAFT и распознаватель) в ONNX для движка ocr_onnx.py.
+Нужны torch, easyocr и onnx — только там, где модели экспортируются; ONNX-движку они не нужны.
+
+    python export_onnx_models.py --lang en [--out onnx_models] [--int8 [--calibration a.pdf b.pdf]]
+
+Результат в каталоге --out:
+    detector.onnx, recognizer_<языки>.onnx, recognizer_<языки>.json (алфавит модели)
+    detector.int8.onnx, recognizer_<языки>.int8.onnx — при --int8
+INT8: распознаватель (LSTM + линейные слои) квантуется динамически; детектор (только свёртки)
+квантуется статически по калибровочным страницам --calibration, без них остаётся в float32.
+"""
+import os
+import sys
+import json
+import argparse
+import inspect
+import logging
+from typing import List, Iterator, Dict
+
+import numpy as np
+import torch
+import easyocr
+
+import fitz  # PyMuPDF
+from PIL import Image
+
+from ocr_engine import get_model_path
+from ocr_onnx import (DETECTOR_NAME, INT8_SUFFIX, MODEL_HEIGHT, get_onnx_model_dir, recognizer_name,
+                      _resize_for_detector)
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+logger = logging.getLogger(__name__)
+
+OPSET = 13
+# Калибровка детектора: страницы растрируются на этом DPI и масштабируются как при распознавании
+# (холст 2560); на вход калибровки идут фрагменты CALIBRATION_TILE x CALIBRATION_TILE с наибольшим
+# разбросом яркости (больше всего текста и линий). Калибровка держит в памяти выходы всех слоёв
+# для всех фрагментов сразу (~0.4 ГБ на фрагмент 512x512), отсюда небольшие пределы
+CALIBRATION_DPI = 200
+CALIBRATION_CANVAS = 2560
+CALIBRATION_TILE = 512
+CALIBRATION_TILES_PER_PAGE = 1
+CALIBRATION_MAX_PAGES = 8
+
+# Новые версии torch по умолчанию экспортируют через dynamo (нужен onnxscript); модели EasyOCR
+# экспортируются классическим трассирующим экспортёром
+EXPORT_KWARGS = {"dynamo": False} if "dynamo" in inspect.signature(torch.onnx.export).parameters else {}
+
+
+class _MeanOverHeight(torch.nn.Module):
+    """Замена AdaptiveAvgPool2d((None, 1)): тот же результат, но экспортируется с переменной шириной входа."""
+
+    def forward(self, x: torch.Tensor) -> torch.Tensor:
+        return x.mean(dim=3, keepdim=True)
+
+
+class _Recognizer(torch.nn.Module):
+    """Распознаватель EasyOCR с одним входом (второй аргумент forward моделью не используется)."""
+
+    def __init__(self, model: torch.nn.Module):
+        super().__init__()
+        self.model = model
+        self.model.AdaptiveAvgPool = _MeanOverHeight()
+
+    def forward(self, image: torch.Tensor) -> torch.Tensor:
+        return self.model(image, None)
+
+
+def _max_diff(session_path: str, module: torch.nn.Module, x: torch.Tensor) -> float:
+    import onnxruntime as ort
+    session = ort.InferenceSession(session_path, providers=["CPUExecutionProvider"])
+    out = session.run(None, {session.get_inputs()[0].name: x.numpy()})[0]
+    module.eval()  # torch.onnx.export возвращает модулю прежний режим (train) вместе с вложенными слоями
+    with torch.no_grad():
+        ref = module(x)
+    ref = ref[0] if isinstance(ref, tuple) else ref
+    return float(np.abs(out - ref.numpy()).max())
+
+
+def export_detector(reader: "easyocr.Reader", path: str) -> None:
+    net = reader.detector.module if isinstance(reader.detector, torch.nn.DataParallel) else reader.detector
+    net = net.float().eval().cpu()
+    x = torch.rand(1, 3, 640, 480)
+    torch.onnx.export(net, x, path, opset_version=OPSET, do_constant_folding=True, **EXPORT_KWARGS,
+                      input_names=["image"], output_names=["score_maps", "feature"],
+                      dynamic_axes={"image": {0: "batch", 2: "height", 3: "width"},
+                                    "score_maps": {0: "batch", 1: "map_height", 2: "map_width"},
+                                    "feature": {0: "batch", 2: "map_height", 3: "map_width"}})
+    logger.info("Detector: %s (max diff vs torch %.2e)", path, _max_diff(path, net, torch.rand(2, 3, 320, 544)))
+
+
+def export_recognizer(reader: "easyocr.Reader", path: str) -> None:
+    net = reader.recognizer.module if isinstance(reader.recognizer, torch.nn.DataParallel) else reader.recognizer
+    model = _Recognizer(net.float().eval().cpu())
+    x = torch.rand(2, 1, MODEL_HEIGHT, 256) * 2 - 1
+    torch.onnx.export(model, x, path, opset_version=OPSET, do_constant_folding=True, **EXPORT_KWARGS,
+                      input_names=["image"], output_names=["logits"],
+                      dynamic_axes={"image": {0: "batch", 3: "width"}, "logits": {0: "batch", 1: "steps"}})
+    logger.info("Recognizer: %s (max diff vs torch %.2e)", path,
+                _max_diff(path, model, torch.rand(3, 1, MODEL_HEIGHT, 640) * 2 - 1))
+
+
+def _calibration_images(pdf_paths: List[str]) -> Iterator[np.ndarray]:
+    """Входы детектора для калибровки: фрагменты страниц PDF в масштабе распознавания."""
+    count = 0
+    for path in pdf_paths:
+        with fitz.open(path) as doc:
+            for page in doc:
+                if count >= CALIBRATION_MAX_PAGES:
+                    return
+                pix = page.get_pixmap(dpi=CALIBRATION_DPI, alpha=False)
+                img = np.array(Image.frombytes("RGB", (pix.width, pix.height), pix.samples))
+                canvas, _ = _resize_for_detector(img, CALIBRATION_CANVAS, 1.0)
+                del img, pix
+
+                size = CALIBRATION_TILE
+                tiles = [canvas[y:y + size, x:x + size]
+                         for y in range(0, max(canvas.shape[0] - size, 0) + 1, size)
+                         for x in range(0, max(canvas.shape[1] - size, 0) + 1, size)]
+                tiles.sort(key=lambda t: float(t.std()), reverse=True)
+                for tile in tiles[:CALIBRATION_TILES_PER_PAGE]:
+                    yield np.ascontiguousarray(tile.transpose(2, 0, 1)[None])
+                count += 1
+
+
+def quantize_detector(src: str, dst: str, calibration: List[str]) -> None:
+    from onnxruntime.quantization import (CalibrationDataReader, QuantFormat, QuantType,
+                                          quantize_static)
+    from onnxruntime.quantization.shape_inference import quant_pre_process
+
+    class _Reader(CalibrationDataReader):
+        def __init__(self):
+            self.images = _calibration_images(calibration)
+
+        def get_next(self) -> Dict[str, np.ndarray]:
+            img = next(self.images, None)
+            return None if img is None else {"image": img}
+
+    prepared = dst + ".prep.onnx"
+    quant_pre_process(src, prepared)
+    try:
+        quantize_static(prepared, dst, _Reader(), quant_format=QuantFormat.QDQ,
+                        activation_type=QuantType.QUInt8, weight_type=QuantType.QInt8, per_channel=True)
+    finally:
+        os.remove(prepared)
+    logger.info("Detector INT8: %s", dst)
+
+
+def quantize_recognizer(src: str, dst: str) -> None:
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+    quantize_dynamic(src, dst, weight_type=QuantType.QInt8, op_types_to_quantize=["MatMul", "Gemm", "LSTM"])
+    logger.info("Recognizer INT8: %s", dst)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Export EasyOCR models to ONNX for the ONNX OCR engine")
+    parser.add_argument("--lang", default="en", help="OCR languages, comma separated (en, en,ru, ...)")
+    parser.add_argument("--out", default=get_onnx_model_dir(), help="output directory")
+    parser.add_argument("--int8", action="store_true", help="also write INT8-quantized models")
+    parser.add_argument("--calibration", nargs="*", default=[], help="PDF files for detector INT8 calibration")
+    args = parser.parse_args()
+
+    lang_list = [p.strip() for p in args.lang.split(",") if p.strip()]
+    os.makedirs(args.out, exist_ok=True)
+    model_directory = get_model_path()
+    # quantize=False: на CPU EasyOCR иначе заменяет слои на квантованные torch, которые не экспортируются
+    reader = easyocr.Reader(lang_list, gpu=False, quantize=False,
+                            model_storage_directory=model_directory,
+                            user_network_directory=model_directory)
+
+    det_path = os.path.join(args.out, DETECTOR_NAME + ".onnx")
+    name = recognizer_name(lang_list)
+    rec_path = os.path.join(args.out, name + ".onnx")
+    export_detector(reader, det_path)
+    export_recognizer(reader, rec_path)
+    with open(os.path.join(args.out, name + ".json"), "w", encoding="utf-8") as f:
+        json.dump({"langs": lang_list, "characters": reader.character, "lang_chars": reader.lang_char},
+                  f, ensure_ascii=False)
+
+    if args.int8:
+        quantize_recognizer(rec_path, os.path.join(args.out, name + INT8_SUFFIX + ".onnx"))
+        if args.calibration:
+            quantize_detector(det_path, os.path.join(args.out, DETECTOR_NAME + INT8_SUFFIX + ".onnx"),
+                              args.calibration)
+        else:
+            logger.warning("No --calibration PDFs: detector is left in float32")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
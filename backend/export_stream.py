@@ -0,0 +1,225 @@
+import json
+import tempfile
+from typing import Any, Dict, Iterator, Iterable, Optional, TextIO, Tuple
+
+# Порция чтения stdin; значение длиннее порции (превью в base64) дочитывается удвоением окна
+READ_CHUNK = 1 << 20
+
+_decoder = json.JSONDecoder()
+
+
+class ExportPayloadError(ValueError):
+    """Некорректный JSON payload экспорта."""
+
+
+class _JsonReader:
+    """
+    Потоковый разбор JSON из текстового файла: структура (скобки, запятые, ключи) разбирается
+    посимвольно, отдельные значения — json.JSONDecoder.raw_decode. В памяти держится
+    только текущее значение, а не весь документ.
+    """
+
+    def __init__(self, fp: TextIO):
+        self.fp = fp
+        self.buf = ""
+        self.pos = 0
+        self.dropped = 0  # символов до начала буфера — для смещений в сообщениях об ошибках
+        self.eof = False
+
+    def _fill(self, size: int = READ_CHUNK) -> bool:
+        if self.eof:
+            return False
+        chunk = self.fp.read(size)
+        if not chunk:
+            self.eof = True
+            return False
+        self.dropped += self.pos
+        self.buf = self.buf[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self) -> str:
+        """Следующий значащий символ (без пробелов); "" — конец данных."""
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in " \t\r\n":
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self._fill():
+                return ""
+
+    def offset(self) -> int:
+        return self.dropped + self.pos
+
+    def take(self) -> str:
+        c = self.peek()
+        if not c:
+            raise ExportPayloadError("Unexpected end of JSON")
+        self.pos += 1
+        return c
+
+    def expect(self, char: str) -> None:
+        c = self.take()
+        if c != char:
+            raise ExportPayloadError(f"Invalid JSON: expected '{char}' at offset {self.offset() - 1}, got '{c}'")
+
+    def value(self) -> Any:
+        self.peek()
+        size = READ_CHUNK
+        while True:
+            try:
+                value, end = _decoder.raw_decode(self.buf, self.pos)
+            except json.JSONDecodeError as e:
+                if not self._fill(size):
+                    raise ExportPayloadError(f"{e.msg} at offset {self.dropped + e.pos}") from e
+                size *= 2
+                continue
+            # число в конце буфера может продолжаться в следующей порции
+            if end == len(self.buf) and not self.eof and self._fill(size):
+                continue
+            self.pos = end
+            return value
+
+    def members(self) -> Iterator[str]:
+        """Ключи объекта по порядку; значение каждого ключа читает вызывающий код."""
+        self.expect("{")
+        if self.peek() == "}":
+            self.pos += 1
+            return
+        while True:
+            key = self.value()
+            if not isinstance(key, str):
+                raise ExportPayloadError("Invalid JSON: object key must be a string")
+            self.expect(":")
+            yield key
+            c = self.take()
+            if c == "}":
+                return
+            if c != ",":
+                raise ExportPayloadError(f"Invalid JSON: expected ',' or '}}' at offset {self.offset() - 1}")
+
+
+def _iter_items(r: _JsonReader) -> Iterator[Dict[str, Any]]:
+    """
+    Элементы массива items: плоский список или группы {filePath, items: [...]} (как строит фронтенд);
+    вложенный items группы тоже читается потоково.
+    """
+    r.expect("[")
+    if r.peek() == "]":
+        r.pos += 1
+        return
+    while True:
+        if r.peek() == "{":
+            # Элемент целиком в буфере (обычно — один найденный номер) разбирается за один вызов
+            try:
+                value, end = _decoder.raw_decode(r.buf, r.pos)
+            except json.JSONDecodeError:
+                value = None
+            if value is not None:
+                r.pos = end
+                yield from _flatten(value)
+            else:
+                yield from _iter_object(r)
+        else:
+            r.value()  # не объект — пропускаем
+        c = r.take()
+        if c == "]":
+            return
+        if c != ",":
+            raise ExportPayloadError(f"Invalid JSON: expected ',' or ']' at offset {r.offset() - 1}")
+
+
+def _flatten(value: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+    items = value.get("items")
+    if not isinstance(items, list):
+        yield value
+        return
+    for item in items:
+        if isinstance(item, dict):
+            yield from _flatten(item)
+
+
+def _iter_object(r: _JsonReader) -> Iterator[Dict[str, Any]]:
+    """Элемент, не поместившийся в буфер (группа файла с превью), — по ключам."""
+    item: Dict[str, Any] = {}
+    group = False
+    for key in r.members():
+        if key == "items" and r.peek() == "[":
+            group = True
+            yield from _iter_items(r)
+        else:
+            item[key] = r.value()
+    if not group:
+        yield item
+
+
+def _spool(items: Iterable[Dict[str, Any]]) -> Iterator[Dict[str, Any]]:
+    """Элементы во временном файле (строка JSON на элемент) — если items пришли раньше опций."""
+    spool = tempfile.TemporaryFile("w+", encoding="utf-8")
+    for item in items:
+        spool.write(json.dumps(item, ensure_ascii=False))
+        spool.write("\n")
+
+    def _replay() -> Iterator[Dict[str, Any]]:
+        with spool:
+            spool.seek(0)
+            for line in spool:
+                yield json.loads(line)
+
+    return _replay()
+
+
+def normalize_item(it: Dict[str, Any]) -> Dict[str, Any]:
+    """Элемент экспорта в унифицированном виде, ожидаемом генераторами отчётов."""
+    sf = it.get("sourceFile") or {}
+    src = {
+        "name": (sf.get("name") if isinstance(sf, dict) else None) or it.get("fileName") or "",
+        "path": (sf.get("path") if isinstance(sf, dict) else None) or it.get("filePath") or "",
+    }
+    b64 = it.get("image_png_b64") or it.get("dataUrl") or ""
+    image_path = it.get("image_path") or ""
+    grid = it.get("grid") or it.get("gridCoord") or ""
+    return {
+        "text": it.get("text", ""),
+        "composite_number": it.get("composite_number") or it.get("text", ""),
+        "page": it.get("page"),
+        "grid": grid,
+        "image_png_b64": b64,
+        "image_path": image_path,
+        "revision": it.get("revision"),
+        "comment": it.get("comment", ""),
+        "sourceFile": src,
+        "clip": it.get("clip"),
+    }
+
+
+def read_export_payload(fp: TextIO) -> Tuple[Dict[str, Any], Optional[Iterator[Dict[str, Any]]]]:
+    """
+    Потоковое чтение payload экспорта {format, options, items} из fp (stdin).
+    Возвращает (payload без items, итератор плоских элементов или None, если массива items нет):
+    элементы читаются по одному по мере записи отчёта. Если items стоят в JSON раньше
+    format/options, они сначала переписываются во временный файл, а не копятся в памяти.
+    """
+    r = _JsonReader(fp)
+    if not r.peek():
+        return {}, None
+    payload: Dict[str, Any] = {}
+    members = r.members()
+    spooled: Optional[Iterator[Dict[str, Any]]] = None
+    for key in members:
+        if key != "items":
+            payload[key] = r.value()
+        elif r.peek() != "[":
+            r.value()
+        elif "format" in payload and "options" in payload:
+            return payload, _stream_rest(r, members)
+        else:
+            spooled = _spool(_iter_items(r))
+    return payload, spooled
+
+
+def _stream_rest(r: _JsonReader, members: Iterator[str]) -> Iterator[Dict[str, Any]]:
+    yield from _iter_items(r)
+    for _ in members:  # ключи после items: значения уже не нужны, но JSON дочитывается и проверяется
+        r.value()
+
@@ -20,7 +20,7 @@ except ImportError as e:
     sys.exit(1)
 
 # --- Импорт генераторов отчётов ---
-from report_generator_pdf import generate_pdf_report
+from report_generator_pdf import write_pdf_report
 from report_generator_text import generate_txt_report, generate_csv_report
 
 # -----------------------
@@ -199,8 +199,11 @@ def main():
                 items_dict = all_items
 
             if file_format == "pdf":
-                content = generate_pdf_report(items_dict, options_dict)
-                suffix, mode = ".pdf", "wb"
+                fd, path = tempfile.mkstemp(suffix=".pdf")
+                os.close(fd)
+                write_pdf_report(items_dict, options_dict, path)
+                print(path, flush=True)
+                return
             elif file_format == "txt":
                 content = generate_txt_report(items_dict, options_dict)
                 suffix, mode = ".txt", "w"
@@ -0,0 +1,29 @@
+import hashlib
+from typing import Dict, Any, Optional
+
+from analysis_cache import AnalysisCache, default_cache_dir
+
+# Меняется при изменении формата записей OCR — старые записи перестают совпадать
+OCR_CACHE_VERSION = 1
+DEFAULT_OCR_MAX_BYTES = 256 * 1024 * 1024
+
+
+class OCRCache(AnalysisCache):
+    """
+    Кэш результатов OCR на диске. Ключ — отпечаток изображения (исходные потоки картинок
+    страницы-скана или пиксели растра, см. ocr_engine.scan_fingerprint / image_fingerprint),
+    движок с языками и версией моделей и вид результата (ocr | detect | recognize).
+    Хранение, атомарная запись и LRU-вытеснение — как у AnalysisCache.
+    """
+
+    def __init__(self, cache_dir: Optional[str] = None, max_bytes: int = DEFAULT_OCR_MAX_BYTES):
+        super().__init__(cache_dir or default_cache_dir("ocr_cache"), max_bytes)
+
+    @staticmethod
+    def key(engine_id: str, kind: str, fingerprint: str) -> str:
+        return hashlib.sha256(f"{OCR_CACHE_VERSION}|{engine_id}|{kind}|{fingerprint}".encode("utf-8")).hexdigest()
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses,
+                "hit_rate": round(self.hits / total, 4) if total else 0.0}
@@ -2,9 +2,29 @@
 import numpy as np
 from PIL import Image
 import fitz  # PyMuPDF
-import easyocr
 import sys
 import os
+import time
+import math
+import hashlib
+import logging
+import bisect
+from typing import List, Dict, Any, Tuple, Iterator, Union, Optional, Callable, Protocol
+
+from ocr_cache import OCRCache
+
+logger = logging.getLogger(__name__)
+
+# Размер пачки распознавателя по умолчанию (строк текста за один прогон сети)
+DEFAULT_BATCH_SIZE = 8
+# Сколько областей склеивается в одну мозаику для recognize_regions
+REGIONS_PER_MOSAIC = 256
+MOSAIC_GAP = 8
+# Тайловый растр (см. iter_page_tiles): сторона тайла и перекрытие соседних тайлов, в пикселях
+DEFAULT_TILE_PX = 4096
+DEFAULT_TILE_OVERLAP_PX = 512
+# Области встроенных картинок (см. image_regions): картинки ближе этого (в пунктах) объединяются
+IMAGE_JOIN_PT = 2.0
 
 # --- Функция для определения пути к моделям ---
 def get_model_path():
@@ -21,39 +41,475 @@ def get_model_path():
         return None
 
 
+# --- Читатели OCR (подключаемые движки) ---
+class OCRReader(Protocol):
+    """
+    Интерфейс движка, с которым работает NeuralOCREngine (подмножество easyocr.Reader).
+    img — массив RGB (HxWx3), grey — в оттенках серого (HxW); рамки — в пикселях изображения.
+    version — версия движка и его моделей (входит в ключ кэша OCR).
+    """
+    version: str
+
+    def readtext(self, img: Any, batch_size: int = 1) -> List[Tuple[Any, str, float]]: ...
+
+    def readtext_batched(self, images: List[Any], batch_size: int = 1) -> List[List[Tuple[Any, str, float]]]: ...
+
+    def detect(self, img: Any) -> Tuple[List[List[Any]], List[List[Any]]]: ...
+
+    def recognize(self, grey: Any, horizontal_list: Optional[List[Any]] = None,
+                  free_list: Optional[List[Any]] = None, batch_size: int = 1) -> List[Tuple[Any, str, float]]: ...
+
+
+def _easyocr_reader(lang_list: List[str]) -> OCRReader:
+    import easyocr  # torch загружается только для этого движка
+
+    model_directory = get_model_path()
+    # Явно указываем путь к моделям
+    reader = easyocr.Reader(
+        lang_list,
+        model_storage_directory=model_directory,
+        user_network_directory=model_directory
+    )
+    # веса моделей EasyOCR фиксированы для версии пакета
+    reader.version = f"easyocr-{getattr(easyocr, '__version__', '')}"
+    return reader
+
+
+def _onnx_reader(lang_list: List[str], model_dir: Optional[str] = None, int8: bool = False,
+                 intra_threads: int = 0, inter_threads: int = 0) -> OCRReader:
+    from ocr_onnx import OnnxOCRReader
+
+    return OnnxOCRReader(lang_list, model_dir=model_dir, int8=int8,
+                         intra_threads=intra_threads, inter_threads=inter_threads)
+
+
+# Движки по имени: фабрика (языки, параметры движка) -> читатель
+READER_FACTORIES: Dict[str, Callable[..., OCRReader]] = {
+    "easyocr": _easyocr_reader,
+    "onnx": _onnx_reader,
+}
+
+
 # --- OCR движок ---
 class NeuralOCREngine:
-    def __init__(self, lang="en"):
+    def __init__(self, lang="en", engine: str = "easyocr", **engine_options):
         """
         lang: язык OCR (например 'en', 'ru', 'et')
+        engine: движок из READER_FACTORIES ('easyocr' — torch, 'onnx' — ONNX Runtime)
+        engine_options: параметры движка (для 'onnx': model_dir, int8, intra_threads, inter_threads)
         """
-        model_directory = get_model_path()
         lang_list = [lang] if isinstance(lang, str) else list(lang)
+        factory = READER_FACTORIES.get(engine)
+        if factory is None:
+            raise ValueError(f"Unknown OCR engine: {engine}")
+        self.engine = engine
+        self.reader: OCRReader = factory(lang_list, **engine_options)
+        # Кэш результатов на диске (см. ocr_cache.py); задаётся вызывающим на время анализа
+        self.cache: Optional[OCRCache] = None
+        self.cache_id = f"{engine}|{','.join(lang_list)}|{getattr(self.reader, 'version', '')}"
+        # Накопительная статистика производительности (см. stats())
+        self.images_done = 0
+        self.seconds_spent = 0.0
+        self.last_stats: Dict[str, Any] = {}
 
-        # Явно указываем путь к моделям
-        self.reader = easyocr.Reader(
-            lang_list,
-            model_storage_directory=model_directory,
-            user_network_directory=model_directory
-        )
-
-    def ocr_image(self, img: Image.Image):
-        """
-        Запускает OCR на изображении (PIL.Image).
-        Возвращает список блоков с text/confidence/bbox.
-        """
-        np_img = np.array(img.convert("RGB"))
-        results = self.reader.readtext(np_img)
-
+    @staticmethod
+    def _to_blocks(results) -> List[Dict[str, Any]]:
         out = []
         for box, text, conf in results:
             out.append({
                 "text": text,
                 "confidence": float(conf),
-                "bbox": box
+                # числа numpy -> Python: блоки сериализуются в JSON (кэш, ответы)
+                "bbox": [[_plain(v) for v in p] for p in box]
             })
         return out
 
+    # --- Кэш ---
+    def _cache_key(self, kind: str, fingerprint: Optional[str]) -> Optional[str]:
+        if self.cache is None or not fingerprint:
+            return None
+        return self.cache.key(self.cache_id, kind, fingerprint)
+
+    def _cache_get(self, key: Optional[str]) -> Optional[List[Any]]:
+        return None if key is None else self.cache.get(key)
+
+    def _cache_put(self, key: Optional[str], value: List[Any]) -> None:
+        if key is not None:
+            self.cache.put(key, value)
+
+    def cached_blocks(self, fingerprint: Optional[str]) -> Optional[List[Dict[str, Any]]]:
+        """
+        Блоки из кэша для изображения с отпечатком fingerprint (см. scan_fingerprint) или None.
+        Позволяет не растрировать страницу, результат которой уже есть в кэше.
+        """
+        return self._cache_get(self._cache_key("ocr", fingerprint))
+
+    def ocr_image(self, img: Image.Image, batch_size: int = DEFAULT_BATCH_SIZE):
+        """
+        Запускает OCR на изображении (PIL.Image).
+        Возвращает список блоков с text/confidence/bbox.
+        """
+        return self.ocr_images([img], batch_size=batch_size)[0]
+
+    def ocr_images(self, images: List[Image.Image], batch_size: int = DEFAULT_BATCH_SIZE,
+                   fingerprints: Optional[List[Optional[str]]] = None) -> List[List[Dict[str, Any]]]:
+        """
+        Пакетный OCR: возвращает блоки для каждого изображения в том же порядке.
+        Изображения одного размера (страницы скана при одинаковом DPI) проходят детектор
+        одной пачкой через readtext_batched; распознавание строк идёт пачками по batch_size.
+        При заданном кэше изображения с готовым результатом (по пикселям) сеть не проходят.
+        fingerprints — отпечатки изображений (см. scan_fingerprint), под которыми результат
+        сохраняется вместо пикселей; искать по ним нужно до растрирования — cached_blocks.
+        """
+        start = time.perf_counter()
+        out: List[List[Dict[str, Any]]] = [[] for _ in images]
+
+        keys: List[Optional[str]] = [None] * len(images)
+        by_size: Dict[Tuple[int, int], List[int]] = {}
+        for i, img in enumerate(images):
+            if self.cache is not None:
+                fingerprint = fingerprints[i] if fingerprints else None
+                if fingerprint:
+                    keys[i] = self._cache_key("ocr", fingerprint)
+                else:
+                    keys[i] = self._cache_key("ocr", image_fingerprint(img))
+                    cached = self._cache_get(keys[i])
+                    if cached is not None:
+                        out[i] = cached
+                        continue
+            by_size.setdefault(img.size, []).append(i)
+        if not by_size:
+            return out
+
+        for indices in by_size.values():
+            arrays = [_rgb_array(images[i]) for i in indices]
+            if len(arrays) > 1:
+                batched = self.reader.readtext_batched(arrays, batch_size=batch_size)
+            else:
+                batched = [self.reader.readtext(arrays[0], batch_size=batch_size)]
+            for i, results in zip(indices, batched):
+                out[i] = self._to_blocks(results)
+                self._cache_put(keys[i], out[i])
+
+        self._record(sum(len(v) for v in by_size.values()), time.perf_counter() - start, batch_size)
+        return out
+
+    def ocr_page_tiled(self, source: Union[fitz.Page, fitz.DisplayList], dpi: int,
+                       tile_px: int = DEFAULT_TILE_PX, overlap_px: int = DEFAULT_TILE_OVERLAP_PX,
+                       batch_size: int = DEFAULT_BATCH_SIZE,
+                       clip: Optional[fitz.Rect] = None,
+                       fingerprint: Optional[str] = None) -> List[Dict[str, Any]]:
+        """
+        OCR страницы (или её области clip, в пунктах PDF) по тайлам: в памяти одновременно только
+        один тайл, поэтому пиковый расход не зависит от размера листа. bbox блоков — в пикселях
+        полного растра страницы (области) на dpi. Дубликаты из зон перекрытия объединяются
+        (см. _merge_tile_blocks).
+        При заданном кэше тайлы с готовым результатом (по пикселям) сеть не проходят.
+        fingerprint — отпечаток страницы с учётом dpi и сетки тайлов, под которым сохраняется
+        итог; поиск по нему (без рендера тайлов) — cached_blocks.
+        """
+        page_key = self._cache_key("ocr", fingerprint)
+
+        start = time.perf_counter()
+        collected: List[Tuple[Dict[str, Any], fitz.IRect]] = []
+        tiles: List[fitz.IRect] = []
+        inferred = 0
+        for img, tile in iter_page_tiles(source, dpi, tile_px, overlap_px, clip):
+            key = self._cache_key("ocr", image_fingerprint(img) if self.cache is not None else None)
+            blocks = self._cache_get(key)
+            if blocks is None:
+                blocks = self._to_blocks(self.reader.readtext(_rgb_array(img), batch_size=batch_size))
+                self._cache_put(key, blocks)
+                inferred += 1
+            del img
+            tiles.append(tile)
+            for block in blocks:
+                block["bbox"] = [[p[0] + tile.x0, p[1] + tile.y0] for p in block["bbox"]]
+                collected.append((block, tile))
+
+        if inferred:
+            self._record(1, time.perf_counter() - start, batch_size)
+        merged = _merge_tile_blocks(collected, tiles)
+        self._cache_put(page_key, merged)
+        return merged
+
+    def detect_boxes(self, img: Image.Image) -> List[Tuple[float, float, float, float]]:
+        """
+        Только детектор (первый проход двухпроходного OCR): прямоугольники строк текста
+        (x0, y0, x1, y1) в пикселях img. Наклонные строки приводятся к охватывающему прямоугольнику.
+        """
+        key = self._cache_key("detect", image_fingerprint(img) if self.cache is not None else None)
+        cached = self._cache_get(key)
+        if cached is not None:
+            return [tuple(b) for b in cached]
+
+        start = time.perf_counter()
+        horizontal, free = self.reader.detect(np.array(img.convert("RGB")))
+        boxes = [(float(b[0]), float(b[2]), float(b[1]), float(b[3])) for b in horizontal[0]]
+        for poly in free[0]:
+            xs = [p[0] for p in poly]
+            ys = [p[1] for p in poly]
+            boxes.append((float(min(xs)), float(min(ys)), float(max(xs)), float(max(ys))))
+        self._record(1, time.perf_counter() - start, 0)
+        self._cache_put(key, boxes)
+        return boxes
+
+    def recognize_regions(self, images: List[Image.Image],
+                          batch_size: int = DEFAULT_BATCH_SIZE) -> List[List[Dict[str, Any]]]:
+        """
+        Только распознаватель (второй проход): каждое изображение — одна область-кандидат.
+        Области склеиваются в вертикальную мозаику, и распознаватель получает их одним
+        вызовом пачками по batch_size. bbox в результатах — в координатах своей области.
+        При заданном кэше области с готовым результатом (по пикселям) в мозаику не попадают.
+        """
+        start = time.perf_counter()
+        out: List[List[Dict[str, Any]]] = [[] for _ in images]
+
+        keys: List[Optional[str]] = [None] * len(images)
+        todo: List[int] = []
+        for i, img in enumerate(images):
+            keys[i] = self._cache_key("recognize", image_fingerprint(img) if self.cache is not None else None)
+            cached = self._cache_get(keys[i])
+            if cached is None:
+                todo.append(i)
+            else:
+                out[i] = cached
+        if not todo:
+            return out
+
+        for first in range(0, len(todo), REGIONS_PER_MOSAIC):
+            indices = todo[first:first + REGIONS_PER_MOSAIC]
+            chunk = [images[i].convert("L") for i in indices]
+            offsets: List[int] = []
+            height = 0
+            for img in chunk:
+                offsets.append(height)
+                height += img.height + MOSAIC_GAP
+            mosaic = Image.new("L", (max(img.width for img in chunk), height), 255)
+            for img, y in zip(chunk, offsets):
+                mosaic.paste(img, (0, y))
+
+            horizontal = [[0, img.width, y, y + img.height] for img, y in zip(chunk, offsets)]
+            results = self.reader.recognize(np.array(mosaic), horizontal_list=horizontal,
+                                            free_list=[], batch_size=batch_size)
+            for box, text, conf in results:
+                cy = sum(p[1] for p in box) / len(box)
+                k = max(0, bisect.bisect_right(offsets, cy) - 1)
+                y = offsets[k]
+                out[indices[k]].append({
+                    "text": text,
+                    "confidence": float(conf),
+                    "bbox": [[_plain(p[0]), _plain(p[1] - y)] for p in box],
+                })
+
+        for i in todo:
+            self._cache_put(keys[i], out[i])
+        elapsed = time.perf_counter() - start
+        self.seconds_spent += elapsed
+        logger.info("OCR: %d region(s) recognized in %.2fs (batch_size=%d)", len(todo), elapsed, batch_size)
+        return out
+
+    def _record(self, images: int, elapsed: float, batch_size: int) -> None:
+        self.images_done += images
+        self.seconds_spent += elapsed
+        self.last_stats = {
+            "images": images,
+            "batch_size": batch_size,
+            "seconds": round(elapsed, 3),
+            "pages_per_sec": round(images / elapsed, 3) if elapsed > 0 else 0.0,
+        }
+        logger.info("OCR: %d image(s) in %.2fs (%.2f pages/sec, batch_size=%d)",
+                    images, elapsed, self.last_stats["pages_per_sec"], batch_size)
+
+    def stats(self) -> Dict[str, Any]:
+        """Сколько изображений распознано за время жизни движка и средняя скорость."""
+        return {
+            "images": self.images_done,
+            "seconds": round(self.seconds_spent, 3),
+            "pages_per_sec": round(self.images_done / self.seconds_spent, 3) if self.seconds_spent > 0 else 0.0,
+        }
+
+
+def _plain(value: Any) -> Any:
+    """Число numpy -> число Python (int остаётся int)."""
+    return value.item() if hasattr(value, "item") else value
+
+
+def image_fingerprint(img: Image.Image) -> str:
+    """Отпечаток изображения для кэша OCR: режим, размер и пиксели."""
+    h = hashlib.sha256(f"{img.mode}:{img.size[0]}x{img.size[1]}:".encode("ascii"))
+    h.update(img.tobytes())
+    return "raster:" + h.hexdigest()
+
+
+def _rgb_array(img: Image.Image):
+    """np.array RGB без лишней копии: convert("RGB") копирует даже RGB-изображение."""
+    return np.array(img if img.mode == "RGB" else img.convert("RGB"))
+
+
+# --- Тайлы ---
+def _tile_starts(length: int, tile: int, step: int) -> List[int]:
+    starts = list(range(0, max(length - tile, 0) + 1, step))
+    if starts[-1] + tile < length:
+        starts.append(length - tile)
+    return starts
+
+
+def tile_grid(width: int, height: int, tile_px: int = DEFAULT_TILE_PX,
+              overlap_px: int = DEFAULT_TILE_OVERLAP_PX) -> List[fitz.IRect]:
+    """
+    Тайлы растра width x height (построчно): не больше tile_px x tile_px, соседние перекрываются
+    на overlap_px. Любой прямоугольник не больше overlap_px целиком лежит хотя бы в одном тайле.
+    """
+    if overlap_px >= tile_px:
+        raise ValueError("Tile overlap must be smaller than the tile size")
+    step = tile_px - overlap_px
+    return [fitz.IRect(x0, y0, min(x0 + tile_px, width), min(y0 + tile_px, height))
+            for y0 in _tile_starts(height, tile_px, step)
+            for x0 in _tile_starts(width, tile_px, step)]
+
+
+def iter_page_tiles(source: Union[fitz.Page, fitz.DisplayList], dpi: int,
+                    tile_px: int = DEFAULT_TILE_PX,
+                    overlap_px: int = DEFAULT_TILE_OVERLAP_PX,
+                    clip: Optional[fitz.Rect] = None) -> Iterator[Tuple[Image.Image, fitz.IRect]]:
+    """
+    Растр страницы (или её области clip, в пунктах PDF) по тайлам не больше tile_px x tile_px
+    с перекрытием overlap_px. Возвращает (изображение тайла, его положение в полном растре).
+    source — страница или её display list (контент интерпретируется один раз на все тайлы).
+    """
+    if isinstance(source, fitz.Page):
+        source = source.get_displaylist()
+
+    zoom = dpi / 72.0
+    mat = fitz.Matrix(zoom, zoom)
+    full = ((source.rect if clip is None else clip) * mat).irect
+    for tile in tile_grid(full.width, full.height, tile_px, overlap_px):
+        clip = fitz.Rect(tile + (full.x0, full.y0, full.x0, full.y0)) / zoom
+        pix = source.get_pixmap(matrix=mat, clip=clip, alpha=False)
+        img = Image.frombytes("RGB", (pix.width, pix.height), pix.samples)
+        # фактическое положение растра (округление clip может сдвинуть его на пиксель)
+        origin = fitz.IRect(pix.irect) - (full.x0, full.y0, full.x0, full.y0)
+        del pix
+        yield img, origin
+
+
+def prime_image_cache(page: fitz.Page, source: fitz.DisplayList, max_bytes: int) -> None:
+    """
+    Однократно декодирует встроенные картинки страницы целиком (рендер в их собственном разрешении).
+    Рендер фрагмента декодирует только нужную часть картинки и заново на каждый фрагмент;
+    полностью декодированная картинка остаётся в кэше MuPDF и используется всеми тайлами и превью.
+    Картинки, чей растр больше max_bytes, пропускаются — для них остаётся декодирование по фрагментам.
+    """
+    for info in page.get_image_info():
+        bbox = fitz.Rect(info["bbox"])
+        if bbox.is_empty or info["width"] * info["height"] > max_bytes:
+            continue
+        zoom = max(info["width"] / bbox.width, info["height"] / bbox.height)
+        pix = source.get_pixmap(matrix=fitz.Matrix(zoom, zoom), clip=bbox,
+                                colorspace=fitz.csGRAY, alpha=False)
+        del pix
+
+
+def image_regions(page: fitz.Page, min_size_pt: float = 36.0,
+                  max_dpi: int = 400) -> List[Tuple[fitz.Rect, int]]:
+    """
+    Области встроенных картинок страницы (в пунктах PDF) и их собственное разрешение (DPI) — для
+    OCR только картинок на странице с текстовым слоем. Перекрывающиеся и стыкующиеся картинки
+    (скан, нарезанный полосами) объединяются, разрешение области — наибольшее из её картинок.
+    Области меньше min_size_pt по любой стороне (логотипы, печати) пропускаются; DPI ограничен
+    max_dpi — рендер выше разрешения скана не добавляет деталей.
+    """
+    regions: List[Tuple[fitz.Rect, float]] = []
+    for info in page.get_image_info():
+        bbox = fitz.Rect(info["bbox"])
+        visible = bbox & page.rect
+        if bbox.is_empty or visible.is_empty:
+            continue
+        # не зависит от поворота картинки на 90°
+        dpi = 72.0 * math.sqrt(info["width"] * info["height"] / (bbox.width * bbox.height))
+
+        pad = IMAGE_JOIN_PT
+        merged = True
+        while merged:
+            merged = False
+            for i, (rect, other_dpi) in enumerate(regions):
+                if (rect + (-pad, -pad, pad, pad)).intersects(visible):
+                    visible |= rect
+                    dpi = max(dpi, other_dpi)
+                    del regions[i]
+                    merged = True
+                    break
+        regions.append((visible, dpi))
+
+    return [(rect, int(round(min(dpi, max_dpi)))) for rect, dpi in regions
+            if min(rect.width, rect.height) >= min_size_pt]
+
+
+def _block_rect(block: Dict[str, Any]) -> fitz.Rect:
+    xs = [p[0] for p in block["bbox"]]
+    ys = [p[1] for p in block["bbox"]]
+    return fitz.Rect(min(xs), min(ys), max(xs), max(ys))
+
+
+# Блок, подходящий к внутренней границе тайла ближе этого, считается обрезанным
+TILE_EDGE_MARGIN = 2
+# Блоки соседних тайлов — одна и та же строка, если перекрываются на половину площади меньшего
+# и текст одного содержится в другом (обрезанная строка) либо почти совпадают рамки (IoU)
+DUPLICATE_OVERLAP = 0.5
+DUPLICATE_IOU = 0.8
+
+
+def _is_duplicate(a: Dict[str, Any], ra: fitz.Rect, b: Dict[str, Any], rb: fitz.Rect) -> bool:
+    inter = abs(ra & rb)
+    if inter <= 0:
+        return False
+    union = abs(ra) + abs(rb) - inter
+    if union > 0 and inter / union >= DUPLICATE_IOU:
+        return True
+    if inter < DUPLICATE_OVERLAP * min(abs(ra), abs(rb)):
+        return False
+    ta = a["text"].replace(" ", "")
+    tb = b["text"].replace(" ", "")
+    return ta in tb or tb in ta
+
+
+def _merge_tile_blocks(collected: List[Tuple[Dict[str, Any], fitz.IRect]],
+                       tiles: List[fitz.IRect]) -> List[Dict[str, Any]]:
+    """
+    Объединяет блоки OCR соседних тайлов. Блок, целиком лежащий вне остальных тайлов,
+    дубликатов иметь не может и остаётся как есть. Блоки из зон перекрытия отбираются
+    жадно: сначала полные (не обрезанные внутренней границей тайла), затем по убыванию площади;
+    блок отбрасывается, если он дубликат уже выбранного (см. _is_duplicate).
+    Возвращает блоки в порядке чтения (сверху вниз, слева направо).
+    """
+    page = fitz.Rect()
+    for tile in tiles:
+        page |= fitz.Rect(tile)
+
+    out: List[Tuple[Dict[str, Any], fitz.Rect]] = []
+    shared: List[Tuple[bool, float, Dict[str, Any], fitz.Rect]] = []
+    for block, tile in collected:
+        rect = _block_rect(block)
+        if not any(other != tile and rect.intersects(other) for other in tiles):
+            out.append((block, rect))
+            continue
+        truncated = ((tile.x0 > page.x0 and rect.x0 <= tile.x0 + TILE_EDGE_MARGIN)
+                     or (tile.x1 < page.x1 and rect.x1 >= tile.x1 - TILE_EDGE_MARGIN)
+                     or (tile.y0 > page.y0 and rect.y0 <= tile.y0 + TILE_EDGE_MARGIN)
+                     or (tile.y1 < page.y1 and rect.y1 >= tile.y1 - TILE_EDGE_MARGIN))
+        shared.append((truncated, abs(rect), block, rect))
+
+    chosen: List[Tuple[Dict[str, Any], fitz.Rect]] = []
+    for _, _, block, rect in sorted(shared, key=lambda s: (s[0], -s[1])):
+        if any(_is_duplicate(block, rect, other, other_rect) for other, other_rect in chosen):
+            continue
+        chosen.append((block, rect))
+        out.append((block, rect))
+
+    out.sort(key=lambda br: (br[1].y0, br[1].x0))
+    return [block for block, _ in out]
+
 
 # --- Утилиты для PDF ---
 def page_has_text(page: fitz.Page) -> bool:
@@ -62,9 +518,46 @@ def page_has_text(page: fitz.Page) -> bool:
     return len(txt) > 0
 
 
+def scan_fingerprint(page: fitz.Page, dpi: int) -> Optional[str]:
+    """
+    Отпечаток страницы-скана для кэша OCR без рендера: геометрия страницы, её поток содержимого
+    и исходные (сжатые) потоки картинок. Одинаковые сканы в разных ревизиях файла дают один
+    отпечаток, даже если номера объектов PDF отличаются. Только для страниц, чей вид полностью
+    задан этими данными (нет текста, форм-объектов и аннотаций); для остальных — None,
+    и ключом служит растр (см. image_fingerprint).
+    """
+    if page.first_annot is not None or page.get_fonts() or page.get_xobjects():
+        return None
+    images = page.get_images(full=True)
+    if not images:
+        return None
+
+    doc = page.parent
+    h = hashlib.sha256(f"{tuple(page.rect)}|{tuple(page.mediabox)}|{page.rotation}|{dpi}".encode("ascii"))
+    h.update(page.read_contents())
+    for xref, smask, width, height, bpc, colorspace, alt_colorspace, name, filters, _ in images:
+        params = [doc.xref_get_key(xref, key)[1] for key in ("DecodeParms", "Decode", "ImageMask", "Intent")]
+        h.update(repr((name, width, height, bpc, colorspace, alt_colorspace, filters, params)).encode("utf-8"))
+        h.update(doc.xref_stream_raw(xref))
+        if smask:
+            h.update(doc.xref_stream_raw(smask))
+    return "scan:" + h.hexdigest()
+
+
 def rasterize_page(page: fitz.Page, dpi: int = 300) -> Image.Image:
     """ Рендер страницы PDF в PIL.Image для OCR """
     zoom = dpi / 72.0
     mat = fitz.Matrix(zoom, zoom)
     pix = page.get_pixmap(matrix=mat, alpha=False)
     return Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
+
+
+def rasterize_region(source, clip: fitz.Rect, dpi: int = 300) -> Image.Image:
+    """
+    Рендер области страницы (в пунктах PDF) в оттенках серого — для распознавания кандидатов.
+    source — fitz.Page или её display list (для многих областей одной страницы: контент
+    интерпретируется один раз, а не при каждом рендере).
+    """
+    zoom = dpi / 72.0
+    pix = source.get_pixmap(matrix=fitz.Matrix(zoom, zoom), clip=clip, colorspace=fitz.csGRAY, alpha=False)
+    return Image.frombytes("L", [pix.width, pix.height], pix.samples)
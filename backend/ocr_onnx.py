@@ -0,0 +1,453 @@
+# ocr_onnx.py
+"""
+OCR на ONNX Runtime без torch: детектор CRAFT и распознаватель CRNN из EasyOCR,
+экспортированные в ONNX скриптом export_onnx_models.py (можно с INT8-квантованием).
+
+OnnxOCRReader повторяет интерфейс easyocr.Reader, которым пользуется NeuralOCREngine
+(readtext / readtext_batched / detect / recognize), и ту же пред- и постобработку,
+поэтому тайлы, пачки и двухпроходный режим работают с ним без изменений.
+"""
+import os
+import sys
+import json
+import math
+import logging
+from typing import List, Dict, Any, Optional, Tuple
+
+import numpy as np
+from PIL import Image
+
+from analysis_cache import file_digest
+
+# ONNX Runtime и OpenCV нужны только этому движку
+try:
+    import onnxruntime as ort
+    import cv2
+except ImportError:  # pragma: no cover - зависит от сборки
+    ort = None
+    cv2 = None
+
+logger = logging.getLogger(__name__)
+
+DETECTOR_NAME = "detector"
+RECOGNIZER_PREFIX = "recognizer_"
+INT8_SUFFIX = ".int8"
+
+# Высота строки на входе распознавателя (модели EasyOCR второго поколения)
+MODEL_HEIGHT = 64
+# Нормализация входа детектора (ImageNet), в шкале 0..255
+DETECTOR_MEAN = np.array([0.485, 0.456, 0.406], dtype=np.float32) * 255.0
+DETECTOR_STD = np.array([0.229, 0.224, 0.225], dtype=np.float32) * 255.0
+
+
+def get_onnx_model_dir() -> str:
+    """Каталог ONNX-моделей: рядом со скриптом в режиме разработки, в sys._MEIPASS в сборке PyInstaller."""
+    if getattr(sys, 'frozen', False):
+        return os.path.join(sys._MEIPASS, "onnx_models")
+    return os.path.join(os.path.dirname(os.path.abspath(__file__)), "onnx_models")
+
+
+def recognizer_name(lang_list: List[str]) -> str:
+    """Имя файла распознавателя для набора языков: ['en', 'ru'] -> 'recognizer_en_ru'."""
+    return RECOGNIZER_PREFIX + "_".join(lang_list)
+
+
+def session_options(intra_threads: int = 0, inter_threads: int = 0,
+                    mem_arena: bool = True) -> "ort.SessionOptions":
+    """
+    Настройки сессии ONNX Runtime. intra_threads — потоки внутри одного оператора
+    (свёртки, матричные умножения), inter_threads — параллельно выполняемые независимые
+    операторы графа; 0 — значение ONNX Runtime по умолчанию (по числу физических ядер).
+    mem_arena=False — память промежуточных тензоров возвращается после каждого прогона.
+    """
+    so = ort.SessionOptions()
+    so.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    so.enable_cpu_mem_arena = mem_arena
+    if intra_threads > 0:
+        so.intra_op_num_threads = intra_threads
+    if inter_threads > 0:
+        so.inter_op_num_threads = inter_threads
+        if inter_threads > 1:
+            so.execution_mode = ort.ExecutionMode.ORT_PARALLEL
+    return so
+
+
+def _model_path(model_dir: str, name: str, int8: bool) -> str:
+    """Путь к модели; при int8 — квантованная версия, если она экспортирована."""
+    path = os.path.join(model_dir, name + ".onnx")
+    if int8:
+        quantized = os.path.join(model_dir, name + INT8_SUFFIX + ".onnx")
+        if os.path.isfile(quantized):
+            return quantized
+        logger.warning("INT8 model %s not found, using %s", os.path.basename(quantized), os.path.basename(path))
+    if not os.path.isfile(path):
+        raise FileNotFoundError(f"ONNX model not found: {path}. Export it with export_onnx_models.py")
+    return path
+
+
+class OnnxOCRReader:
+    """
+    Читатель OCR на ONNX Runtime с интерфейсом easyocr.Reader.
+    lang_list — языки; для них должен быть экспортирован распознаватель (recognizer_<языки>.onnx
+    и .json с алфавитом модели).
+    """
+
+    def __init__(self, lang_list: List[str], model_dir: Optional[str] = None, int8: bool = False,
+                 intra_threads: int = 0, inter_threads: int = 0):
+        if ort is None or cv2 is None:
+            raise RuntimeError("ONNX OCR engine requires onnxruntime and OpenCV. "
+                               "Please run 'pip install onnxruntime opencv-python-headless'.")
+        model_dir = model_dir or get_onnx_model_dir()
+        name = recognizer_name(lang_list)
+        providers = ["CPUExecutionProvider"]
+
+        det_path = _model_path(model_dir, DETECTOR_NAME, int8)
+        rec_path = _model_path(model_dir, name, int8)
+        # промежуточные тензоры детектора на холсте 2560 — больше гигабайта каждый; арена ONNX Runtime
+        # удерживала бы пиковый объём между страницами, поэтому у детектора она выключена
+        self.detector = ort.InferenceSession(det_path, providers=providers,
+                                             sess_options=session_options(intra_threads, inter_threads,
+                                                                          mem_arena=False))
+        self.recognizer = ort.InferenceSession(rec_path, providers=providers,
+                                               sess_options=session_options(intra_threads, inter_threads))
+        self.model_files = [os.path.basename(det_path), os.path.basename(rec_path)]
+
+        meta_path = os.path.join(model_dir, name + ".json")
+        with open(meta_path, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        self.character: str = meta["characters"]
+        lang_chars = set(meta["lang_chars"])
+        # индекс 0 — пустой символ CTC; символы модели вне выбранных языков не выводятся (как в EasyOCR)
+        self.labels = np.array([""] + list(self.character), dtype=object)
+        self.ignore_idx = [i + 1 for i, c in enumerate(self.character) if c not in lang_chars]
+        # версия для кэша OCR: переэкспорт или замена моделей меняет её
+        self.version = f"onnx-{ort.__version__}:" + ",".join(
+            file_digest(path)[:16] for path in (det_path, rec_path, meta_path))
+        logger.info("ONNX OCR: %s", ", ".join(self.model_files))
+
+    # --- Интерфейс easyocr.Reader ---
+    def readtext(self, image: np.ndarray, batch_size: int = 1, **kwargs) -> List[Tuple[Any, str, float]]:
+        img, grey = _reformat(image)
+        horizontal, free = self.detect(img, **kwargs)
+        return self.recognize(grey, horizontal[0], free[0], batch_size=batch_size)
+
+    def readtext_batched(self, images: List[np.ndarray], batch_size: int = 1,
+                         **kwargs) -> List[List[Tuple[Any, str, float]]]:
+        """Изображения одного размера: детектор получает их одной пачкой."""
+        pairs = [_reformat(image) for image in images]
+        horizontal, free = self.detect(np.stack([img for img, _ in pairs]), **kwargs)
+        return [self.recognize(grey, h, f, batch_size=batch_size)
+                for (_, grey), h, f in zip(pairs, horizontal, free)]
+
+    def detect(self, img: np.ndarray, min_size: int = 20, text_threshold: float = 0.7,
+               low_text: float = 0.4, link_threshold: float = 0.4, canvas_size: int = 2560,
+               mag_ratio: float = 1.0, slope_ths: float = 0.1, ycenter_ths: float = 0.5,
+               height_ths: float = 0.5, width_ths: float = 0.5,
+               add_margin: float = 0.1) -> Tuple[List[List[List[int]]], List[List[List[List[float]]]]]:
+        """
+        Строки текста на изображении (RGB, HxWx3) или пачке изображений одного размера (NxHxWx3).
+        Возвращает (horizontal_list, free_list) для каждого изображения, как easyocr.Reader.detect.
+        """
+        images = img if img.ndim == 4 else img[None]
+        batch = []
+        ratio = 1.0
+        for im in images:
+            canvas, ratio = _resize_for_detector(im, canvas_size, mag_ratio)
+            batch.append(canvas)
+        x = np.ascontiguousarray(np.stack(batch).transpose(0, 3, 1, 2))
+        del batch
+        score_maps = self.detector.run([self.detector.get_outputs()[0].name],
+                                       {self.detector.get_inputs()[0].name: x})[0]
+        del x
+
+        # карты детектора вдвое меньше его входа
+        scale = 2.0 / ratio
+        horizontal_agg, free_agg = [], []
+        for out in score_maps:
+            polys = [(box * scale).astype(np.int32).reshape(-1)
+                     for box in _det_boxes(out[:, :, 0], out[:, :, 1], text_threshold, link_threshold, low_text)]
+            horizontal, free = _group_text_boxes(polys, slope_ths, ycenter_ths, height_ths, width_ths, add_margin)
+            if min_size:
+                horizontal = [b for b in horizontal if max(b[1] - b[0], b[3] - b[2]) > min_size]
+                free = [p for p in free if max(_span([c[0] for c in p]), _span([c[1] for c in p])) > min_size]
+            horizontal_agg.append(horizontal)
+            free_agg.append(free)
+        return horizontal_agg, free_agg
+
+    def recognize(self, img_cv_grey: np.ndarray, horizontal_list: Optional[List[List[int]]] = None,
+                  free_list: Optional[List[Any]] = None, batch_size: int = 1,
+                  contrast_ths: float = 0.1, adjust_contrast: float = 0.5,
+                  **kwargs) -> List[Tuple[Any, str, float]]:
+        """
+        Распознаёт строки horizontal_list ([x_min, x_max, y_min, y_max]) и free_list (четырёхугольники)
+        на изображении в оттенках серого. Без областей распознаётся всё изображение.
+        Результат — [(рамка, текст, уверенность)]: сначала horizontal_list, затем free_list.
+        """
+        if img_cv_grey.ndim == 3:
+            img_cv_grey = _reformat(img_cv_grey)[1]
+        if horizontal_list is None and free_list is None:
+            h, w = img_cv_grey.shape
+            horizontal_list = [[0, w, 0, h]]
+        lines = _crop_lines(horizontal_list or [], free_list or [], img_cv_grey)
+
+        first = self._predict([crop for _, crop, _ in lines], [width for _, _, width in lines], batch_size, 0.0)
+        # строки с низкой уверенностью — второй прогон с повышенным контрастом
+        low = [i for i, (_, conf) in enumerate(first) if conf < contrast_ths]
+        if low:
+            second = self._predict([lines[i][1] for i in low], [lines[i][2] for i in low],
+                                   batch_size, adjust_contrast)
+            for i, pred in zip(low, second):
+                if pred[1] >= first[i][1]:
+                    first[i] = pred
+        return [(box, text, conf) for (box, _, _), (text, conf) in zip(lines, first)]
+
+    # --- Распознаватель ---
+    def _predict(self, crops: List[np.ndarray], widths: List[int], batch_size: int,
+                 adjust_contrast: float) -> List[Tuple[str, float]]:
+        """
+        Прогон распознавателя. Ширина входа у каждой строки своя (как у EasyOCR на CPU, где строки
+        распознаются по одной), поэтому в пачку попадают только строки одной ширины — результат
+        совпадает с построчным, а сеть вызывается пачками по batch_size.
+        """
+        out: List[Tuple[str, float]] = [("", 0.0)] * len(crops)
+        by_width: Dict[int, List[int]] = {}
+        for i, width in enumerate(widths):
+            by_width.setdefault(width, []).append(i)
+
+        input_name = self.recognizer.get_inputs()[0].name
+        for width, indices in by_width.items():
+            for first in range(0, len(indices), max(1, batch_size)):
+                chunk = indices[first:first + max(1, batch_size)]
+                x = np.stack([_normalize_line(crops[i], width, adjust_contrast) for i in chunk])
+                logits = self.recognizer.run(None, {input_name: x})[0]
+                for i, pred in zip(chunk, self._decode(logits)):
+                    out[i] = pred
+        return out
+
+    def _decode(self, logits: np.ndarray) -> List[Tuple[str, float]]:
+        """Жадное CTC-декодирование; уверенность — как в EasyOCR (prod(p) ** (2 / sqrt(n)))."""
+        probs = np.exp(logits - logits.max(axis=2, keepdims=True))
+        probs /= probs.sum(axis=2, keepdims=True)
+        if self.ignore_idx:
+            probs[:, :, self.ignore_idx] = 0.0
+            probs /= probs.sum(axis=2, keepdims=True)
+
+        indices = probs.argmax(axis=2)
+        values = probs.max(axis=2)
+        out = []
+        for idx, val in zip(indices, values):
+            keep = np.insert(idx[1:] != idx[:-1], 0, True) & (idx != 0)
+            text = "".join(self.labels[idx[keep]])
+            max_probs = val[idx != 0]
+            if len(max_probs) == 0:
+                max_probs = np.array([0.0])
+            out.append((text, float(max_probs.prod() ** (2.0 / np.sqrt(len(max_probs))))))
+        return out
+
+
+# -----------------------
+# Пред- и постобработка (как в EasyOCR)
+# -----------------------
+def _reformat(image: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """(RGB, оттенки серого) из массива RGB или серого."""
+    if image.ndim == 2:
+        return cv2.cvtColor(image, cv2.COLOR_GRAY2RGB), image
+    if image.shape[2] == 4:
+        image = image[:, :, :3]
+    return image, cv2.cvtColor(image, cv2.COLOR_RGB2GRAY)
+
+
+def _resize_for_detector(img: np.ndarray, canvas_size: int, mag_ratio: float) -> Tuple[np.ndarray, float]:
+    """Масштаб до canvas_size по длинной стороне, дополнение до кратных 32 и нормализация."""
+    height, width = img.shape[:2]
+    target = min(mag_ratio * max(height, width), canvas_size)
+    ratio = target / max(height, width)
+    target_h, target_w = int(height * ratio), int(width * ratio)
+    resized = cv2.resize(img, (target_w, target_h), interpolation=cv2.INTER_LINEAR)
+
+    canvas = np.zeros((target_h + (-target_h % 32), target_w + (-target_w % 32), 3), dtype=np.float32)
+    canvas[:target_h, :target_w, :] = resized
+    canvas -= DETECTOR_MEAN
+    canvas /= DETECTOR_STD
+    return canvas, ratio
+
+
+def _det_boxes(textmap: np.ndarray, linkmap: np.ndarray, text_threshold: float,
+               link_threshold: float, low_text: float) -> List[np.ndarray]:
+    """
+    Рамки слов по картам CRAFT (постобработка EasyOCR getDetBoxes без полигонов).
+    Маски компонент строятся в окне рамки компоненты, а не по всей карте: результат тот же,
+    но число компонент на чертеже (тысячи) больше не умножается на площадь карты.
+    """
+    img_h, img_w = textmap.shape
+    text_score = textmap > low_text
+    link_score = linkmap > link_threshold
+    link_only = link_score & ~text_score
+    n_labels, labels, stats, _ = cv2.connectedComponentsWithStats(
+        (text_score | link_score).astype(np.uint8), connectivity=4)
+
+    boxes = []
+    for k in range(1, n_labels):
+        x, y, w, h, size = (int(v) for v in stats[k, :5])
+        if size < 10:
+            continue
+
+        niter = int(math.sqrt(size * min(w, h) / (w * h)) * 2)
+        sx, ex = max(x - niter, 0), min(x + w + niter + 1, img_w)
+        sy, ey = max(y - niter, 0), min(y + h + niter + 1, img_h)
+        component = labels[sy:ey, sx:ex] == k
+        if textmap[sy:ey, sx:ex][component].max() < text_threshold:
+            continue
+
+        segmap = (component & ~link_only[sy:ey, sx:ex]).astype(np.uint8) * 255
+        kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (1 + niter, 1 + niter))
+        segmap = cv2.dilate(segmap, kernel)
+
+        ys, xs = np.nonzero(segmap)
+        points = np.stack([xs + sx, ys + sy], axis=1).astype(np.int32)
+        box = cv2.boxPoints(cv2.minAreaRect(points))
+
+        # почти квадратные рамки (ромбы) выравниваются по осям
+        bw, bh = np.linalg.norm(box[0] - box[1]), np.linalg.norm(box[1] - box[2])
+        if abs(1 - max(bw, bh) / (min(bw, bh) + 1e-5)) <= 0.1:
+            l, r = points[:, 0].min(), points[:, 0].max()
+            t, b = points[:, 1].min(), points[:, 1].max()
+            box = np.array([[l, t], [r, t], [r, b], [l, b]], dtype=np.float32)
+
+        # по часовой стрелке, начиная с верхнего левого угла
+        start = box.sum(axis=1).argmin()
+        boxes.append(np.roll(box, 4 - start, 0))
+    return boxes
+
+
+def _span(values: List[float]) -> float:
+    return max(values) - min(values)
+
+
+def _group_text_boxes(polys: List[np.ndarray], slope_ths: float, ycenter_ths: float, height_ths: float,
+                      width_ths: float, add_margin: float) -> Tuple[List[List[int]], List[List[List[float]]]]:
+    """
+    Объединение слов в строки (group_text_box из EasyOCR): почти горизонтальные рамки
+    склеиваются в строки [x_min, x_max, y_min, y_max], наклонные остаются четырёхугольниками.
+    """
+    horizontal, free = [], []
+    for poly in polys:
+        slope_up = (poly[3] - poly[1]) / max(10, poly[2] - poly[0])
+        slope_down = (poly[5] - poly[7]) / max(10, poly[4] - poly[6])
+        if max(abs(slope_up), abs(slope_down)) < slope_ths:
+            xs, ys = poly[0::2], poly[1::2]
+            x_min, x_max, y_min, y_max = min(xs), max(xs), min(ys), max(ys)
+            horizontal.append([x_min, x_max, y_min, y_max, 0.5 * (y_min + y_max), y_max - y_min])
+        else:
+            height = np.linalg.norm([poly[6] - poly[0], poly[7] - poly[1]])
+            width = np.linalg.norm([poly[2] - poly[0], poly[3] - poly[1]])
+            margin = int(1.44 * add_margin * min(width, height))
+            theta13 = abs(np.arctan((poly[1] - poly[5]) / max(10, poly[0] - poly[4])))
+            theta24 = abs(np.arctan((poly[3] - poly[7]) / max(10, poly[2] - poly[6])))
+            free.append([
+                [poly[0] - np.cos(theta13) * margin, poly[1] - np.sin(theta13) * margin],
+                [poly[2] + np.cos(theta24) * margin, poly[3] - np.sin(theta24) * margin],
+                [poly[4] + np.cos(theta13) * margin, poly[5] + np.sin(theta13) * margin],
+                [poly[6] - np.cos(theta24) * margin, poly[7] + np.sin(theta24) * margin],
+            ])
+    horizontal.sort(key=lambda b: b[4])
+
+    # строки: рамки с близким центром по вертикали
+    rows: List[List[List[float]]] = []
+    for box in horizontal:
+        if rows and abs(np.mean([b[4] for b in rows[-1]]) - box[4]) < ycenter_ths * np.mean([b[5] for b in rows[-1]]):
+            rows[-1].append(box)
+        else:
+            rows.append([box])
+
+    merged: List[List[int]] = []
+    for row in rows:
+        if len(row) == 1:
+            box = row[0]
+            margin = int(add_margin * min(box[1] - box[0], box[5]))
+            merged.append([box[0] - margin, box[1] + margin, box[2] - margin, box[3] + margin])
+            continue
+
+        # внутри строки — соседние слова близкой высоты с небольшим промежутком
+        groups: List[List[List[float]]] = []
+        x_max = 0
+        for box in sorted(row, key=lambda b: b[0]):
+            if (groups and abs(np.mean([b[5] for b in groups[-1]]) - box[5]) < height_ths * np.mean([b[5] for b in groups[-1]])
+                    and (box[0] - x_max) < width_ths * (box[3] - box[2])):
+                groups[-1].append(box)
+            else:
+                groups.append([box])
+            x_max = box[1]
+        for group in groups:
+            x0 = min(b[0] for b in group)
+            x1 = max(b[1] for b in group)
+            y0 = min(b[2] for b in group)
+            y1 = max(b[3] for b in group)
+            margin = int(add_margin * min(x1 - x0, y1 - y0))
+            merged.append([x0 - margin, x1 + margin, y0 - margin, y1 + margin])
+    return merged, free
+
+
+def _resize_line(crop: np.ndarray) -> Tuple[np.ndarray, float]:
+    """Строка к высоте MODEL_HEIGHT (вертикальная — к ширине); возвращает и отношение сторон (>= 1)."""
+    height, width = crop.shape[:2]
+    ratio = width / height
+    # EasyOCR передаёт в cv2.resize константу PIL LANCZOS (1) — для OpenCV это INTER_LINEAR
+    if ratio < 1.0:
+        ratio = 1.0 / ratio
+        return cv2.resize(crop, (MODEL_HEIGHT, int(MODEL_HEIGHT * ratio)), interpolation=cv2.INTER_LINEAR), ratio
+    return cv2.resize(crop, (int(MODEL_HEIGHT * ratio), MODEL_HEIGHT), interpolation=cv2.INTER_LINEAR), ratio
+
+
+def _four_point_crop(img: np.ndarray, quad: List[List[float]]) -> np.ndarray:
+    """Выпрямляет наклонную строку (четырёхугольник tl, tr, br, bl) в прямоугольник."""
+    rect = np.array(quad, dtype=np.float32)
+    tl, tr, br, bl = rect
+    width = max(int(np.linalg.norm(br - bl)), int(np.linalg.norm(tr - tl)))
+    height = max(int(np.linalg.norm(tr - br)), int(np.linalg.norm(tl - bl)))
+    dst = np.array([[0, 0], [width - 1, 0], [width - 1, height - 1], [0, height - 1]], dtype=np.float32)
+    return cv2.warpPerspective(img, cv2.getPerspectiveTransform(rect, dst), (width, height))
+
+
+def _crop_lines(horizontal_list: List[List[int]], free_list: List[Any],
+                grey: np.ndarray) -> List[Tuple[Any, np.ndarray, int]]:
+    """Вырезки строк для распознавателя: (рамка, вырезка высотой MODEL_HEIGHT, ширина входа сети)."""
+    max_y, max_x = grey.shape
+    lines = []
+    for box in horizontal_list:
+        x_min, x_max = int(max(0, box[0])), int(min(box[1], max_x))
+        y_min, y_max = int(max(0, box[2])), int(min(box[3], max_y))
+        width, height = x_max - x_min, y_max - y_min
+        if width <= 0 or height <= 0:
+            continue
+        crop, ratio = _resize_line(grey[y_min:y_max, x_min:x_max])
+        lines.append(([[x_min, y_min], [x_max, y_min], [x_max, y_max], [x_min, y_max]],
+                      crop, math.ceil(ratio) * MODEL_HEIGHT))
+    for quad in free_list:
+        warped = _four_point_crop(grey, quad)
+        if warped.shape[0] == 0 or warped.shape[1] == 0:
+            continue
+        crop, ratio = _resize_line(warped)
+        lines.append(([[float(x), float(y)] for x, y in quad], crop, math.ceil(ratio) * MODEL_HEIGHT))
+    return lines
+
+
+def _adjust_contrast(img: np.ndarray, target: float) -> np.ndarray:
+    high, low = np.percentile(img, 90), np.percentile(img, 10)
+    if (high - low) / max(10, high + low) >= target:
+        return img
+    ratio = 200.0 / max(10, high - low)
+    return np.clip((img.astype(int) - low + 25) * ratio, 0, 255).astype(np.uint8)
+
+
+def _normalize_line(crop: np.ndarray, width: int, adjust_contrast: float) -> np.ndarray:
+    """Вход распознавателя 1 x MODEL_HEIGHT x width: масштаб с сохранением пропорций, [-1, 1], справа — повтор края."""
+    if adjust_contrast > 0:
+        crop = _adjust_contrast(crop, adjust_contrast)
+    img = Image.fromarray(crop, "L")
+    resized_w = min(width, math.ceil(MODEL_HEIGHT * img.width / img.height))
+    line = np.asarray(img.resize((resized_w, MODEL_HEIGHT), Image.BICUBIC), dtype=np.float32) / 127.5 - 1.0
+    out = np.empty((1, MODEL_HEIGHT, width), dtype=np.float32)
+    out[0, :, :resized_w] = line
+    out[0, :, resized_w:] = line[:, -1:]
+    return out
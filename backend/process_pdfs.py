@@ -1,12 +1,14 @@
 import sys
 import os
-import base64
 import io
 import tempfile
 import re
 import json
 import logging
-from typing import List, Dict, Any, Optional
+import math
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import List, Dict, Any, Optional, Tuple, Callable, Iterator, Iterable
 
 # --- Обязательная зависимость для analyze ---
 try:
@@ -15,6 +17,15 @@ except ImportError as e:
     print(f"Error: PyMuPDF is not installed. {e}\nPlease run 'pip install PyMuPDF'.", file=sys.stderr)
     sys.exit(1)
 
+from analysis_cache import AnalysisCache
+from export_stream import ExportPayloadError, normalize_item, read_export_payload
+from results_store import ResultsStore
+from revision_index import RevisionIndex, page_fingerprints
+from tag_index import TagIndex
+from text_layer import iter_block_chars, span_rect
+from thumbnail_encoding import ThumbnailOptions, encode_pixmap
+from thumbnail_store import thumbnail_fields, has_thumbnail
+
 # -----------------------
 # Логирование
 # -----------------------
@@ -35,11 +46,109 @@ class AnalyzeOptions:
         self.dedup_csv: bool = data.get("dedup_csv", False)
         # новый параметр — лимит цифр после префикса
         self.max_digits: int = int(data.get("max_digits", 5))
+        # число процессов для пакетного анализа (0 — по числу ядер, 1 — последовательно)
+        self.workers: int = int(data.get("workers", 0)) or (os.cpu_count() or 1)
+        # потоковый вывод NDJSON: "" — один JSON в конце, "file" — строка на файл, "item" — строка на находку
+        self.stream: str = str(data.get("stream") or "").lower()
+        # кэш результатов на диске (см. analysis_cache.py)
+        self.use_cache: bool = bool(data.get("use_cache", True))
+        self.cache_dir: Optional[str] = data.get("cache_dir")
+        self.cache_max_mb: int = int(data.get("cache_max_mb", 512))
+        # повторный анализ новой ревизии чертежа: неизменённые страницы берутся из предыдущей
+        # (см. revision_index.py); как и кэш, отключается use_cache / --no-cache
+        self.incremental: bool = bool(data.get("incremental", True))
+        # False — только геометрия (rect/clip), превью рендерятся позже командой render
+        self.thumbnails: bool = bool(data.get("thumbnails", True))
+        # результаты в базу SQLite (см. results_store.py): ответ содержит run_id и число находок
+        # по файлам, сами находки читаются командой query постранично
+        self.store_results: bool = bool(data.get("store_results", False))
+        self.store_path: Optional[str] = data.get("store_path")
+        self.store_keep_runs: int = int(data.get("store_keep_runs", 10))
+        # формат, цвет, dpi и сжатие превью (thumb_* в опциях)
+        self.thumb: ThumbnailOptions = ThumbnailOptions(data)
+
+    def result_key(self) -> Dict[str, Any]:
+        """Опции, от которых зависит результат анализа (входят в ключ кэша)."""
+        key = {
+            "prefix": self.prefix,
+            "max_digits": self.max_digits,
+            "cap_width": self.cap_width,
+            "cap_height": self.cap_height,
+            "pos_x": self.pos_x,
+            "pos_y": self.pos_y,
+            "thumbnails": self.thumbnails,
+        }
+        # без превью параметры их кодирования на результат не влияют
+        if self.thumbnails:
+            key["thumb"] = self.thumb.as_key()
+        return key
 
 # -----------------------
 # Утилиты
 # -----------------------
 
+def _render_clip(page: fitz.Page, clip: fitz.Rect, enc: ThumbnailOptions) -> bytes:
+    """Рендер области страницы в закодированное изображение (формат — по enc)."""
+    pix = page.get_pixmap(clip=clip, dpi=enc.dpi, colorspace=enc.render_colorspace)
+    return encode_pixmap(pix, enc)
+
+
+# Растр области всех превью страницы не должен превышать этот размер
+PAGE_RASTER_MAX_BYTES = 64 * 1024 * 1024
+
+
+def _render_clips(page: fitz.Page, clips: List[fitz.Rect], enc: ThumbnailOptions) -> List[bytes]:
+    """
+    Рендер всех превью страницы. Стратегия выбирается автоматически:
+      - одно превью — обычный page.get_pixmap(clip=...);
+      - несколько — один display list страницы на все превью (контент страницы
+        интерпретируется один раз, результат совпадает с get_pixmap попиксельно);
+      - плотная страница, где превью перекрываются и их суммарная площадь больше
+        охватывающей области, — эта область рендерится один раз, превью вырезаются из неё
+        (если растр укладывается в PAGE_RASTER_MAX_BYTES). Сетка пикселей та же, что при
+        рендере отдельной области, но сглаживание MuPDF зависит от области рендера, поэтому
+        такие превью совпадают с get_pixmap лишь приблизительно (на плотном листе A1 —
+        отличия до 22 единиц канала примерно в половине превью).
+    """
+    if not clips:
+        return []
+    if len(clips) == 1:
+        return [_render_clip(page, clips[0], enc)]
+
+    dl = page.get_displaylist()
+    zoom = enc.dpi / 72.0
+    mat = fitz.Matrix(zoom, zoom)
+    cs = enc.render_colorspace
+
+    visible = [c & dl.rect for c in clips]
+    union = fitz.Rect()
+    for c in visible:
+        if not c.is_empty:
+            union |= c
+    clips_px = sum(abs(c * mat) for c in visible if not c.is_empty)
+    union_px = abs(union * mat)
+
+    if not union.is_empty and union_px <= clips_px and union_px * cs.n <= PAGE_RASTER_MAX_BYTES:
+        big = dl.get_pixmap(matrix=mat, clip=union, colorspace=cs, alpha=False)
+        out = []
+        for clip, vis in zip(clips, visible):
+            irect = (vis * mat).irect & big.irect
+            if irect.is_empty:
+                out.append(encode_pixmap(dl.get_pixmap(matrix=mat, clip=clip, colorspace=cs, alpha=False), enc))
+                continue
+            pix = fitz.Pixmap(big.colorspace, irect, False)
+            pix.copy(big, irect)
+            out.append(encode_pixmap(pix, enc))
+        return out
+
+    return [encode_pixmap(dl.get_pixmap(matrix=mat, clip=clip, colorspace=cs, alpha=False), enc)
+            for clip in clips]
+
+
+def _rect_list(rect: fitz.Rect) -> List[float]:
+    return [round(rect.x0, 2), round(rect.y0, 2), round(rect.x1, 2), round(rect.y1, 2)]
+
+
 def _parse_revision_from_filename(file_name: str) -> Optional[int]:
     if not file_name:
         return None
@@ -61,30 +170,20 @@ def _get_file_prefix(file_name: str) -> str:
     return name.split('_')[0]
 
 
+def _file_context(file_path: str) -> Tuple[str, Optional[int], str]:
+    """Отображаемое имя, ревизия и префикс, которые выводятся из имени файла."""
+    file_name = os.path.basename(file_path)
+    display_file_name = file_name
+    if display_file_name.upper().startswith("EST-"):
+        display_file_name = display_file_name[4:]
+    return display_file_name, _parse_revision_from_filename(file_name), _get_file_prefix(file_name)
+
+
 def _normalize_flat_items(items: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
     """
     Приводим элементы к унифицированному виду, ожидаемому генераторами отчётов.
     """
-    norm: List[Dict[str, Any]] = []
-    for it in items or []:
-        sf = it.get("sourceFile") or {}
-        src = {
-            "name": (sf.get("name") if isinstance(sf, dict) else None) or it.get("fileName") or "",
-            "path": (sf.get("path") if isinstance(sf, dict) else None) or it.get("filePath") or "",
-        }
-        b64 = it.get("image_png_b64") or it.get("dataUrl") or ""
-        grid = it.get("grid") or it.get("gridCoord") or ""
-        norm.append({
-            "text": it.get("text", ""),
-            "composite_number": it.get("composite_number") or it.get("text", ""),
-            "page": it.get("page"),
-            "grid": grid,
-            "image_png_b64": b64,
-            "revision": it.get("revision"),
-            "comment": it.get("comment", ""),
-            "sourceFile": src,
-        })
-    return norm
+    return [normalize_item(it) for it in items or []]
 
 
 def _flatten_items_structure(items_any: Any) -> List[Dict[str, Any]]:
@@ -109,15 +208,25 @@ def _flatten_items_structure(items_any: Any) -> List[Dict[str, Any]]:
 # -----------------------
 
 def analyze_single_pdf(file_path: str, options: AnalyzeOptions) -> List[Dict[str, Any]]:
+    """
+    Анализ одного PDF. Сначала проверяется кэш результатов (если не отключён);
+    при options.workers > 1 большой документ делится на диапазоны страниц,
+    которые обрабатываются в пуле процессов.
+    """
+    return _analyze_paths(options, [file_path], cache=_open_cache(options),
+                          revisions=_open_revisions(options))[0]["items"]
+
+
+def _analyze_page_range(file_path: str, options: AnalyzeOptions,
+                        start: int = 0, stop: Optional[int] = None,
+                        sink: Optional[Callable[[Dict[str, Any]], None]] = None) -> List[Dict[str, Any]]:
+    """
+    Анализ страниц [start, stop) одного документа в текущем процессе.
+    Если задан sink, найденные элементы передаются в него сразу и не накапливаются.
+    """
     results: List[Dict[str, Any]] = []
     file_name = os.path.basename(file_path)
-    
-    display_file_name = file_name
-    if display_file_name.upper().startswith("EST-"):
-        display_file_name = display_file_name[4:]
-
-    revision = _parse_revision_from_filename(file_name)
-    prefix = _get_file_prefix(file_name)
+    display_file_name, revision, prefix = _file_context(file_path)
 
     number_pattern = re.compile(
         rf"\b{re.escape(options.prefix)}(?P<digits>\d{{1,{options.max_digits}}})(?!\d)"
@@ -125,16 +234,13 @@ def analyze_single_pdf(file_path: str, options: AnalyzeOptions) -> List[Dict[str
 
     try:
         doc: fitz.Document = fitz.open(file_path)
-        for page_num in range(len(doc)):
+        stop = len(doc) if stop is None else min(stop, len(doc))
+        for page_num in range(start, stop):
             page: fitz.Page = doc[page_num]
-            blocks = page.get_text("blocks")
-            for blk in blocks:
-                if len(blk) < 5:
-                    continue
-                x0, y0, x1, y1, text = blk[:5]
-                if not isinstance(text, str) or not text:
-                    continue
-
+            page_items: List[Dict[str, Any]] = []
+            page_clips: List[fitz.Rect] = []
+            # текст страницы разбирается один раз; рамки находок берутся из рамок символов
+            for text, boxes in iter_block_chars(page):
                 for m in number_pattern.finditer(text):
                     digits = m.group("digits")
                     if not (1 <= len(digits) <= options.max_digits):
@@ -143,47 +249,679 @@ def analyze_single_pdf(file_path: str, options: AnalyzeOptions) -> List[Dict[str
                     found_text = f"{options.prefix}{digits}"
                     composite = f"{prefix}{found_text}"
 
-                    instances = page.search_for(found_text, clip=fitz.Rect(x0, y0, x1, y1))
-                    if not instances:
+                    rect = span_rect(boxes, m.start(), m.end())
+                    if rect is None:
                         continue
-                    
-                    seen_rects = set()
-                    for rect in instances:
-                        key = (int(rect.x0), int(rect.y0), int(rect.x1), int(rect.y1))
-                        if key in seen_rects:
-                            continue
-                        seen_rects.add(key)
-
-                        center_x = (rect.x0 + rect.x1) / 2
-                        center_y = (rect.y0 + rect.y1) / 2
-
-                        cap_x0 = center_x - (options.cap_width * options.pos_x / 100.0)
-                        cap_y0 = center_y - (options.cap_height * options.pos_y / 100.0)
-                        cap_rect = fitz.Rect(cap_x0, cap_y0, cap_x0 + options.cap_width, cap_y0 + options.cap_height)
-
-                        pix = page.get_pixmap(clip=cap_rect, dpi=150)
-                        img_bytes = pix.tobytes("png")
-                        img_b64 = "data:image/png;base64," + base64.b64encode(img_bytes).decode("utf-8")
-
-                        # --- НОВОЕ: Конвертируем координаты из пунктов в миллиметры ---
-                        PT_TO_MM = 25.4 / 72.0
-                        grid_x_mm = int(rect.x0 * PT_TO_MM)
-                        grid_y_mm = int(rect.y0 * PT_TO_MM)
-
-                        results.append({
-                            "text": found_text,
-                            "composite_number": composite,
-                            "page": page_num + 1,
-                            "grid": f"{grid_x_mm},{grid_y_mm}", # <-- Отправляем координаты в мм
-                            "image_png_b64": img_b64,
-                            "revision": revision,
-                            "comment": "",
-                            "sourceFile": {"name": display_file_name, "path": file_path}
-                        })
+
+                    center_x = (rect.x0 + rect.x1) / 2
+                    center_y = (rect.y0 + rect.y1) / 2
+
+                    cap_x0 = center_x - (options.cap_width * options.pos_x / 100.0)
+                    cap_y0 = center_y - (options.cap_height * options.pos_y / 100.0)
+                    cap_rect = fitz.Rect(cap_x0, cap_y0, cap_x0 + options.cap_width, cap_y0 + options.cap_height)
+
+                    # --- НОВОЕ: Конвертируем координаты из пунктов в миллиметры ---
+                    PT_TO_MM = 25.4 / 72.0
+                    grid_x_mm = int(rect.x0 * PT_TO_MM)
+                    grid_y_mm = int(rect.y0 * PT_TO_MM)
+
+                    item = {
+                        "text": found_text,
+                        "composite_number": composite,
+                        "page": page_num + 1,
+                        "grid": f"{grid_x_mm},{grid_y_mm}", # <-- Отправляем координаты в мм
+                        # data URL превью (формат — по options.thumb, имя ключа историческое);
+                        # при options.thumb.store_dir вместо него — "image_path" (см. thumbnail_store.py)
+                        "image_png_b64": "",
+                        "revision": revision,
+                        "comment": "",
+                        "sourceFile": {"name": display_file_name, "path": file_path},
+                        # геометрия в пунктах PDF: найденный текст и область превью
+                        "rect": _rect_list(rect),
+                        "clip": _rect_list(cap_rect),
+                    }
+                    page_items.append(item)
+                    page_clips.append(cap_rect)
+
+            # превью рендерятся пакетом на страницу (см. _render_clips)
+            if options.thumbnails:
+                for item, data in zip(page_items, _render_clips(page, page_clips, options.thumb)):
+                    item.update(thumbnail_fields(data, options.thumb))
+            for item in page_items:
+                if sink is not None:
+                    sink(item)
+                else:
+                    results.append(item)
         doc.close()
     except Exception as e:
         logger.error(f"Failed to process {file_name}: {e}")
+        raise PartialAnalysisError(str(e), results) from e
     return results
+
+
+class PartialAnalysisError(Exception):
+    """Ошибка посреди документа; items — то, что успели найти до неё."""
+
+    def __init__(self, message: str, items: List[Dict[str, Any]]):
+        super().__init__(message, items)
+        self.items = items
+
+
+def _rebind_items(items: List[Dict[str, Any]], file_path: str) -> List[Dict[str, Any]]:
+    """Подставляет в закэшированные элементы поля, зависящие от имени и пути файла."""
+    display_file_name, revision, prefix = _file_context(file_path)
+    for it in items:
+        it["composite_number"] = f"{prefix}{it.get('text', '')}"
+        it["revision"] = revision
+        it["sourceFile"] = {"name": display_file_name, "path": file_path}
+    return items
+
+
+def _thumbnails_available(items: List[Dict[str, Any]]) -> bool:
+    """Все файлы превью, на которые ссылаются элементы из кэша, ещё есть в хранилище."""
+    return all(has_thumbnail(it) for it in items if it.get("image_path"))
+
+
+def _open_cache(options: AnalyzeOptions) -> Optional[AnalysisCache]:
+    if not options.use_cache:
+        return None
+    try:
+        return AnalysisCache(options.cache_dir, options.cache_max_mb * 1024 * 1024)
+    except OSError as e:
+        logger.warning(f"Analysis cache disabled: {e}")
+        return None
+
+
+def _open_revisions(options: AnalyzeOptions) -> Optional[RevisionIndex]:
+    if not options.use_cache or not options.incremental:
+        return None
+    try:
+        return RevisionIndex(os.path.join(options.cache_dir, "revisions") if options.cache_dir else None)
+    except OSError as e:
+        logger.warning(f"Incremental analysis disabled: {e}")
+        return None
+
+
+def _file_fingerprints(path: str) -> List[str]:
+    """Отпечатки страниц файла (см. revision_index.page_fingerprints); пусто, если файл не читается."""
+    try:
+        with fitz.open(path) as doc:
+            return page_fingerprints(doc)
+    except Exception as e:
+        logger.warning(f"Failed to fingerprint pages of {path}: {e}")
+        return []
+
+
+def _plan_revision(fingerprints: List[str], previous: Dict[str, List[Dict[str, Any]]]
+                   ) -> Tuple[List[Tuple[int, List[Dict[str, Any]]]], List[Tuple[int, Optional[int]]]]:
+    """
+    Делит страницы новой ревизии на неизменённые и изменённые по отпечаткам предыдущей.
+    Возвращает (готовые части [(первая страница, находки)], диапазоны [start, stop) для анализа);
+    соседние страницы объединяются. Страница, у которой пропали файлы превью, считается изменённой.
+    """
+    reused: List[List[Any]] = []
+    changed: List[List[int]] = []
+    for i, fp in enumerate(fingerprints):
+        items = previous.get(fp)
+        if items is None or not _thumbnails_available(items):
+            if changed and changed[-1][1] == i:
+                changed[-1][1] = i + 1
+            else:
+                changed.append([i, i + 1])
+            continue
+        page_items = [dict(it, page=i + 1) for it in items]
+        if reused and reused[-1][1] == i:
+            reused[-1][1] = i + 1
+            reused[-1][2].extend(page_items)
+        else:
+            reused.append([i, i + 1, page_items])
+    return [(start, items) for start, _, items in reused], [(start, stop) for start, stop in changed]
+
+
+def render_thumbnails(targets: List[Dict[str, Any]],
+                      enc: Optional[ThumbnailOptions] = None) -> List[Optional[Dict[str, str]]]:
+    """
+    Рендерит превью по запросу: targets — [{"path", "page" (с 1), "clip": [x0, y0, x1, y1]}].
+    enc — параметры кодирования (по умолчанию PNG RGB 150 dpi).
+    Возвращает поля превью ({"image_png_b64"} или {"image_path"}, см. thumbnail_fields)
+    в том же порядке (None при ошибке). Каждый файл открывается один раз.
+    """
+    enc = enc or ThumbnailOptions({})
+    out: List[Optional[Dict[str, str]]] = [None] * len(targets)
+    by_file: Dict[str, List[int]] = {}
+    for i, t in enumerate(targets):
+        by_file.setdefault(t.get("path") or "", []).append(i)
+
+    for path, indices in by_file.items():
+        try:
+            doc = fitz.open(path)
+        except Exception as e:
+            logger.error(f"Failed to open {path} for rendering: {e}")
+            continue
+        with doc:
+            for i in indices:
+                t = targets[i]
+                try:
+                    page = doc[int(t["page"]) - 1]
+                    out[i] = thumbnail_fields(_render_clip(page, fitz.Rect(t["clip"]), enc), enc)
+                except Exception as e:
+                    logger.error(f"Failed to render thumbnail for {path} page {t.get('page')}: {e}")
+    return out
+
+
+def _fill_missing_thumbnails(items: List[Dict[str, Any]], enc: ThumbnailOptions) -> None:
+    """Дорисовывает превью для нормализованных элементов, пришедших без изображения."""
+    missing = [it for it in items
+               if not has_thumbnail(it) and it.get("clip") and it["sourceFile"].get("path")]
+    if not missing:
+        return
+    images = render_thumbnails([
+        {"path": it["sourceFile"]["path"], "page": it.get("page"), "clip": it["clip"]} for it in missing
+    ], enc)
+    for it, fields in zip(missing, images):
+        if fields:
+            it.update(fields)
+
+
+# -----------------------
+# Параллельный анализ
+# -----------------------
+
+# Пул процессов переиспользуется между запросами в serve-режиме
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_size: int = 0
+
+
+def _get_pool(workers: int) -> ProcessPoolExecutor:
+    global _pool, _pool_size
+    if _pool is None or _pool_size != workers:
+        _shutdown_pool()
+        _pool = ProcessPoolExecutor(max_workers=workers)
+        _pool_size = workers
+    return _pool
+
+
+def _shutdown_pool() -> None:
+    global _pool, _pool_size
+    if _pool is not None:
+        _pool.shutdown(wait=True, cancel_futures=True)
+    _pool, _pool_size = None, 0
+
+
+# Меньше шарды не делаем: каждый процесс заново открывает документ
+SHARD_MIN_PAGES = 8
+
+
+def _estimate_cost(path: str) -> int:
+    """Оценка трудоёмкости файла для планирования: размер файла в байтах."""
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+
+def _page_count(path: str) -> int:
+    try:
+        with fitz.open(path) as doc:
+            return len(doc)
+    except Exception:
+        return 0
+
+
+def _plan_page_shards(page_count: int, workers: int) -> List[Tuple[int, Optional[int]]]:
+    """Делит документ на диапазоны страниц [start, stop) для пула процессов."""
+    if workers <= 1 or page_count < 2 * SHARD_MIN_PAGES:
+        return [(0, None)]
+    size = max(SHARD_MIN_PAGES, math.ceil(page_count / (workers * 2)))
+    return [(s, min(s + size, page_count)) for s in range(0, page_count, size)]
+
+
+def _plan_range_shards(start: int, stop: Optional[int], workers: int) -> List[Tuple[int, Optional[int]]]:
+    """_plan_page_shards для диапазона страниц [start, stop); stop=None — до конца документа."""
+    if stop is None:
+        return [(start, None)]
+    return [(start + s, stop if e is None else start + e) for s, e in _plan_page_shards(stop - start, workers)]
+
+
+ItemSink = Callable[[int, Dict[str, Any]], None]
+FileSink = Callable[[int, List[Dict[str, Any]], int], None]
+
+
+def _analyze_paths(options: AnalyzeOptions, paths: List[str],
+                   on_item: Optional[ItemSink] = None,
+                   on_file: Optional[FileSink] = None,
+                   cache: Optional[AnalysisCache] = None,
+                   revisions: Optional[RevisionIndex] = None) -> List[Dict[str, Any]]:
+    """
+    Анализирует пакет файлов. При options.workers > 1 работа делится на задачи
+    (файл, диапазон страниц) и распределяется по пулу процессов, крупные — первыми.
+    Результаты всегда в порядке входных путей и страниц, как при последовательном
+    анализе; ошибка в одном файле даёт пустой список items только для него.
+
+    Потоковый режим: on_item(index, item) вызывается для каждой находки,
+    on_file(index, items, count) — по готовности файла (в порядке завершения).
+    Если задан on_item, в on_file приходит пустой список. В потоковом режиме
+    items не накапливаются: вместо них в результате возвращается count.
+
+    Если передан cache, файлы с попаданием в кэш не открываются, а результаты
+    успешно проанализированных файлов сохраняются в него.
+
+    Если передан revisions, страницы, не изменившиеся с предыдущей ревизии того же чертежа
+    (по отпечаткам, см. revision_index.py), не анализируются: находки берутся из индекса.
+    Число взятых и пересчитанных страниц — в "pages" элемента результата.
+    """
+    streaming = on_item is not None or on_file is not None
+    keep_items = on_item is None or cache is not None or revisions is not None
+
+    results: List[List[Dict[str, Any]]] = [[] for _ in paths]
+    keys: List[Optional[str]] = [None] * len(paths)
+    failed = [False] * len(paths)
+    chunks: Dict[Tuple[int, int], List[Dict[str, Any]]] = {}
+    remaining = [0] * len(paths)
+    counts = [0] * len(paths)
+    fingerprints: List[List[str]] = [[] for _ in paths]
+    revision_keys: List[Optional[str]] = [None] * len(paths)
+    page_stats: List[Optional[Dict[str, int]]] = [None] * len(paths)
+
+    def finish_file(idx: int) -> None:
+        items: List[Dict[str, Any]] = []
+        for key in sorted(k for k in chunks if k[0] == idx):
+            items.extend(chunks.pop(key))
+        if cache is not None and keys[idx] and not failed[idx]:
+            cache.put(keys[idx], items)
+        if revisions is not None and revision_keys[idx] and not failed[idx]:
+            revisions.save(revision_keys[idx], fingerprints[idx], items)
+        if on_file is not None:
+            on_file(idx, [] if on_item is not None else items, counts[idx])
+        if not streaming:
+            results[idx] = items
+
+    def finish_chunk(idx: int, start: int, items: List[Dict[str, Any]], emitted: bool = False) -> None:
+        if not emitted:
+            counts[idx] += len(items)
+            if on_item is not None:
+                for it in items:
+                    on_item(idx, it)
+        chunks[(idx, start)] = items if keep_items else []
+        remaining[idx] -= 1
+        if remaining[idx] == 0:
+            finish_file(idx)
+
+    # (индекс файла, start, stop, оценка стоимости)
+    tasks: List[Tuple[int, int, Optional[int], float]] = []
+    for idx, p in enumerate(paths):
+        if cache is not None:
+            keys[idx] = cache.key_for(p, options.result_key())
+            cached = cache.get(keys[idx], _thumbnails_available) if keys[idx] else None
+            if cached is not None:
+                keys[idx] = None  # запись уже есть, повторно не сохраняем
+                remaining[idx] = 1
+                finish_chunk(idx, 0, _rebind_items(cached, p))
+                continue
+
+        size = _estimate_cost(p)
+        reused: List[Tuple[int, List[Dict[str, Any]]]] = []
+        if revisions is not None:
+            fingerprints[idx] = _file_fingerprints(p)
+        if fingerprints[idx]:
+            pages = len(fingerprints[idx])
+            revision_keys[idx] = revisions.drawing_key(p, options.result_key())
+            reused, ranges = _plan_revision(fingerprints[idx], revisions.previous_pages(revision_keys[idx]))
+            recomputed = sum(stop - start for start, stop in ranges)
+            revisions.record(pages - recomputed, recomputed)
+            page_stats[idx] = {"reused": pages - recomputed, "recomputed": recomputed}
+        else:
+            pages = _page_count(p) if options.workers > 1 else 0
+            ranges = [(0, pages or None)]
+        for range_start, range_stop in ranges:
+            for start, stop in _plan_range_shards(range_start, range_stop, options.workers):
+                share = ((stop - start) / pages) if stop is not None else 1.0
+                tasks.append((idx, start, stop, size * share))
+                remaining[idx] += 1
+        # готовые страницы — отдельными частями файла; задачи уже учтены в remaining
+        remaining[idx] += len(reused)
+        for start, items in reused:
+            finish_chunk(idx, start, _rebind_items(items, p))
+
+    def run_serial(task_list: List[Tuple[int, int, Optional[int], float]]) -> None:
+        for idx, start, stop, _ in task_list:
+            items: List[Dict[str, Any]] = []
+            sink = None
+            if on_item is not None:
+                def sink(item: Dict[str, Any], idx: int = idx, items: List[Dict[str, Any]] = items) -> None:
+                    counts[idx] += 1
+                    on_item(idx, item)
+                    if keep_items:
+                        items.append(item)
+            try:
+                found = _analyze_page_range(paths[idx], options, start, stop, sink=sink)
+                if sink is None:
+                    items = found
+            except Exception as e:
+                failed[idx] = True
+                if isinstance(e, PartialAnalysisError):
+                    items = items if sink is not None else e.items
+                else:
+                    logger.exception(f"Analyze failed for {paths[idx]}")
+            finish_chunk(idx, start, items, emitted=sink is not None)
+
+    if options.workers <= 1 or len(tasks) <= 1:
+        run_serial(tasks)
+    else:
+        tasks.sort(key=lambda t: t[3], reverse=True)
+        try:
+            pool = _get_pool(options.workers)
+            futures = {
+                pool.submit(_analyze_page_range, paths[idx], options, start, stop): (idx, start)
+                for idx, start, stop, _ in tasks
+            }
+        except Exception:
+            logger.exception("Failed to start worker pool, falling back to serial analysis")
+            _shutdown_pool()
+            run_serial(tasks)
+        else:
+            for fut in as_completed(futures):
+                idx, start = futures[fut]
+                try:
+                    items = fut.result()
+                except Exception as e:
+                    failed[idx] = True
+                    if isinstance(e, PartialAnalysisError):
+                        items = e.items
+                    else:
+                        logger.exception(f"Analyze failed for {paths[idx]} (from page {start + 1})")
+                        items = []
+                finish_chunk(idx, start, items)
+            # упавший процесс ломает весь пул — следующий запрос создаст новый
+            if getattr(pool, "_broken", False):
+                _shutdown_pool()
+
+    out = [{"filePath": p, "count": counts[idx]} if streaming else {"filePath": p, "items": results[idx]}
+           for idx, p in enumerate(paths)]
+    for entry, stats in zip(out, page_stats):
+        if stats is not None:
+            entry["pages"] = stats
+    return out
+
+
+def _stream_sinks(mode: str, paths: List[str],
+                  emit: Callable[[Dict[str, Any]], None]) -> Dict[str, Any]:
+    """Колбэки _analyze_paths, превращающие результаты в NDJSON-события."""
+    if mode == "file":
+        return {
+            "on_file": lambda idx, items, count: emit(
+                {"type": "file", "index": idx, "filePath": paths[idx], "items": items}),
+        }
+    if mode == "item":
+        return {
+            "on_item": lambda idx, item: emit(
+                {"type": "item", "index": idx, "filePath": paths[idx], "item": item}),
+            "on_file": lambda idx, items, count: emit(
+                {"type": "file", "index": idx, "filePath": paths[idx], "count": count}),
+        }
+    raise ValueError(f"Unknown stream mode: {mode}")
+
+
+# -----------------------
+# Команды (общие для CLI и serve)
+# -----------------------
+
+def _store_sinks(store: ResultsStore, run_id: int, sinks: Dict[str, Any]) -> Dict[str, Any]:
+    """Колбэки _analyze_paths, сохраняющие находки в базу (поверх колбэков потокового вывода)."""
+    on_item: Optional[ItemSink] = sinks.get("on_item")
+    on_file: Optional[FileSink] = sinks.get("on_file")
+
+    def store_item(idx: int, item: Dict[str, Any]) -> None:
+        store.add_items(run_id, [item])
+        on_item(idx, item)
+
+    def store_file(idx: int, items: List[Dict[str, Any]], count: int) -> None:
+        if on_item is None:
+            store.add_items(run_id, items)
+        store.commit()
+        if on_file is not None:
+            on_file(idx, items, count)
+
+    return {"on_item": store_item if on_item is not None else None, "on_file": store_file}
+
+
+def _run_analyze(options: AnalyzeOptions, paths: List[str],
+                 emit: Callable[[Dict[str, Any]], None]) -> Dict[str, Any]:
+    """
+    Команда analyze: данные ответа {"files": [...], "cache": {...}}; события потока — через emit.
+    При options.store_results находки сохраняются в базу, в "files" — только их число,
+    в "store" — {"path", "run_id"} для команды query.
+    """
+    sinks = _stream_sinks(options.stream, paths, emit) if options.stream else {}
+    cache = _open_cache(options)
+    revisions = _open_revisions(options)
+    store = ResultsStore(options.store_path, options.store_keep_runs) if options.store_results else None
+    try:
+        if store is not None:
+            run_id = store.begin_run(paths, options.result_key())
+            sinks = _store_sinks(store, run_id, sinks)
+        data: Dict[str, Any] = {"files": _analyze_paths(options, paths, cache=cache, revisions=revisions, **sinks)}
+        if store is not None:
+            data["store"] = {"path": store.path, "run_id": run_id}
+    finally:
+        if store is not None:
+            store.close()
+    if cache is not None:
+        data["cache"] = cache.stats()
+    if revisions is not None:
+        data["revisions"] = revisions.stats()
+    return data
+
+
+def _run_query(request: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Команда query: страница находок из базы результатов.
+    Запрос: {"store": путь (по умолчанию — стандартный), "run_id": (по умолчанию — последний),
+             "filter": {"number", "text", "file", "page", "revision"}, "sort": id | number | file | page | revision,
+             "desc": bool, "offset": 0, "limit": 100, "thumbnails": true, "runs": false}
+    "runs": true — в ответ добавляется список сохранённых запусков.
+    """
+    with ResultsStore(request.get("store")) as store:
+        data = store.query(request.get("run_id"), request.get("filter") or {},
+                           sort=request.get("sort") or "id", desc=bool(request.get("desc", False)),
+                           offset=int(request.get("offset", 0)), limit=int(request.get("limit", 100)),
+                           thumbnails=bool(request.get("thumbnails", True)))
+        if request.get("runs"):
+            data["runs"] = store.runs()
+    return data
+
+
+def _run_index(request: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Команда index: обновление обратного индекса номеров (см. tag_index.py).
+    Запрос: {"index": путь (по умолчанию — стандартный), "files": [...] — добавленные или изменённые,
+             "remove": [...] — удалённые, "prune": false — убрать пропавшие с диска, "options": {...}}
+    Анализируются только файлы, которых нет в индексе или которые изменились; превью индексу
+    не нужны, поэтому по умолчанию анализ идёт с thumbnails=false.
+    """
+    options = AnalyzeOptions({"thumbnails": False, **(request.get("options") or {})})
+    # от остальных опций ссылки в индексе не зависят
+    options_key = json.dumps({"prefix": options.prefix, "max_digits": options.max_digits}, sort_keys=True)
+    files = request.get("files") or []
+    with TagIndex(request.get("index")) as index:
+        removed = index.remove_files(request.get("remove") or [])
+        if request.get("prune"):
+            removed += len(index.prune_missing())
+        todo = index.stale(files, options_key)
+        paths = list(todo)
+
+        def on_file(idx: int, items: List[Dict[str, Any]], count: int) -> None:
+            index.replace_file(paths[idx], todo[paths[idx]], options_key, items)
+
+        _analyze_paths(options, paths, on_file=on_file,
+                       cache=_open_cache(options), revisions=_open_revisions(options))
+        unchanged = sum(1 for p in set(files) if p not in todo and os.path.exists(p))
+        return {"path": index.path, "indexed": len(paths), "unchanged": unchanged,
+                "removed": removed, **index.stats()}
+
+
+def _run_lookup(request: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Команда lookup: где встречается номер. Запрос: {"index": путь, "number": "W1234",
+    "prefix": false, "offset": 0, "limit": 1000}; ответ — см. TagIndex.lookup.
+    """
+    number = str(request.get("number") or "")
+    if not number:
+        raise ValueError("lookup: number is required")
+    with TagIndex(request.get("index")) as index:
+        return index.lookup(number, prefix=bool(request.get("prefix", False)),
+                            offset=int(request.get("offset", 0)),
+                            limit=int(request.get("limit", 1000)))
+
+
+def _store_items(source: Dict[str, Any], thumbnails: bool) -> Iterator[Dict[str, Any]]:
+    """Находки для экспорта прямо из базы результатов (payload["source"], поля — как у query)."""
+    with ResultsStore(source.get("store")) as store:
+        yield from store.iter_items(source.get("run_id"), source.get("filter") or {},
+                                    sort=source.get("sort") or "id", desc=bool(source.get("desc", False)),
+                                    thumbnails=thumbnails)
+
+
+def _export_to_tempfile(payload: Dict[str, Any], items: Optional[Iterable[Dict[str, Any]]] = None) -> str:
+    """
+    Генерирует отчёт по payload экспорта и возвращает путь к временному файлу.
+    items — плоские элементы потоком (export_stream.read_export_payload); по умолчанию payload["items"],
+    а при payload["source"] = {"store", "run_id", "filter", "sort", "desc"} — выборка из базы результатов.
+    TXT и CSV пишутся в файл по мере чтения элементов; PDF верстается по полному списку.
+    """
+    options_dict: Dict[str, Any] = payload.get("options", {})
+    file_format: str = payload.get("format", "pdf").lower()
+    if items is None and payload.get("source"):
+        # превью из базы нужны только PDF
+        items = _store_items(payload["source"], thumbnails=file_format == "pdf")
+    elif items is None:
+        items = _flatten_items_structure(payload.get("items", []))
+
+    if file_format == "pdf":
+        norm_items = _normalize_flat_items(list(items))
+        _fill_missing_thumbnails(norm_items, ThumbnailOptions(options_dict))
+        from report_generator_pdf import write_pdf_report  # type: ignore
+        # PDF пишется в файл по мере генерации, без копии документа в памяти;
+        # большие отчёты верстаются частями в нескольких процессах (как workers в анализе)
+        workers = int(options_dict.get("workers", 0)) or (os.cpu_count() or 1)
+        fd, path = tempfile.mkstemp(suffix=".pdf")
+        os.close(fd)
+        write_pdf_report(norm_items, options_dict, path, workers=workers)
+        return path
+    elif file_format == "txt":
+        from report_generator_text import write_txt_report as write_report  # type: ignore
+    elif file_format == "csv":
+        from report_generator_text import write_csv_report as write_report  # type: ignore
+    else:
+        raise ValueError(f"Unknown export format: {file_format}")
+
+    with tempfile.NamedTemporaryFile(mode="w", suffix=f".{file_format}", delete=False, encoding="utf-8") as tmp:
+        try:
+            write_report(map(normalize_item, items), options_dict, tmp)
+        except Exception:
+            tmp.close()
+            os.remove(tmp.name)
+            raise
+        return tmp.name
+
+
+# -----------------------
+# Резидентный режим (serve)
+# -----------------------
+
+def _write_message(message: Dict[str, Any]) -> None:
+    print(json.dumps(message, ensure_ascii=False), flush=True)
+
+
+def _handle_request(request: Dict[str, Any],
+                    emit: Callable[[Dict[str, Any]], None]) -> Dict[str, Any]:
+    """
+    Обрабатывает один запрос serve-режима и возвращает тело ответа (без id).
+    Формат запроса: {"id": ..., "command": "ping" | "analyze" | "export" | "render" | "query" | "index" | "lookup"
+                     | "shutdown", ...}
+      analyze: {"options": {...}, "files": [...]}
+      export:  {"payload": {"format": ..., "options": {...}, "items": [...]}}
+               или {"payload": {"format": ..., "options": {...}, "source": {"run_id": ..., "filter": {...}}}}
+      query:   {"run_id": ..., "filter": {...}, "sort": ..., "offset": ..., "limit": ...} (см. _run_query)
+      index:   {"files": [...], "remove": [...], "options": {...}} (см. _run_index)
+      lookup:  {"number": ..., "prefix": false, "offset": ..., "limit": ...} (см. _run_lookup)
+      render:  {"items": [{"path": ..., "page": ..., "clip": [x0, y0, x1, y1]}, ...], "options": {...}}
+    Промежуточные события (options.stream) отправляются через emit до финального ответа.
+    """
+    command = request.get("command")
+
+    if command == "ping":
+        return {"data": {"status": "ok", "pid": os.getpid()}}
+
+    if command == "shutdown":
+        return {"data": {"status": "bye"}}
+
+    if command == "analyze":
+        options = AnalyzeOptions(request.get("options") or {})
+        paths = request.get("files") or []
+        return {"data": _run_analyze(options, paths, emit)}
+
+    if command == "export":
+        return {"data": {"filePath": _export_to_tempfile(request.get("payload") or {})}}
+
+    if command == "render":
+        enc = ThumbnailOptions(request.get("options") or {})
+        return {"data": {"images": render_thumbnails(request.get("items") or [], enc)}}
+
+    if command == "query":
+        return {"data": _run_query(request)}
+
+    if command == "index":
+        return {"data": _run_index(request)}
+
+    if command == "lookup":
+        return {"data": _run_lookup(request)}
+
+    raise ValueError(f"Unknown command: {command}")
+
+
+def serve() -> None:
+    """
+    Резидентный режим: читает JSON-запросы построчно из stdin и пишет
+    по одному JSON-ответу на строку в stdout. Каждый ответ содержит "id" запроса.
+    Завершается по команде "shutdown" или при закрытии stdin.
+    """
+    sys.stdin.reconfigure(encoding="utf-8")
+    logger.info("Backend worker ready (pid %s)", os.getpid())
+
+    for line in sys.stdin:
+        line = line.strip()
+        if not line:
+            continue
+
+        try:
+            request = json.loads(line)
+            if not isinstance(request, dict):
+                raise ValueError("Request must be a JSON object")
+        except Exception as e:
+            _write_message({"id": None, "error": True, "message": f"Invalid request JSON: {e}"})
+            continue
+
+        req_id = request.get("id")
+
+        def emit(event: Dict[str, Any], req_id: Any = req_id) -> None:
+            _write_message({"id": req_id, "event": event})
+
+        try:
+            response = _handle_request(request, emit)
+        except Exception as e:
+            logger.exception(f"Request {req_id} failed")
+            response = {"error": True, "message": str(e)}
+
+        _write_message({"id": req_id, **response})
+
+        if request.get("command") == "shutdown":
+            break
+
+    _shutdown_pool()
+    logger.info("Backend worker stopped")
+
+
 # -----------------------
 # Точка входа
 # -----------------------
@@ -209,56 +947,73 @@ def main():
                 return
 
             options = AnalyzeOptions(options_payload)
-            paths = sys.argv[3:] if len(sys.argv) >= 4 else []
+            args = sys.argv[3:] if len(sys.argv) >= 4 else []
+            if "--no-cache" in args:
+                options.use_cache = False
+            paths = [a for a in args if a != "--no-cache"]
 
-            files_out = []
-            for p in paths:
-                try:
-                    items = analyze_single_pdf(p, options)
-                except Exception:
-                    logger.exception(f"Analyze failed for {p}")
-                    items = []
-                files_out.append({"filePath": p, "items": items})
+            try:
+                data = _run_analyze(options, paths, _write_message)
+            finally:
+                _shutdown_pool()
 
-            print(json.dumps({"data": {"files": files_out}}, ensure_ascii=False), flush=True)
+            if options.stream:
+                _write_message({"type": "done", "data": data})
+            else:
+                print(json.dumps({"data": data}, ensure_ascii=False), flush=True)
             return
 
         elif command == "export":
+            # payload читается из stdin потоком: элементы (с превью в base64) не собираются в памяти целиком
+            try:
+                payload, items = read_export_payload(sys.stdin)
+                print(_export_to_tempfile(payload, items), flush=True)
+            except ExportPayloadError as e:
+                print(json.dumps({"error": True, "message": f"Invalid export payload JSON: {e}"}), file=sys.stderr)
+                sys.exit(1)
+            return
+
+        elif command == "render":
             raw = sys.stdin.read()
             try:
                 payload = json.loads(raw) if raw else {}
             except Exception as e:
-                print(json.dumps({"error": True, "message": f"Invalid export payload JSON: {e}"}), file=sys.stderr)
+                print(json.dumps({"error": True, "message": f"Invalid render payload JSON: {e}"}), file=sys.stderr)
                 sys.exit(1)
 
-            options_dict: Dict[str, Any] = payload.get("options", {})
-            items_dict: List[Dict[str, Any]] = payload.get("items", [])
-            file_format: str = payload.get("format", "pdf").lower()
-
-            flat_items = _flatten_items_structure(items_dict)
-            norm_items = _normalize_flat_items(flat_items)
-
-            if file_format == "pdf":
-                from report_generator_pdf import generate_pdf_report  # type: ignore
-                content = generate_pdf_report(norm_items, options_dict)
-                suffix, mode = ".pdf", "wb"
-            elif file_format == "txt":
-                from report_generator_text import generate_txt_report  # type: ignore
-                content = generate_txt_report(norm_items, options_dict)
-                suffix, mode = ".txt", "w"
-            elif file_format == "csv":
-                from report_generator_text import generate_csv_report  # type: ignore
-                content = generate_csv_report(norm_items, options_dict)
-                suffix, mode = ".csv", "w"
-            else:
-                raise ValueError(f"Unknown export format: {file_format}")
-
-            with tempfile.NamedTemporaryFile(
-                mode=mode, suffix=suffix, delete=False,
-                encoding=("utf-8" if mode == "w" else None)
-            ) as tmp:
-                tmp.write(content)
-                print(tmp.name, flush=True)
+            enc = ThumbnailOptions(payload.get("options") or {})
+            images = render_thumbnails(payload.get("items") or [], enc)
+            print(json.dumps({"data": {"images": images}}, ensure_ascii=False), flush=True)
+            return
+
+        elif command == "query":
+            raw = sys.stdin.read()
+            try:
+                request = json.loads(raw) if raw else {}
+            except Exception as e:
+                print(json.dumps({"error": True, "message": f"Invalid query JSON: {e}"}), file=sys.stderr)
+                sys.exit(1)
+
+            print(json.dumps({"data": _run_query(request)}, ensure_ascii=False), flush=True)
+            return
+
+        elif command in ("index", "lookup"):
+            raw = sys.stdin.read()
+            try:
+                request = json.loads(raw) if raw else {}
+            except Exception as e:
+                print(json.dumps({"error": True, "message": f"Invalid {command} JSON: {e}"}), file=sys.stderr)
+                sys.exit(1)
+
+            try:
+                data = _run_index(request) if command == "index" else _run_lookup(request)
+            finally:
+                _shutdown_pool()
+            print(json.dumps({"data": data}, ensure_ascii=False), flush=True)
+            return
+
+        elif command == "serve":
+            serve()
             return
 
         else:
@@ -271,5 +1026,5 @@ def main():
 
 
 if __name__ == "__main__":
+    multiprocessing.freeze_support()  # нужно для пула процессов в сборке PyInstaller
     main()
-
@@ -4,9 +4,13 @@ import os
 import re
 import json
 import logging
-import base64
 import io
-from typing import List, Dict, Any, Optional
+import time
+import queue
+import threading
+import tempfile
+from collections import Counter
+from typing import List, Dict, Any, Optional, Tuple, Callable, Iterator, Iterable
 
 try:
     import fitz  # PyMuPDF
@@ -16,7 +20,14 @@ except ImportError as e:
     sys.exit(1)
 
 # --- OCR движок (EasyOCR) ---
-from ocr_engine import NeuralOCREngine, rasterize_page, page_has_text
+from ocr_engine import (NeuralOCREngine, rasterize_page, rasterize_region, page_has_text, image_regions,
+                        scan_fingerprint, tile_grid, prime_image_cache,
+                        DEFAULT_BATCH_SIZE, DEFAULT_TILE_PX, DEFAULT_TILE_OVERLAP_PX)
+from export_stream import ExportPayloadError, normalize_item, read_export_payload
+from ocr_cache import OCRCache
+from text_layer import iter_block_chars, span_rect
+from thumbnail_encoding import ThumbnailOptions, encode_pil, encode_pixmap
+from thumbnail_store import thumbnail_fields
 
 # -----------------------
 # Логирование
@@ -24,6 +35,18 @@ from ocr_engine import NeuralOCREngine, rasterize_page, page_has_text
 logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
 logger = logging.getLogger(__name__)
 
+# DPI растра для распознавания (и для превью найденных по OCR номеров)
+OCR_DPI = 400
+
+# Двухпроходный OCR: какие строки, найденные детектором, могут быть тегом
+TAG_MIN_HEIGHT_PT = 2.0    # высота строки в пунктах PDF
+TAG_MAX_HEIGHT_PT = 36.0
+TAG_MAX_ASPECT = 25.0      # ширина / высота (детектор объединяет слова строки)
+REGION_PAD = 0.25          # поля вокруг кандидата, доля высоты строки
+
+# Превью номера: screenshot_width/height заданы в пикселях при этом DPI
+CAPTURE_DPI = 150
+
 # -----------------------
 # Опции анализа
 # -----------------------
@@ -38,6 +61,48 @@ class AnalyzeOptions:
         self.dedup_csv: bool = data.get("dedup_csv", False)
         self.max_digits: int = int(data.get("max_digits", 5))
         self.ocr_lang: str = data.get("ocr_lang", "en")
+        # размер пачки распознавателя и число сканированных страниц на один пакетный вызов OCR
+        self.ocr_batch_size: int = max(1, int(data.get("ocr_batch_size") or DEFAULT_BATCH_SIZE))
+        self.ocr_batch_pages: int = max(1, int(data.get("ocr_batch_pages") or 4))
+        # двухпроходный режим: детектор на растре ocr_detect_dpi, распознавание только кандидатов на OCR_DPI
+        self.ocr_two_pass: bool = bool(data.get("ocr_two_pass", False))
+        self.ocr_detect_dpi: int = int(data.get("ocr_detect_dpi") or 150)
+        # страницы, чей растр на OCR_DPI больше ocr_max_raster_mb, распознаются по тайлам
+        self.ocr_max_raster_mb: int = int(data.get("ocr_max_raster_mb") or 256)
+        self.ocr_tile_px: int = int(data.get("ocr_tile_px") or DEFAULT_TILE_PX)
+        self.ocr_tile_overlap_px: int = int(data.get("ocr_tile_overlap_px") or DEFAULT_TILE_OVERLAP_PX)
+        # гибридный режим: на страницах с текстовым слоем дополнительно распознаются встроенные картинки
+        # (каждая в своём разрешении); картинки меньше ocr_region_min_pt по любой стороне пропускаются
+        self.ocr_image_regions: bool = bool(data.get("ocr_image_regions", False))
+        self.ocr_region_min_pt: float = float(data.get("ocr_region_min_pt") or 36)
+        # движок OCR: easyocr (torch) | onnx (ONNX Runtime, модели — export_onnx_models.py);
+        # для onnx — каталог моделей, INT8-модели и потоки (0 — по умолчанию ONNX Runtime)
+        self.ocr_engine: str = str(data.get("ocr_engine") or "easyocr").lower()
+        self.ocr_model_dir: str = str(data.get("ocr_model_dir") or "")
+        self.ocr_int8: bool = bool(data.get("ocr_int8", False))
+        self.ocr_intra_threads: int = int(data.get("ocr_intra_threads") or 0)
+        self.ocr_inter_threads: int = int(data.get("ocr_inter_threads") or 0)
+        # кэш результатов OCR на диске (см. ocr_cache.py): повторный анализ тех же сканов без нейросети
+        self.ocr_cache: bool = bool(data.get("ocr_cache", True))
+        self.ocr_cache_dir: Optional[str] = data.get("ocr_cache_dir")
+        self.ocr_cache_max_mb: int = int(data.get("ocr_cache_max_mb", 256))
+        # конвейер OCR сканов: рендер следующих страниц и кодирование превью идут в потоках,
+        # пока нейросеть распознаёт текущую пачку; ocr_encode_threads — потоки кодирования превью
+        self.ocr_pipeline: bool = bool(data.get("ocr_pipeline", True))
+        self.ocr_encode_threads: int = max(1, int(data.get("ocr_encode_threads") or 2))
+        # формат, цвет, dpi и сжатие превью (thumb_* в опциях)
+        self.thumb: ThumbnailOptions = ThumbnailOptions(data)
+
+    def engine_options(self) -> Dict[str, Any]:
+        """Параметры движка OCR для NeuralOCREngine (у easyocr их нет)."""
+        if self.ocr_engine != "onnx":
+            return {}
+        return {
+            "model_dir": self.ocr_model_dir or None,
+            "int8": self.ocr_int8,
+            "intra_threads": self.ocr_intra_threads,
+            "inter_threads": self.ocr_inter_threads,
+        }
 
 # -----------------------
 # Утилиты для имени файла
@@ -59,11 +124,25 @@ def _get_file_prefix(file_name: str) -> str:
         name = name[4:]
     return name.split('_')[0]
 
+def _number_pattern(options: AnalyzeOptions) -> "re.Pattern":
+    return re.compile(rf"\b{re.escape(options.prefix)}(?P<digits>\d{{1,{options.max_digits}}})(?!\d)")
+
+def _capture_rect(center_x: float, center_y: float, options: AnalyzeOptions) -> fitz.Rect:
+    """Область превью вокруг номера, в пунктах PDF (размеры из настроек — пиксели при CAPTURE_DPI)."""
+    PT_PER_INCH = 72.0
+    cap_width_pt = (options.cap_width / CAPTURE_DPI) * PT_PER_INCH
+    cap_height_pt = (options.cap_height / CAPTURE_DPI) * PT_PER_INCH
+
+    cap_x0 = center_x - (cap_width_pt * options.pos_x / 100.0)
+    cap_y0 = center_y - (cap_height_pt * options.pos_y / 100.0)
+    return fitz.Rect(cap_x0, cap_y0, cap_x0 + cap_width_pt, cap_y0 + cap_height_pt)
+
 # -----------------------
 # Основной анализ с OCR
 # -----------------------
-def analyze_single_pdf(file_path: str, options: AnalyzeOptions, ocr: NeuralOCREngine) -> List[Dict[str, Any]]:
-    results: List[Dict[str, Any]] = []
+def analyze_single_pdf(file_path: str, options: AnalyzeOptions, ocr: NeuralOCREngine,
+                       times: Optional["StageTimes"] = None) -> List[Dict[str, Any]]:
+    """Находки в одном PDF; times — накопитель времени стадий OCR (см. StageTimes)."""
     file_name = os.path.basename(file_path)
 
     display_file_name = file_name
@@ -73,31 +152,29 @@ def analyze_single_pdf(file_path: str, options: AnalyzeOptions, ocr: NeuralOCREn
     revision = _parse_revision_from_filename(file_name)
     prefix = _get_file_prefix(file_name)
 
-    number_pattern = re.compile(rf"\b{re.escape(options.prefix)}(?P<digits>\d{{1,{options.max_digits}}})(?!\d)")
+    number_pattern = _number_pattern(options)
+    source = {"name": display_file_name, "path": file_path}
+
+    # Результаты по страницам: сканы распознаются пачками позже, а порядок должен остаться постраничным
+    page_results: Dict[int, List[Dict[str, Any]]] = {}
+    scanned_pages: List[int] = []
+    # гибридный режим: страницы с текстом и картинками -> (области картинок, номера текстового слоя)
+    region_pages: Dict[int, Tuple[List[Tuple[fitz.Rect, int]], List[Tuple[str, fitz.Rect]]]] = {}
 
     try:
         doc = fitz.open(file_path)
         for page_num in range(doc.page_count):
             page = doc.load_page(page_num)
+            results = page_results.setdefault(page_num, [])
             
             # ===============================================================
             #  ПУТЬ 1: Обработка PDF с извлекаемым текстом (ИСПРАВЛЕНО)
             # ===============================================================
             if page_has_text(page):
-                # --- НОВОЕ: Конвертируем пиксели из настроек в пункты ---
-                DPI = 150  # DPI, с которым вы сохраняете превью
-                PT_PER_INCH = 72.0
-                
-                cap_width_pt = (options.cap_width / DPI) * PT_PER_INCH
-                cap_height_pt = (options.cap_height / DPI) * PT_PER_INCH
-                # --- Конец нового блока ---
-
-                text_blocks = page.get_text("blocks")
-                for blk in text_blocks:
-                    if len(blk) < 5:
-                        continue
-                    x0, y0, x1, y1, text_content = blk[:5]
-                    
+                text_hits: List[Tuple[str, fitz.Rect]] = []
+                # текст страницы разбирается один раз; рамка находки — из рамок её символов
+                # (search_for искал бы и W12 внутри W123)
+                for text_content, boxes in iter_block_chars(page):
                     for m in number_pattern.finditer(text_content):
                         digits = m.group(1)
                         if not (1 <= len(digits) <= options.max_digits):
@@ -105,85 +182,951 @@ def analyze_single_pdf(file_path: str, options: AnalyzeOptions, ocr: NeuralOCREn
 
                         found_text = f"{options.prefix}{digits}"
                         composite = f"{prefix}{found_text}"
-                        
-                        search_rects = page.search_for(found_text, clip=fitz.Rect(x0, y0, x1, y1))
-                        
-                        for rect in search_rects:
-                            center_x = (rect.x0 + rect.x1) / 2
-                            center_y = (rect.y0 + rect.y1) / 2
-
-                            # ИСПОЛЬЗУЕМ КОНВЕРТИРОВАННЫЕ ЗНАЧЕНИЯ В ПУНКТАХ
-                            cap_x0 = center_x - (cap_width_pt * options.pos_x / 100.0)
-                            cap_y0 = center_y - (cap_height_pt * options.pos_y / 100.0)
-                            cap_rect = fitz.Rect(cap_x0, cap_y0, cap_x0 + cap_width_pt, cap_y0 + cap_height_pt)
-
-                            pix = page.get_pixmap(clip=cap_rect, dpi=DPI)
-                            img_bytes = pix.tobytes("png")
-                            crop_b64 = "data:image/png;base64," + base64.b64encode(img_bytes).decode("utf-8")
-                            
-                            results.append({
-                                "text": found_text, "composite_number": composite, "page": page_num + 1,
-                                "image_png_b64": crop_b64, "revision": revision, "comment": "",
-                                "sourceFile": {"name": display_file_name, "path": file_path}
-                            })
+
+                        rect = span_rect(boxes, m.start(), m.end())
+                        if rect is None:
+                            continue
+
+                        center_x = (rect.x0 + rect.x1) / 2
+                        center_y = (rect.y0 + rect.y1) / 2
+                        text_hits.append((found_text, rect))
+
+                        # размеры превью из настроек — в пикселях, рендер — в пунктах
+                        cap_rect = _capture_rect(center_x, center_y, options)
+
+                        pix = page.get_pixmap(clip=cap_rect, dpi=options.thumb.dpi,
+                                              colorspace=options.thumb.render_colorspace)
+                        thumb = thumbnail_fields(encode_pixmap(pix, options.thumb), options.thumb)
+
+                        results.append({
+                            "text": found_text, "composite_number": composite, "page": page_num + 1,
+                            **thumb, "revision": revision, "comment": "",
+                            "sourceFile": dict(source)
+                        })
+
+                if options.ocr_image_regions:
+                    regions = image_regions(page, options.ocr_region_min_pt, OCR_DPI)
+                    if regions:
+                        region_pages[page_num] = (regions, text_hits)
                 continue
 
             # ===============================================================
-            #  ПУТЬ 2: Обработка PDF-картинки (С OCR, без изменений)
+            #  ПУТЬ 2: Обработка PDF-картинки (С OCR) — страницы копятся и распознаются пачками
             # ===============================================================
             else:
-                img = rasterize_page(page, dpi=400)
-                ocr_blocks = ocr.ocr_image(img)
+                scanned_pages.append(page_num)
 
-                for block in ocr_blocks:
-                    for m in number_pattern.finditer(block["text"]):
-                        digits = m.group(1)
-                        if not (1 <= len(digits) <= options.max_digits):
-                            continue
+        times = times if times is not None else StageTimes()
+        if options.ocr_two_pass:
+            for i in range(0, len(scanned_pages), options.ocr_batch_pages):
+                batch = scanned_pages[i:i + options.ocr_batch_pages]
+                page_results.update(_two_pass_items(
+                    doc, batch, ocr, options, number_pattern, prefix, revision, source))
+        else:
+            # большие листы — по тайлам, по одной странице; остальные — пачками целиком
+            whole = []
+            for page_num in scanned_pages:
+                page = doc.load_page(page_num)
+                if _raster_bytes(page.rect, OCR_DPI) > options.ocr_max_raster_mb * 1024 * 1024:
+                    fingerprint = scan_fingerprint(page, OCR_DPI) if ocr.cache is not None else None
+                    page_results[page_num] = _ocr_page_tiled(
+                        page, page_num, ocr, options, number_pattern, prefix, revision, source, fingerprint)
+                else:
+                    whole.append(page_num)
+            scan_pages = _ocr_pages_pipelined if options.ocr_pipeline else _ocr_pages_sequential
+            page_results.update(scan_pages(doc, whole, ocr, options, number_pattern,
+                                           prefix, revision, source, times))
 
-                        found_text = f"{options.prefix}{digits}"
-                        composite = f"{prefix}{found_text}"
+        for page_num, (regions, text_hits) in region_pages.items():
+            page_results[page_num].extend(_image_region_items(
+                doc.load_page(page_num), page_num, regions, text_hits, ocr,
+                options, number_pattern, prefix, revision, source))
 
-                        x_coords = [p[0] for p in block["bbox"]]
-                        y_coords = [p[1] for p in block["bbox"]]
-                        xmin, xmax = min(x_coords), max(x_coords)
-                        ymin, ymax = min(y_coords), max(y_coords)
-
-                        cx = (xmin + xmax) / 2
-                        cy = (ymin + ymax) / 2
-                        
-                        cap_x0 = cx - (options.cap_width * options.pos_x / 100.0)
-                        cap_y0 = cy - (options.cap_height * options.pos_y / 100.0)
-                        cap_x1 = cap_x0 + options.cap_width
-                        cap_y1 = cap_y0 + options.cap_height
-
-                        cap_x0, cap_y0 = int(max(0, cap_x0)), int(max(0, cap_y0))
-                        cap_x1, cap_y1 = int(min(img.width, cap_x1)), int(min(img.height, cap_y1))
-
-                        cropped = img.crop((cap_x0, cap_y0, cap_x1, cap_y1))
-                        buf = io.BytesIO()
-                        cropped.save(buf, format="PNG")
-                        crop_b64 = "data:image/png;base64," + base64.b64encode(buf.getvalue()).decode("utf-8")
-                        
-                        results.append({
-                            "text": found_text, "composite_number": composite, "page": page_num + 1,
-                            "image_png_b64": crop_b64, "revision": revision, "comment": "",
-                            "sourceFile": {"name": display_file_name, "path": file_path}
-                        })
-                        
         doc.close()
     except Exception as e:
         logger.error(f"Failed to process {file_path}: {e}")
+    return [item for page_num in sorted(page_results) for item in page_results[page_num]]
+
+
+def _tag_candidates(boxes: List[Tuple[float, float, float, float]], zoom: float,
+                    options: AnalyzeOptions) -> List[fitz.Rect]:
+    """Строки детектора (в пикселях растра с масштабом zoom), похожие на тег, — в пунктах PDF, с полями."""
+    min_aspect = 0.4 * (len(options.prefix) + 1)  # самый короткий тег: префикс + одна цифра
+    out: List[fitz.Rect] = []
+    for box in boxes:
+        rect = fitz.Rect(box) / zoom
+        if rect.is_empty:
+            continue
+        aspect = rect.width / rect.height
+        if not (TAG_MIN_HEIGHT_PT <= rect.height <= TAG_MAX_HEIGHT_PT):
+            continue
+        if not (min_aspect <= aspect <= TAG_MAX_ASPECT):
+            continue
+        pad = rect.height * REGION_PAD
+        out.append(rect + (-pad, -pad, pad, pad))
+    return out
+
+
+def _two_pass_items(doc: fitz.Document, batch: List[int], ocr: NeuralOCREngine,
+                    options: AnalyzeOptions, number_pattern: "re.Pattern",
+                    prefix: str, revision: Optional[int],
+                    source: Dict[str, str]) -> Dict[int, List[Dict[str, Any]]]:
+    """
+    Двухпроходный OCR пачки сканированных страниц:
+      1) детектор на растре ocr_detect_dpi (EasyOCR всё равно уменьшает вход до canvas_size);
+      2) строки-кандидаты по размеру и пропорциям рендерятся через get_pixmap(clip=...) на OCR_DPI
+         и распознаются одним пакетным вызовом. Полный растр страницы на OCR_DPI не строится.
+    """
+    detect_zoom = options.ocr_detect_dpi / 72.0
+    rec_zoom = OCR_DPI / 72.0
+    pages = {n: doc.load_page(n) for n in batch}
+
+    regions: List[Tuple[int, fitz.Rect]] = []
+    for page_num, page in pages.items():
+        img = rasterize_page(page, dpi=options.ocr_detect_dpi)
+        for rect in _tag_candidates(ocr.detect_boxes(img), detect_zoom, options):
+            rect &= page.rect
+            if not rect.is_empty:
+                regions.append((page_num, rect))
+
+    # области страницы рендерятся из одного display list (см. _render_clips в process_pdfs.py)
+    display_lists = {n: pages[n].get_displaylist() for n in {n for n, _ in regions}}
+    crops = [rasterize_region(display_lists[n], rect, dpi=OCR_DPI) for n, rect in regions]
+    recognized = ocr.recognize_regions(crops, options.ocr_batch_size) if crops else []
+
+    cap_w_pt = options.cap_width / rec_zoom
+    thumb_zoom = options.thumb.dpi / 72.0
+    cap_h_pt = options.cap_height / rec_zoom
+    out: Dict[int, List[Dict[str, Any]]] = {n: [] for n in batch}
+    for (page_num, rect), blocks in zip(regions, recognized):
+        page = pages[page_num]
+        for block in blocks:
+            for found_text, composite in _tag_matches(block["text"], options, number_pattern, prefix):
+                xs = [p[0] for p in block["bbox"]]
+                ys = [p[1] for p in block["bbox"]]
+                cx = rect.x0 + (min(xs) + max(xs)) / 2 / rec_zoom
+                cy = rect.y0 + (min(ys) + max(ys)) / 2 / rec_zoom
+
+                # та же область превью, что и у вырезки из полного растра на OCR_DPI; разрешение — thumb_dpi
+                cap_x0 = cx - cap_w_pt * options.pos_x / 100.0
+                cap_y0 = cy - cap_h_pt * options.pos_y / 100.0
+                cap_rect = fitz.Rect(cap_x0, cap_y0, cap_x0 + cap_w_pt, cap_y0 + cap_h_pt) & page.rect
+                pix = display_lists[page_num].get_pixmap(matrix=fitz.Matrix(thumb_zoom, thumb_zoom), clip=cap_rect,
+                                                         colorspace=options.thumb.render_colorspace, alpha=False)
+                thumb = thumbnail_fields(encode_pixmap(pix, options.thumb), options.thumb)
+
+                out[page_num].append({
+                    "text": found_text, "composite_number": composite, "page": page_num + 1,
+                    **thumb, "revision": revision, "comment": "",
+                    "sourceFile": dict(source)
+                })
+    return out
+
+
+def _tag_matches(text: str, options: AnalyzeOptions, number_pattern: "re.Pattern",
+                 prefix: str) -> Iterator[Tuple[str, str]]:
+    """(found_text, composite_number) для каждого номера в распознанном тексте."""
+    for m in number_pattern.finditer(text):
+        digits = m.group(1)
+        if not (1 <= len(digits) <= options.max_digits):
+            continue
+        found_text = f"{options.prefix}{digits}"
+        yield found_text, f"{prefix}{found_text}"
+
+
+def _raster_size(rect: fitz.Rect, dpi: int) -> Tuple[int, int]:
+    """Размер растра области (страницы) на dpi, в пикселях."""
+    zoom = dpi / 72.0
+    return int(rect.width * zoom), int(rect.height * zoom)
+
+
+def _raster_bytes(rect: fitz.Rect, dpi: int) -> int:
+    """Размер RGB-растра области (страницы) на dpi, в байтах."""
+    width, height = _raster_size(rect, dpi)
+    return width * height * 3
+
+
+# Строит превью сразу для всех областей (x0, y0, x1, y1) страницы
+ThumbnailMaker = Callable[[List[Tuple[int, int, int, int]]], List[Dict[str, str]]]
+
+
+def _crop_thumbnail(img: "Image.Image", dpi: int, options: AnalyzeOptions) -> ThumbnailMaker:
+    """
+    Превью — вырезки из готового растра страницы на dpi, уменьшенные до thumb_dpi
+    (разрешение выше растра вырезке взять неоткуда — она остаётся как есть).
+    """
+    scale = options.thumb.dpi / dpi
+
+    def crop(box: Tuple[int, int, int, int]) -> "Image.Image":
+        img_crop = img.crop(box)
+        if scale < 1:
+            img_crop = img_crop.resize((max(1, round(img_crop.width * scale)),
+                                        max(1, round(img_crop.height * scale))), Image.LANCZOS)
+        return img_crop
+
+    return lambda boxes: [thumbnail_fields(encode_pil(crop(box), options.thumb), options.thumb)
+                          for box in boxes]
+
+
+def _render_thumbnail(dl: fitz.DisplayList, dpi: int, options: AnalyzeOptions) -> ThumbnailMaker:
+    """
+    Превью — рендер из display list на thumb_dpi, без полного растра (области — в пикселях
+    растра на dpi). Каждый рендер фрагмента скана заново декодирует встроенную картинку,
+    поэтому области группируются по той же сетке тайлов, что и OCR: на тайл — один рендер
+    объединения его областей, превью вырезаются из него.
+    """
+    zoom = dpi / 72.0
+    full = (dl.rect * fitz.Matrix(zoom, zoom)).irect
+    tiles = tile_grid(full.width, full.height, options.ocr_tile_px, options.ocr_tile_overlap_px)
+    thumb_zoom = options.thumb.dpi / 72.0
+    thumb_mat = fitz.Matrix(thumb_zoom, thumb_zoom)
+    scale = thumb_zoom / zoom
+
+    def render(clip: fitz.IRect) -> Tuple["Image.Image", fitz.IRect]:
+        pix = dl.get_pixmap(matrix=thumb_mat, clip=fitz.Rect(clip) / zoom,
+                            colorspace=options.thumb.render_colorspace, alpha=False)
+        img = Image.frombytes("L" if pix.n == 1 else "RGB", (pix.width, pix.height), pix.samples)
+        # область фрагмента в растре может сдвинуться на пиксель при округлении
+        return img, fitz.IRect(pix.irect)
+
+    def make(boxes: List[Tuple[int, int, int, int]]) -> List[Dict[str, str]]:
+        groups: Dict[int, List[int]] = {}
+        for i, box in enumerate(boxes):
+            rect = fitz.IRect(box)
+            tile = next((t for t, tile in enumerate(tiles) if rect in tile), None)
+            # области больше перекрытия тайлов могут не поместиться ни в один тайл
+            groups.setdefault(-1 - i if tile is None else tile, []).append(i)
+
+        out: List[Optional[Dict[str, str]]] = [None] * len(boxes)
+        for members in groups.values():
+            union = fitz.IRect(boxes[members[0]])
+            for i in members[1:]:
+                union |= fitz.IRect(boxes[i])
+            img, origin = render(union)
+            for i in members:
+                x0, y0, x1, y1 = (round(v * scale) for v in boxes[i])
+                crop = img.crop((x0 - origin.x0, y0 - origin.y0,
+                                 max(x1, x0 + 1) - origin.x0, max(y1, y0 + 1) - origin.y0))
+                out[i] = thumbnail_fields(encode_pil(crop, options.thumb), options.thumb)
+        return out
+    return make
+
+
+def _page_thumbnail(page: fitz.Page, options: AnalyzeOptions) -> ThumbnailMaker:
+    """
+    Превью страницы без полного растра (результат OCR взят из кэша): рендер из display list.
+    Встроенные картинки декодируются целиком один раз — и только если превью вообще нужны.
+    """
+    dl = page.get_displaylist()
+    render = _render_thumbnail(dl, OCR_DPI, options)
+
+    def make(boxes: List[Tuple[int, int, int, int]]) -> List[Dict[str, str]]:
+        prime_image_cache(page, dl, options.ocr_max_raster_mb * 1024 * 1024)
+        return render(boxes)
+    return make
+
+
+def _ocr_page_tiled(page: fitz.Page, page_num: int, ocr: NeuralOCREngine,
+                    options: AnalyzeOptions, number_pattern: "re.Pattern",
+                    prefix: str, revision: Optional[int],
+                    source: Dict[str, str], fingerprint: Optional[str] = None) -> List[Dict[str, Any]]:
+    """
+    OCR большого листа по тайлам: пиковая память ограничена размером тайла, а не страницы.
+    fingerprint — отпечаток скана для кэша OCR (см. scan_fingerprint); результат зависит и от сетки тайлов.
+    """
+    size = _raster_size(page.rect, OCR_DPI)
+    if fingerprint is not None:
+        fingerprint = f"{fingerprint}/tiles:{options.ocr_tile_px}:{options.ocr_tile_overlap_px}"
+        cached = ocr.cached_blocks(fingerprint)
+        if cached is not None:
+            return _items_from_ocr_blocks(cached, size, _page_thumbnail(page, options), page_num,
+                                          options, number_pattern, prefix, revision, source)
+
+    dl = page.get_displaylist()
+    prime_image_cache(page, dl, options.ocr_max_raster_mb * 1024 * 1024)
+    blocks = ocr.ocr_page_tiled(dl, OCR_DPI, options.ocr_tile_px, options.ocr_tile_overlap_px,
+                                options.ocr_batch_size, fingerprint=fingerprint)
+    return _items_from_ocr_blocks(blocks, size, _render_thumbnail(dl, OCR_DPI, options), page_num,
+                                  options, number_pattern, prefix, revision, source)
+
+
+def _image_region_items(page: fitz.Page, page_num: int, regions: List[Tuple[fitz.Rect, int]],
+                        text_hits: List[Tuple[str, fitz.Rect]], ocr: NeuralOCREngine,
+                        options: AnalyzeOptions, number_pattern: "re.Pattern",
+                        prefix: str, revision: Optional[int],
+                        source: Dict[str, str]) -> List[Dict[str, Any]]:
+    """
+    Гибридный режим: OCR только встроенных картинок страницы с текстовым слоем, каждой области —
+    в собственном разрешении картинки (см. image_regions); остальная страница уже прочитана из текста.
+    Большие области распознаются по тайлам. Номер, который текстовый слой уже дал в том же месте
+    (скан с невидимым OCR-слоем, подписи поверх картинки), повторно не добавляется.
+    Превью — той же геометрии, что и у номеров из текстового слоя.
+    """
+    dl = page.get_displaylist()
+    max_bytes = options.ocr_max_raster_mb * 1024 * 1024
+    # каждая картинка декодируется один раз, а не на каждый тайл и превью
+    prime_image_cache(page, dl, max_bytes)
+
+    # большие области — по тайлам, остальные — одним пакетным вызовом
+    region_blocks: List[List[Dict[str, Any]]] = [[] for _ in regions]
+    whole: List[int] = []
+    for i, (rect, dpi) in enumerate(regions):
+        if _raster_bytes(rect, dpi) > max_bytes:
+            region_blocks[i] = ocr.ocr_page_tiled(dl, dpi, options.ocr_tile_px, options.ocr_tile_overlap_px,
+                                                  options.ocr_batch_size, clip=rect)
+        else:
+            whole.append(i)
+    if whole:
+        images = [rasterize_region(dl, *regions[i]) for i in whole]
+        for i, blocks in zip(whole, ocr.ocr_images(images, options.ocr_batch_size)):
+            region_blocks[i] = blocks
+        del images
+
+    results: List[Dict[str, Any]] = []
+    for (rect, dpi), blocks in zip(regions, region_blocks):
+        zoom = dpi / 72.0
+        for block in blocks:
+            for found_text, composite in _tag_matches(block["text"], options, number_pattern, prefix):
+                xs = [p[0] for p in block["bbox"]]
+                ys = [p[1] for p in block["bbox"]]
+                center = fitz.Point(rect.x0 + (min(xs) + max(xs)) / 2 / zoom,
+                                    rect.y0 + (min(ys) + max(ys)) / 2 / zoom)
+                if any(text == found_text and center in known + (-known.height, -known.height,
+                                                                 known.height, known.height)
+                       for text, known in text_hits):
+                    continue
+
+                pix = dl.get_pixmap(matrix=fitz.Matrix(options.thumb.dpi / 72.0, options.thumb.dpi / 72.0),
+                                    clip=_capture_rect(center.x, center.y, options),
+                                    colorspace=options.thumb.render_colorspace, alpha=False)
+                thumb = thumbnail_fields(encode_pixmap(pix, options.thumb), options.thumb)
+                results.append({
+                    "text": found_text, "composite_number": composite, "page": page_num + 1,
+                    **thumb, "revision": revision, "comment": "",
+                    "sourceFile": dict(source)
+                })
     return results
 
+
+def _items_from_ocr_blocks(ocr_blocks: List[Dict[str, Any]], size: Tuple[int, int],
+                           make_thumbnail: ThumbnailMaker, page_num: int,
+                           options: AnalyzeOptions, number_pattern: "re.Pattern",
+                           prefix: str, revision: Optional[int],
+                           source: Dict[str, str]) -> List[Dict[str, Any]]:
+    """
+    Находки в блоках OCR одной страницы. bbox блоков — в пикселях растра страницы размером size;
+    превью строит make_thumbnail по областям (x0, y0, x1, y1) в тех же пикселях.
+    """
+    results, boxes = _ocr_hits(ocr_blocks, size, page_num, options, number_pattern, prefix, revision, source)
+    for item, thumb in zip(results, make_thumbnail(boxes) if boxes else []):
+        item.update(thumb)
+    return results
+
+
+def _ocr_hits(ocr_blocks: List[Dict[str, Any]], size: Tuple[int, int], page_num: int,
+              options: AnalyzeOptions, number_pattern: "re.Pattern",
+              prefix: str, revision: Optional[int],
+              source: Dict[str, str]) -> Tuple[List[Dict[str, Any]], List[Tuple[int, int, int, int]]]:
+    """Находки в блоках OCR без превью и области их превью (x0, y0, x1, y1) в пикселях растра."""
+    width, height = size
+    results: List[Dict[str, Any]] = []
+    boxes: List[Tuple[int, int, int, int]] = []
+    for block in ocr_blocks:
+        for found_text, composite in _tag_matches(block["text"], options, number_pattern, prefix):
+            x_coords = [p[0] for p in block["bbox"]]
+            y_coords = [p[1] for p in block["bbox"]]
+            xmin, xmax = min(x_coords), max(x_coords)
+            ymin, ymax = min(y_coords), max(y_coords)
+
+            cx = (xmin + xmax) / 2
+            cy = (ymin + ymax) / 2
+
+            cap_x0 = cx - (options.cap_width * options.pos_x / 100.0)
+            cap_y0 = cy - (options.cap_height * options.pos_y / 100.0)
+            cap_x1 = cap_x0 + options.cap_width
+            cap_y1 = cap_y0 + options.cap_height
+
+            cap_x0, cap_y0 = int(max(0, cap_x0)), int(max(0, cap_y0))
+            cap_x1, cap_y1 = int(min(width, cap_x1)), int(min(height, cap_y1))
+
+            boxes.append((cap_x0, cap_y0, cap_x1, cap_y1))
+            results.append({
+                "text": found_text, "composite_number": composite, "page": page_num + 1,
+                "image_png_b64": "", "revision": revision, "comment": "",
+                "sourceFile": dict(source)
+            })
+    return results, boxes
+
+# -----------------------
+# Конвейер OCR страниц-сканов
+# -----------------------
+STAGES = ("render", "ocr", "encode")
+
+
+class StageTimes:
+    """
+    Время стадий OCR сканов, в секундах: render — MuPDF (растр страниц), ocr — нейросеть,
+    encode — вырезка и кодирование превью. busy — работа стадии (у encode — суммарно по потокам),
+    wait — ожидание очередей конвейера: render ждёт места в очереди (нейросеть не успевает),
+    ocr — страниц от render или места в очереди превью, encode — работы.
+    Узкое место — стадия с наибольшим busy.
+    """
+
+    def __init__(self):
+        self.busy: Dict[str, float] = {stage: 0.0 for stage in STAGES}
+        self.wait: Dict[str, float] = {stage: 0.0 for stage in STAGES}
+        self._lock = threading.Lock()
+
+    def add(self, stage: str, busy: float = 0.0, wait: float = 0.0) -> None:
+        with self._lock:
+            self.busy[stage] += busy
+            self.wait[stage] += wait
+
+    def as_dict(self) -> Dict[str, Any]:
+        out: Dict[str, Any] = {stage: {"busy": round(self.busy[stage], 3), "wait": round(self.wait[stage], 3)}
+                               for stage in STAGES}
+        out["bottleneck"] = max(STAGES, key=self.busy.get) if any(self.busy.values()) else None
+        return out
+
+
+# Признак конца потока в очередях конвейера
+_DONE = object()
+
+
+def _put(q: "queue.Queue", item: Any, stop: threading.Event) -> bool:
+    """put в ограниченную очередь; прерывается по stop, чтобы поток не ждал вечно упавшего соседа."""
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def _get(q: "queue.Queue", stop: threading.Event) -> Any:
+    """get из очереди; по stop возвращает _DONE."""
+    while not stop.is_set():
+        try:
+            return q.get(timeout=0.1)
+        except queue.Empty:
+            continue
+    return _DONE
+
+
+def _cached_page_items(page: fitz.Page, page_num: int, ocr: NeuralOCREngine,
+                       options: AnalyzeOptions, number_pattern: "re.Pattern",
+                       prefix: str, revision: Optional[int],
+                       source: Dict[str, str]) -> Tuple[Optional[List[Dict[str, Any]]], Optional[str]]:
+    """
+    Находки страницы-скана из кэша OCR (без растра) и её отпечаток.
+    Без кэша или при промахе находок нет (None), отпечаток нужен для записи результата.
+    """
+    fingerprint = scan_fingerprint(page, OCR_DPI) if ocr.cache is not None else None
+    cached = ocr.cached_blocks(fingerprint)
+    if cached is None:
+        return None, fingerprint
+    return _items_from_ocr_blocks(cached, _raster_size(page.rect, OCR_DPI), _page_thumbnail(page, options),
+                                  page_num, options, number_pattern, prefix, revision, source), fingerprint
+
+
+def _ocr_pages_sequential(doc: fitz.Document, pages: List[int], ocr: NeuralOCREngine,
+                          options: AnalyzeOptions, number_pattern: "re.Pattern",
+                          prefix: str, revision: Optional[int], source: Dict[str, str],
+                          times: StageTimes) -> Dict[int, List[Dict[str, Any]]]:
+    """OCR страниц-сканов пачками по ocr_batch_pages, стадии — по очереди в текущем потоке."""
+    out: Dict[int, List[Dict[str, Any]]] = {}
+    for i in range(0, len(pages), options.ocr_batch_pages):
+        start = time.perf_counter()
+        batch: List[int] = []
+        images: List[Image.Image] = []
+        fingerprints: List[Optional[str]] = []
+        for page_num in pages[i:i + options.ocr_batch_pages]:
+            page = doc.load_page(page_num)
+            items, fingerprint = _cached_page_items(page, page_num, ocr, options, number_pattern,
+                                                    prefix, revision, source)
+            if items is not None:
+                out[page_num] = items
+                continue
+            batch.append(page_num)
+            images.append(rasterize_page(page, dpi=OCR_DPI))
+            fingerprints.append(fingerprint)
+        times.add("render", busy=time.perf_counter() - start)
+
+        start = time.perf_counter()
+        results = ocr.ocr_images(images, options.ocr_batch_size, fingerprints) if images else []
+        times.add("ocr", busy=time.perf_counter() - start)
+
+        start = time.perf_counter()
+        for page_num, img, ocr_blocks in zip(batch, images, results):
+            out[page_num] = _items_from_ocr_blocks(
+                ocr_blocks, img.size, _crop_thumbnail(img, OCR_DPI, options), page_num,
+                options, number_pattern, prefix, revision, source)
+        times.add("encode", busy=time.perf_counter() - start)
+    return out
+
+
+def _ocr_pages_pipelined(doc: fitz.Document, pages: List[int], ocr: NeuralOCREngine,
+                         options: AnalyzeOptions, number_pattern: "re.Pattern",
+                         prefix: str, revision: Optional[int], source: Dict[str, str],
+                         times: StageTimes) -> Dict[int, List[Dict[str, Any]]]:
+    """
+    OCR страниц-сканов конвейером:
+      render (поток)  -> очередь страниц -> ocr (текущий поток, пачки по ocr_batch_pages)
+                      -> очередь превью  -> encode (ocr_encode_threads потоков).
+    Пока нейросеть распознаёт пачку (torch и ONNX Runtime отпускают GIL), следующая пачка уже
+    растрируется, а превью предыдущей кодируются. Очередь страниц вмещает одну пачку, поэтому
+    в памяти не больше двух пачек растров и одной рендерящейся страницы; вырезки превью
+    делаются сразу после распознавания, и растр страницы освобождается, не дожидаясь кодирования.
+    PyMuPDF не допускает одновременной работы из нескольких потоков, поэтому все вызовы
+    MuPDF (растр, отпечаток для кэша, превью страниц из кэша) выполняет только поток render.
+    """
+    out: Dict[int, List[Dict[str, Any]]] = {}
+    if not pages:
+        return out
+    to_ocr: "queue.Queue" = queue.Queue(maxsize=options.ocr_batch_pages)
+    to_encode: "queue.Queue" = queue.Queue(maxsize=options.ocr_batch_pages * 4)
+    stop = threading.Event()
+    errors: List[BaseException] = []
+
+    def render() -> None:
+        try:
+            for page_num in pages:
+                start = time.perf_counter()
+                page = doc.load_page(page_num)
+                items, fingerprint = _cached_page_items(page, page_num, ocr, options, number_pattern,
+                                                        prefix, revision, source)
+                if items is not None:
+                    out[page_num] = items
+                    times.add("render", busy=time.perf_counter() - start)
+                    continue
+                img = rasterize_page(page, dpi=OCR_DPI)
+                del page
+                ready = time.perf_counter()
+                times.add("render", busy=ready - start)
+                if not _put(to_ocr, (page_num, img, fingerprint), stop):
+                    return
+                times.add("render", wait=time.perf_counter() - ready)
+        except BaseException as e:
+            errors.append(e)
+            stop.set()
+        finally:
+            _put(to_ocr, _DONE, stop)
+
+    def encode() -> None:
+        try:
+            while True:
+                start = time.perf_counter()
+                job = _get(to_encode, stop)
+                got = time.perf_counter()
+                times.add("encode", wait=got - start)
+                if job is _DONE:
+                    return
+                items, crops = job
+                for item, crop in zip(items, crops):
+                    item.update(thumbnail_fields(encode_pil(crop, options.thumb), options.thumb))
+                times.add("encode", busy=time.perf_counter() - got)
+        except BaseException as e:
+            errors.append(e)
+            stop.set()
+
+    def recognize(batch: List[Tuple[int, Image.Image, Optional[str]]]) -> None:
+        start = time.perf_counter()
+        results = ocr.ocr_images([img for _, img, _ in batch], options.ocr_batch_size,
+                                 [fingerprint for _, _, fingerprint in batch])
+        cropped = time.perf_counter()
+        times.add("ocr", busy=cropped - start)
+        jobs = []
+        for (page_num, img, _), ocr_blocks in zip(batch, results):
+            items, boxes = _ocr_hits(ocr_blocks, img.size, page_num, options, number_pattern,
+                                     prefix, revision, source)
+            out[page_num] = items
+            if boxes:
+                jobs.append((items, [img.crop(box) for box in boxes]))
+        batch.clear()  # растры пачки больше не нужны
+        queued = time.perf_counter()
+        times.add("encode", busy=queued - cropped)
+        for job in jobs:
+            if not _put(to_encode, job, stop):
+                return
+        times.add("ocr", wait=time.perf_counter() - queued)
+
+    threads = [threading.Thread(target=render, name="ocr-render", daemon=True)]
+    threads += [threading.Thread(target=encode, name=f"ocr-encode-{i}", daemon=True)
+                for i in range(options.ocr_encode_threads)]
+    for thread in threads:
+        thread.start()
+    try:
+        batch: List[Tuple[int, Image.Image, Optional[str]]] = []
+        while True:
+            start = time.perf_counter()
+            job = _get(to_ocr, stop)
+            times.add("ocr", wait=time.perf_counter() - start)
+            if job is _DONE:
+                break
+            batch.append(job)
+            if len(batch) >= options.ocr_batch_pages:
+                recognize(batch)
+        if batch:
+            recognize(batch)
+        for _ in threads[1:]:
+            _put(to_encode, _DONE, stop)
+    except BaseException:
+        stop.set()
+        raise
+    finally:
+        for thread in threads:
+            thread.join()
+    if errors:
+        raise errors[0]
+    return out
+
+# -----------------------
+# OCR-движки (по одному на набор языков)
+# -----------------------
+# Ключ: (языки, движок, параметры движка)
+_engines: Dict[Tuple[Any, ...], NeuralOCREngine] = {}
+
+
+def _lang_key(lang: Any) -> Tuple[str, ...]:
+    """'en', 'en,ru' или ['en', 'ru'] -> ('en', 'ru'); порядок сохраняется, повторы убираются."""
+    parts = lang.split(",") if isinstance(lang, str) else list(lang or [])
+    key: List[str] = []
+    for p in parts:
+        p = str(p).strip()
+        if p and p not in key:
+            key.append(p)
+    return tuple(key) or ("en",)
+
+
+def _engine_key(lang: Any, engine: str, engine_options: Dict[str, Any]) -> Tuple[Any, ...]:
+    return _lang_key(lang), engine, tuple(sorted(engine_options.items()))
+
+
+def _engine_label(key: Tuple[Any, ...]) -> str:
+    """'en,ru' для EasyOCR, 'onnx:en' / 'onnx-int8:en' для остальных движков."""
+    langs, engine, params = key
+    if engine == "easyocr":
+        return ",".join(langs)
+    if dict(params).get("int8"):
+        engine += "-int8"
+    return f"{engine}:{','.join(langs)}"
+
+
+def get_ocr_engine(lang: Any, engine: str = "easyocr",
+                   engine_options: Optional[Dict[str, Any]] = None) -> NeuralOCREngine:
+    """
+    Возвращает движок для набора языков, создавая его при первом обращении.
+    Загрузка torch/EasyOCR и весов моделей занимает секунды, поэтому в резидентном
+    режиме движок создаётся один раз на набор языков (и движок с его параметрами) и переиспользуется.
+    """
+    engine_options = engine_options or {}
+    key = _engine_key(lang, engine, engine_options)
+    ocr = _engines.get(key)
+    if ocr is None:
+        logger.info("Loading OCR models for %s", _engine_label(key))
+        ocr = _engines[key] = NeuralOCREngine(lang=list(key[0]), engine=engine, **engine_options)
+    return ocr
+
+
+def _engine_for(options: AnalyzeOptions) -> NeuralOCREngine:
+    return get_ocr_engine(options.ocr_lang, options.ocr_engine, options.engine_options())
+
+
+def _open_ocr_cache(options: AnalyzeOptions) -> Optional[OCRCache]:
+    if not options.ocr_cache:
+        return None
+    try:
+        return OCRCache(options.ocr_cache_dir, options.ocr_cache_max_mb * 1024 * 1024)
+    except OSError as e:
+        logger.warning(f"OCR cache disabled: {e}")
+        return None
+
+
+def _run_analyze(options: AnalyzeOptions, paths: List[str]) -> Dict[str, Any]:
+    ocr = _engine_for(options)
+    before = ocr.stats()
+    # кэш — только на время анализа: bench и compare должны замерять саму нейросеть
+    cache = ocr.cache = _open_ocr_cache(options)
+    times = StageTimes()
+    try:
+        files_out = []
+        for path in paths:
+            items = analyze_single_pdf(path, options, ocr, times)
+            files_out.append({"filePath": path, "items": items})
+    finally:
+        ocr.cache = None
+
+    after = ocr.stats()
+    pages = after["images"] - before["images"]
+    seconds = after["seconds"] - before["seconds"]
+    stats = {
+        "pages": pages,
+        "seconds": round(seconds, 3),
+        "pages_per_sec": round(pages / seconds, 3) if seconds > 0 else 0.0,
+        "batch_size": options.ocr_batch_size,
+        "stages": times.as_dict(),
+    }
+    if cache is not None:
+        stats["cache"] = cache.stats()
+    return {"files": files_out, "ocr": stats}
+
+
+# Размеры пачки, которые перебирает bench по умолчанию
+BENCH_BATCH_SIZES = [1, 2, 4, 8, 16, 32]
+
+
+def benchmark_batch_sizes(options: AnalyzeOptions, paths: List[str],
+                          batch_sizes: List[int], max_pages: int = 16) -> Dict[str, Any]:
+    """
+    Замер скорости OCR (страниц/с) при разных размерах пачки на сканированных страницах paths.
+    Страницы растрируются один раз; перед замерами движок прогревается на первой странице.
+    """
+    ocr = _engine_for(options)
+    images: List[Image.Image] = []
+    for path in paths:
+        with fitz.open(path) as doc:
+            for page in doc:
+                if len(images) >= max_pages:
+                    break
+                if not page_has_text(page):
+                    images.append(rasterize_page(page, dpi=OCR_DPI))
+    if not images:
+        raise ValueError("No scanned pages found for OCR benchmark")
+
+    ocr.ocr_image(images[0], options.ocr_batch_size)  # прогрев: первые прогоны сети заметно медленнее
+
+    runs = []
+    for batch_size in batch_sizes:
+        start = time.perf_counter()
+        for i in range(0, len(images), options.ocr_batch_pages):
+            ocr.ocr_images(images[i:i + options.ocr_batch_pages], batch_size)
+        elapsed = time.perf_counter() - start
+        runs.append({
+            "batch_size": batch_size,
+            "seconds": round(elapsed, 3),
+            "pages_per_sec": round(len(images) / elapsed, 3) if elapsed > 0 else 0.0,
+        })
+
+    best = max(runs, key=lambda r: r["pages_per_sec"])
+    return {"pages": len(images), "batch_pages": options.ocr_batch_pages,
+            "runs": runs, "best_batch_size": best["batch_size"]}
+
+
+# Движки, которые сравнивает compare по умолчанию (поверх опций запроса)
+COMPARE_ENGINES: List[Dict[str, Any]] = [
+    {"ocr_engine": "easyocr"},
+    {"ocr_engine": "onnx"},
+    {"ocr_engine": "onnx", "ocr_int8": True},
+]
+
+
+def _tag_counts(texts: Iterator[str], options: AnalyzeOptions, number_pattern: "re.Pattern") -> Counter:
+    return Counter(found for text in texts for found, _ in _tag_matches(text, options, number_pattern, ""))
+
+
+def compare_engines(payload: Dict[str, Any], paths: List[str], engines: List[Any],
+                    max_pages: int = 8) -> Dict[str, Any]:
+    """
+    Сравнение движков OCR по скорости и точности на одних и тех же страницах paths.
+    engines — опции движка поверх payload ({"ocr_engine": "onnx", "ocr_int8": true, ...}) или имя движка.
+    Точность (precision/recall найденных номеров) считается по страницам с текстовым слоем:
+    они растрируются как сканы, а эталон берётся из текста PDF. agreement — F1 совпадения
+    номеров с первым движком списка на всех страницах. Движки, загруженные только для сравнения,
+    выгружаются после замера, чтобы в памяти не держалось несколько моделей сразу.
+    """
+    base = AnalyzeOptions(payload)
+    number_pattern = _number_pattern(base)
+    images: List[Image.Image] = []
+    truth: List[Optional[Counter]] = []
+    for path in paths:
+        with fitz.open(path) as doc:
+            for page in doc:
+                if len(images) >= max_pages:
+                    break
+                images.append(rasterize_page(page, dpi=OCR_DPI))
+                truth.append(_tag_counts((b[4] for b in page.get_text("blocks")), base, number_pattern)
+                             if page_has_text(page) else None)
+    if not images:
+        raise ValueError("No pages found for OCR engine comparison")
+
+    runs = []
+    reference: List[Counter] = []
+    for spec in engines:
+        spec = {"ocr_engine": spec} if isinstance(spec, str) else dict(spec)
+        options = AnalyzeOptions({**payload, **spec})
+        key = _engine_key(options.ocr_lang, options.ocr_engine, options.engine_options())
+        resident = key in _engines
+        start = time.perf_counter()
+        ocr = _engine_for(options)
+        load_seconds = time.perf_counter() - start
+        ocr.ocr_image(images[0], options.ocr_batch_size)  # прогрев
+
+        found: List[Counter] = []
+        start = time.perf_counter()
+        for i in range(0, len(images), options.ocr_batch_pages):
+            for blocks in ocr.ocr_images(images[i:i + options.ocr_batch_pages], options.ocr_batch_size):
+                found.append(_tag_counts((b["text"] for b in blocks), options, number_pattern))
+        elapsed = time.perf_counter() - start
+        if not resident:
+            del _engines[key], ocr
+        if not reference:
+            reference = found
+
+        tp = sum(sum((f & t).values()) for f, t in zip(found, truth) if t is not None)
+        n_found = sum(sum(f.values()) for f, t in zip(found, truth) if t is not None)
+        n_truth = sum(sum(t.values()) for t in truth if t is not None)
+        common = sum(sum((f & r).values()) for f, r in zip(found, reference))
+        total = sum(sum(f.values()) for f in found) + sum(sum(r.values()) for r in reference)
+        runs.append({
+            "engine": _engine_label(key),
+            "options": spec,
+            "load_seconds": round(load_seconds, 3),
+            "seconds": round(elapsed, 3),
+            "pages_per_sec": round(len(images) / elapsed, 3) if elapsed > 0 else 0.0,
+            "tags_found": sum(sum(f.values()) for f in found),
+            "precision": round(tp / n_found, 4) if n_found else None,
+            "recall": round(tp / n_truth, 4) if n_truth else None,
+            "agreement": round(2 * common / total, 4) if total else 1.0,
+        })
+
+    return {"pages": len(images), "truth_pages": sum(t is not None for t in truth),
+            "truth_tags": sum(sum(t.values()) for t in truth if t is not None), "engines": runs}
+
+
+# -----------------------
+# Экспорт
+# -----------------------
+def _export_to_tempfile(payload: Dict[str, Any], items: Iterable[Dict[str, Any]]) -> str:
+    """Отчёт по payload экспорта (элементы — потоком, см. export_stream.py); возвращает путь к файлу."""
+    options_dict = payload.get("options", {})
+    file_format = payload.get("format", "pdf").lower()
+    if file_format == "pdf":
+        from report_generator_pdf import write_pdf_report
+        fd, path = tempfile.mkstemp(suffix=".pdf")
+        os.close(fd)
+        write_pdf_report([normalize_item(it) for it in items], options_dict, path)
+        return path
+    elif file_format == "txt":
+        from report_generator_text import write_txt_report as write_report
+    elif file_format == "csv":
+        from report_generator_text import write_csv_report as write_report
+    else:
+        raise ValueError(f"Unknown export format: {file_format}")
+
+    with tempfile.NamedTemporaryFile(mode="w", suffix=f".{file_format}", delete=False, encoding="utf-8") as tmp:
+        try:
+            write_report(map(normalize_item, items), options_dict, tmp)
+        except Exception:
+            tmp.close()
+            os.remove(tmp.name)
+            raise
+        return tmp.name
+
+
+# -----------------------
+# Резидентный режим (serve)
+# -----------------------
+def _handle_request(request: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Обрабатывает один запрос serve-режима и возвращает тело ответа (без id).
+    Формат запроса: {"id": ..., "command": "ping" | "warmup" | "analyze" | "bench" | "compare" | "shutdown", ...}
+      warmup:  {"lang": "en", "options": {"ocr_engine": ...}} — загрузить модели заранее
+      analyze: {"options": {...}, "files": [...]}
+      bench:   {"options": {..., "batch_sizes": [...], "bench_max_pages": N}, "files": [...]}
+      compare: {"options": {..., "compare_engines": [...], "compare_max_pages": N}, "files": [...]}
+    """
+    command = request.get("command")
+
+    if command == "ping":
+        return {"data": {"status": "ok", "pid": os.getpid(),
+                         "engines": [_engine_label(k) for k in _engines]}}
+
+    if command == "shutdown":
+        return {"data": {"status": "bye"}}
+
+    if command == "warmup":
+        _engine_for(AnalyzeOptions({"ocr_lang": request.get("lang") or "en", **(request.get("options") or {})}))
+        return {"data": {"status": "ok", "engines": [_engine_label(k) for k in _engines]}}
+
+    if command == "analyze":
+        options = AnalyzeOptions(request.get("options") or {})
+        return {"data": _run_analyze(options, request.get("files") or [])}
+
+    if command == "bench":
+        payload = request.get("options") or {}
+        batch_sizes = [int(b) for b in payload.get("batch_sizes") or BENCH_BATCH_SIZES]
+        return {"data": benchmark_batch_sizes(AnalyzeOptions(payload), request.get("files") or [],
+                                              batch_sizes, int(payload.get("bench_max_pages") or 16))}
+
+    if command == "compare":
+        payload = request.get("options") or {}
+        return {"data": compare_engines(payload, request.get("files") or [],
+                                        payload.get("compare_engines") or COMPARE_ENGINES,
+                                        int(payload.get("compare_max_pages") or 8))}
+
+    raise ValueError(f"Unknown command: {command}")
+
+
+def serve() -> None:
+    """
+    Резидентный OCR-сервис: читает JSON-запросы построчно из stdin и пишет
+    по одному JSON-ответу на строку в stdout (с "id" запроса). Модели загружаются
+    при первом запросе для набора языков и остаются в памяти до "shutdown" или закрытия stdin.
+    """
+    sys.stdin.reconfigure(encoding="utf-8")
+    out = sys.stdout
+    # stdout занят протоколом: всё, что печатают EasyOCR/torch, уходит в stderr
+    sys.stdout = sys.stderr
+
+    def write_message(message: Dict[str, Any]) -> None:
+        out.write(json.dumps(message, ensure_ascii=False) + "\n")
+        out.flush()
+
+    logger.info("OCR worker ready (pid %s)", os.getpid())
+
+    for line in sys.stdin:
+        line = line.strip()
+        if not line:
+            continue
+
+        try:
+            request = json.loads(line)
+            if not isinstance(request, dict):
+                raise ValueError("Request must be a JSON object")
+        except Exception as e:
+            write_message({"id": None, "error": True, "message": f"Invalid request JSON: {e}"})
+            continue
+
+        req_id = request.get("id")
+        try:
+            response = _handle_request(request)
+        except Exception as e:
+            logger.exception(f"Request {req_id} failed")
+            response = {"error": True, "message": str(e)}
+
+        write_message({"id": req_id, **response})
+
+        if request.get("command") == "shutdown":
+            break
+
+    logger.info("OCR worker stopped")
+
+
 # -----------------------
 # Точка входа
 # -----------------------
 def main():
     sys.stdout.reconfigure(encoding="utf-8")
 
-    if len(sys.argv) < 3:
-        print("Usage: python process_pdfs_ocr.py analyze <options_json> <files...>", file=sys.stderr)
+    if len(sys.argv) >= 2 and sys.argv[1] == "serve":
+        serve()
+        return
+
+    # export читает payload из stdin и аргументов не требует
+    if len(sys.argv) < 3 and not (len(sys.argv) == 2 and sys.argv[1] == "export"):
+        print("Usage: python process_pdfs_ocr.py analyze|bench|compare <options_json> <files...> | export | serve",
+              file=sys.stderr)
         sys.exit(1)
 
     command = sys.argv[1]
@@ -199,53 +1142,36 @@ def main():
             return
 
         options = AnalyzeOptions(options_payload)
-        ocr = NeuralOCREngine(lang=options.ocr_lang)
+        print(json.dumps({"data": _run_analyze(options, sys.argv[3:])}, ensure_ascii=False), flush=True)
 
-        files_out = []
-        for path in sys.argv[3:]:
-            items = analyze_single_pdf(path, options, ocr)
-            files_out.append({"filePath": path, "items": items})
+    elif command == "bench":
+        # bench <options_json> <files...>: options.batch_sizes — перебираемые размеры пачки,
+        # options.bench_max_pages — сколько сканированных страниц взять для замера
+        options_payload = json.loads(sys.argv[2])
+        options = AnalyzeOptions(options_payload)
+        batch_sizes = [int(b) for b in options_payload.get("batch_sizes") or BENCH_BATCH_SIZES]
+        max_pages = int(options_payload.get("bench_max_pages") or 16)
+        data = benchmark_batch_sizes(options, sys.argv[3:], batch_sizes, max_pages)
+        print(json.dumps({"data": data}, ensure_ascii=False), flush=True)
 
-        print(json.dumps({"data": {"files": files_out}}, ensure_ascii=False), flush=True)
+    elif command == "compare":
+        # compare <options_json> <files...>: options.compare_engines — сравниваемые движки,
+        # options.compare_max_pages — сколько страниц взять для замера
+        options_payload = json.loads(sys.argv[2])
+        engines = options_payload.get("compare_engines") or COMPARE_ENGINES
+        max_pages = int(options_payload.get("compare_max_pages") or 8)
+        data = compare_engines(options_payload, sys.argv[3:], engines, max_pages)
+        print(json.dumps({"data": data}, ensure_ascii=False), flush=True)
 
     elif command == "export":
-        raw = sys.stdin.read()
+        # payload читается из stdin потоком (как в process_pdfs.py): TXT и CSV пишутся в файл
+        # по мере чтения элементов, не собираясь в памяти
         try:
-            payload = json.loads(raw) if raw else {}
-        except Exception as e:
+            payload, items = read_export_payload(sys.stdin)
+            print(_export_to_tempfile(payload, items if items is not None else iter(())), flush=True)
+        except ExportPayloadError as e:
             print(json.dumps({"error": True, "message": f"Invalid export payload JSON: {e}"}), file=sys.stderr)
             sys.exit(1)
-
-        options_dict = payload.get("options", {})
-        items_dict = payload.get("items", [])
-        file_format = payload.get("format", "pdf").lower()
-
-        flat_items = _flatten_items_structure(items_dict)
-        norm_items = _normalize_flat_items(flat_items)
-
-        if file_format == "pdf":
-            from report_generator_pdf import generate_pdf_report
-            content = generate_pdf_report(norm_items, options_dict)
-            suffix, mode = ".pdf", "wb"
-        elif file_format == "txt":
-            from report_generator_text import generate_txt_report
-            content = generate_txt_report(norm_items, options_dict)
-            suffix, mode = ".txt", "w"
-        elif file_format == "csv":
-            from report_generator_text import generate_csv_report
-            content = generate_csv_report(norm_items, options_dict)
-            suffix, mode = ".csv", "w"
-        else:
-            raise ValueError(f"Unknown export format: {file_format}")
-
-        with tempfile.NamedTemporaryFile(
-            mode=mode,
-            suffix=suffix,
-            delete=False,
-            encoding=("utf-8" if mode == "w" else None)
-        ) as tmp:
-            tmp.write(content)
-            print(tmp.name, flush=True)
         return
 
     else:
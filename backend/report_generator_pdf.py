@@ -1,33 +1,143 @@
+import sys
 import base64
+import hashlib
 import io
 import os
 import re
+import math
+import shutil
 import logging
-from typing import List, Dict, Any, Optional
+import tempfile
+import inspect
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Dict, Any, Optional, BinaryIO, Union, Tuple, Callable
 
 # --- Обязательные зависимости ---
 try:
     from fpdf import FPDF
     from fpdf.enums import XPos, YPos
+    from fpdf.image_parsing import preload_image
 except ImportError as e:
     sys.stderr.write(f"Error: fpdf2 library is not installed. {e}\nPlease run 'pip install fpdf2'.\n")
     sys.exit(1)
 
+# Запись в файл по мере сериализации опирается на внутренности fpdf2 (OutputProducer и его буфер),
+# проверенные на версии из requirements.txt; без них документ собирается в памяти (см. _output_to_file)
+try:
+    from fpdf.output import OutputProducer
+except ImportError:
+    OutputProducer = None
+_STREAMING_OUTPUT = (OutputProducer is not None
+                     and "output_producer_class" in inspect.signature(FPDF.output).parameters)
+
+try:
+    import fitz  # PyMuPDF
+except ImportError as e:
+    sys.stderr.write(f"Error: PyMuPDF library is not installed. {e}\nPlease run 'pip install PyMuPDF'.\n")
+    sys.exit(1)
+
 logger = logging.getLogger(__name__)
 
+# Форматы превью, которые может прислать бэкенд (см. thumbnail_encoding.py)
+SUPPORTED_IMAGE_MIME = ("image/png", "image/jpeg", "image/webp")
+
+# Параллельная вёрстка: строки делятся на части не меньше REPORT_CHUNK_MIN_ROWS
+# (запуск процесса и импорт fpdf стоят ~0.5 с, 500 строк верстаются ~0.4 с)
+REPORT_CHUNK_MIN_ROWS = 500
+
+# Футер (см. PDF.footer): отступ снизу, высота ячейки и кегль, мм / pt
+FOOTER_Y = 15
+FOOTER_CELL_H = 10
+FOOTER_FONT_SIZE = 8
+
+
+def _decode_image_data_url(data_url: str) -> bytes:
+    """Декодирует data URL превью (PNG/JPEG/WebP) в байты изображения."""
+    if not data_url or ',' not in data_url:
+        raise ValueError("Invalid base64 data URL")
+    header, payload = data_url.split(',', 1)
+    mime = header[5:].split(';', 1)[0] if header.startswith("data:") else ""
+    if mime and mime not in SUPPORTED_IMAGE_MIME:
+        raise ValueError(f"Unsupported image type: {mime}")
+    img_data = base64.b64decode(payload)
+    if not img_data:
+        raise ValueError("Empty image data after decoding")
+    return img_data
+
+
+# --- Запись PDF в файл по мере сериализации ---
+class _FileSink:
+    """
+    Замена буфера OutputProducer: объекты PDF пишутся в файл сразу, а не копятся в bytearray.
+    Для таблицы xref нужна только текущая длина вывода; для /ID — md5 всего вывода (см. PDF.file_id).
+    """
+
+    def __init__(self, fh: BinaryIO):
+        self.fh = fh
+        self.size = 0
+        self.md5 = hashlib.md5()
+
+    def __iadd__(self, data: bytes) -> "_FileSink":
+        self.fh.write(data)
+        self.md5.update(data)
+        self.size += len(data)
+        return self
+
+    def __len__(self) -> int:
+        return self.size
+
+
+def _file_output_producer(fh: BinaryIO) -> type:
+    class _FileOutputProducer(OutputProducer):
+        def __init__(self, fpdf: FPDF):
+            super().__init__(fpdf)
+            # буфер другого вида — другая версия fpdf2: остаётся обычная сборка в памяти
+            if isinstance(getattr(self, "buffer", None), bytearray):
+                self.buffer = _FileSink(fh)  # type: ignore[assignment]
+                fpdf.output_sink = self.buffer
+
+    return _FileOutputProducer
+
+
+def _output_to_file(pdf: "PDF", fh: BinaryIO) -> None:
+    """Сериализует документ в fh; если хук записи в файл недоступен — через pdf.output() в памяти."""
+    if not _STREAMING_OUTPUT:
+        fh.write(pdf.output())
+        return
+    data = pdf.output(output_producer_class=_file_output_producer(fh))
+    if pdf.output_sink is None:
+        logger.warning("fpdf2 output internals have changed, PDF report is built in memory")
+        fh.write(data)
+
+
 # --- Кастомный класс PDF с версией в футере ---
 class PDF(FPDF):
-    def __init__(self, orientation='P', unit='mm', format='A4', app_version='N/A'):
+    def __init__(self, orientation='P', unit='mm', format='A4', app_version='N/A', page_numbers=True):
         super().__init__(orientation, unit, format)
         self.app_version = app_version
+        # False — части параллельного отчёта: номера страниц ставятся после склейки (_stamp_page_numbers)
+        self.page_numbers = page_numbers
+        self.output_sink: Optional[_FileSink] = None
+
+    def file_id(self):
+        # По умолчанию fpdf считает /ID по готовому буферу; при записи в файл буфера нет —
+        # тот же md5 накапливается по мере записи
+        if self.output_sink is None:
+            return super().file_id()
+        id_hash = self.output_sink.md5.copy()
+        if self.creation_date:
+            id_hash.update(self.creation_date.strftime("%Y%m%d%H%M%S").encode("utf8"))
+        hash_hex = id_hash.hexdigest().upper()
+        return f"<{hash_hex}><{hash_hex}>"
 
     def footer(self):
-        self.set_y(-15)
-        self.set_font("Helvetica", "I", 8)
+        self.set_y(-FOOTER_Y)
+        self.set_font("Helvetica", "I", FOOTER_FONT_SIZE)
         # Используем сохраненную версию приложения
-        self.cell(0, 10, f"App Version: {self.app_version}", align="L")
-        self.set_x(self.w - self.r_margin - 10)
-        self.cell(0, 10, f"Page {self.page_no()}/{{nb}}", align="R")
+        self.cell(0, FOOTER_CELL_H, f"App Version: {self.app_version}", align="L")
+        if self.page_numbers:
+            self.set_x(self.w - self.r_margin - 10)
+            self.cell(0, FOOTER_CELL_H, f"Page {self.page_no()}/{{nb}}", align="R")
 
 # --- Утилиты ---
 def _parse_revision_from_filename(file_name: str) -> Optional[int]:
@@ -39,13 +149,37 @@ def _parse_revision_from_filename(file_name: str) -> Optional[int]:
 def find_font_path() -> Optional[str]:
     return None
 
-# --- Основная функция генерации PDF ---
-def generate_pdf_report(items: List[Dict[str, Any]], options: Dict[str, Any]) -> bytes:
+def _image_name(pdf: FPDF, item: Dict[str, Any], embedded: Dict[str, str]) -> str:
+    """
+    Имя превью строки в кэше изображений fpdf. Одинаковые картинки fpdf и сам встраивает один раз;
+    здесь data URL сопоставляются по sha256, чтобы base64 повторяющегося превью декодировался
+    и разбирался только при первой встрече. Файлы хранилища (thumbnail_store.py) fpdf кэширует по пути.
+    """
+    image_path = item.get("image_path")
+    if image_path:
+        return image_path
+    data_url = item.get("image_png_b64") or item.get("dataUrl", "")
+    key = hashlib.sha256(data_url.encode("utf-8")).hexdigest()
+    name = embedded.get(key)
+    if name is None:
+        name, _, _ = preload_image(pdf.image_cache, io.BytesIO(_decode_image_data_url(data_url)))
+        embedded[key] = name
+    return name
+
+# --- Вёрстка таблицы ---
+TITLE_H, TITLE_GAP = 10, 5
+HEADER_H = 7
+COL_INDEX_W, COL_IMAGE_W = 10, 50
+
+
+def _new_pdf(options: Dict[str, Any], page_numbers: bool = True) -> Tuple[PDF, Callable[[str], str]]:
+    """Документ с настройками отчёта и функция приведения текста к загруженному шрифту."""
     # Извлекаем версию из опций и передаем ее в наш PDF класс
     app_version = options.get('app_version', 'N/A')
-    pdf = PDF(orientation="P", unit="mm", format="A4", app_version=app_version)
+    pdf = PDF(orientation="P", unit="mm", format="A4", app_version=app_version, page_numbers=page_numbers)
 
-    pdf.alias_nb_pages()
+    if page_numbers:
+        pdf.alias_nb_pages()
     pdf.set_auto_page_break(auto=True, margin=15)
 
     font_path = find_font_path()
@@ -63,45 +197,107 @@ def generate_pdf_report(items: List[Dict[str, Any]], options: Dict[str, Any]) ->
     def safe_text(text: str) -> str:
         return text if font_loaded else text.encode('latin-1', 'replace').decode('latin-1')
 
+    return pdf, safe_text
+
+
+def _row_texts(item: Dict[str, Any]) -> Tuple[str, str, str]:
+    """Номер, строка "ревизия/страница/сетка" и комментарий строки отчёта."""
+    main_number = item.get("composite_number", item.get("text", ""))
+    revision = item.get("revision")
+    if revision is None or revision == -1:
+        revision = _parse_revision_from_filename(item.get("sourceFile", {}).get("name", ""))
+
+    rev_prefix = f"r{str(revision).zfill(2)} " if revision is not None else ""
+    page_info = f"{rev_prefix}Page: {item.get('page', '')}, Grid: {item.get('grid', '')}"
+    comment = f"Comment: {item.get('comment', '')}"
+    return main_number, page_info, comment
+
+
+def _image_height(options: Dict[str, Any]) -> float:
+    img_w = COL_IMAGE_W - 2
+    cap_width = options.get('cap_width', 200)
+    cap_height = options.get('cap_height', 88)
+    return (img_w / cap_width) * cap_height if cap_width > 0 else 0
+
+
+def _row_height(pdf: PDF, safe_text: Callable[[str], str], texts: Tuple[str, str, str],
+                col_text_w: float, img_h: float) -> float:
+    main_number, page_info, comment = texts
+    pdf.set_font("Helvetica", "B", 12)
+    h1 = pdf.multi_cell(col_text_w - 6, 5, safe_text(main_number), dry_run=True, output='HEIGHT')
+    pdf.set_font("Helvetica", "", 9)
+    h2 = pdf.multi_cell(col_text_w - 6, 5, safe_text(page_info), dry_run=True, output='HEIGHT')
+    h3 = pdf.multi_cell(col_text_w - 6, 5, safe_text(comment), dry_run=True, output='HEIGHT')
+    text_total_height = h1 + h2 + h3 + 6
+    return max(img_h + 2, text_total_height)
+
+
+def _row_heights(texts: List[Tuple[str, str, str]], options: Dict[str, Any]) -> List[float]:
+    """Высоты строк отчёта по их текстам (_row_texts) — в процессе пула."""
+    pdf, safe_text = _new_pdf(options, page_numbers=False)
+    pdf.add_page()
+    col_text_w = pdf.w - 2 * pdf.l_margin - COL_INDEX_W - COL_IMAGE_W
+    img_h = _image_height(options)
+    return [_row_height(pdf, safe_text, t, col_text_w, img_h) for t in texts]
+
+
+def _page_starts(heights: List[float], options: Dict[str, Any]) -> List[int]:
+    """
+    Индексы строк, с которых в отчёте целиком (_build_pdf) начинаются страницы со второй:
+    разбивка повторяется по высотам строк и отступам, без вёрстки.
+    """
+    pdf, _ = _new_pdf(options, page_numbers=False)
+    bottom = pdf.h - pdf.b_margin
+    # y накапливается по шагам, как в fpdf при вёрстке, — с теми же округлениями
+    y = pdf.t_margin
+    y += TITLE_H
+    y += TITLE_GAP
+    y += HEADER_H
+    starts: List[int] = []
+    for i, row_height in enumerate(heights):
+        if y + row_height > bottom:
+            starts.append(i)
+            y = pdf.t_margin
+            y += HEADER_H
+        y += row_height
+    return starts
+
+
+# --- Основная функция генерации PDF ---
+def _build_pdf(items: List[Dict[str, Any]], options: Dict[str, Any],
+               first_index: int = 0, title: bool = True, page_numbers: bool = True,
+               heights: Optional[List[float]] = None) -> PDF:
+    """
+    Вёрстка отчёта. first_index — индекс первой строки в полном отчёте (сквозная нумерация частей);
+    title=False — без заголовка отчёта, page_numbers=False — футер без номеров страниц;
+    heights — уже посчитанные высоты строк (_row_heights).
+    """
+    pdf, safe_text = _new_pdf(options, page_numbers)
     pdf.add_page()
     page_width = pdf.w - 2 * pdf.l_margin
-    pdf.cell(page_width, 10, safe_text("PDF Analysis Report"), align="C", new_x=XPos.LMARGIN, new_y=YPos.NEXT)
-    pdf.ln(5)
+    if title:
+        pdf.cell(page_width, TITLE_H, safe_text("PDF Analysis Report"), align="C", new_x=XPos.LMARGIN, new_y=YPos.NEXT)
+        pdf.ln(TITLE_GAP)
 
-    col_index_w, col_image_w = 10, 50
+    col_index_w, col_image_w = COL_INDEX_W, COL_IMAGE_W
     col_text_w = page_width - col_index_w - col_image_w
 
     def draw_header():
         pdf.set_font("Helvetica", "B", 10)
         pdf.set_fill_color(240, 240, 240)
-        pdf.cell(col_index_w, 7, safe_text("#"), border=1, align='C', fill=True)
-        pdf.cell(col_image_w, 7, safe_text("Preview"), border=1, align='C', fill=True)
-        pdf.cell(col_text_w, 7, safe_text("Details"), border=1, align='C', fill=True, new_x=XPos.LMARGIN, new_y=YPos.NEXT)
+        pdf.cell(col_index_w, HEADER_H, safe_text("#"), border=1, align='C', fill=True)
+        pdf.cell(col_image_w, HEADER_H, safe_text("Preview"), border=1, align='C', fill=True)
+        pdf.cell(col_text_w, HEADER_H, safe_text("Details"), border=1, align='C', fill=True, new_x=XPos.LMARGIN, new_y=YPos.NEXT)
 
     draw_header()
 
+    img_w = col_image_w - 2
+    img_h = _image_height(options)
+    embedded: Dict[str, str] = {}  # sha256 data URL -> имя изображения в кэше fpdf
     for i, item in enumerate(items):
-        main_number = item.get("composite_number", item.get("text", ""))
-        revision = item.get("revision")
-        if revision is None or revision == -1:
-            revision = _parse_revision_from_filename(item.get("sourceFile", {}).get("name", ""))
-
-        rev_prefix = f"r{str(revision).zfill(2)} " if revision is not None else ""
-        page_info = f"{rev_prefix}Page: {item.get('page', '')}, Grid: {item.get('grid', '')}"
-        comment = f"Comment: {item.get('comment', '')}"
-
-        pdf.set_font("Helvetica", "B", 12)
-        h1 = pdf.multi_cell(col_text_w - 6, 5, safe_text(main_number), dry_run=True, output='HEIGHT')
-        pdf.set_font("Helvetica", "", 9)
-        h2 = pdf.multi_cell(col_text_w - 6, 5, safe_text(page_info), dry_run=True, output='HEIGHT')
-        h3 = pdf.multi_cell(col_text_w - 6, 5, safe_text(comment), dry_run=True, output='HEIGHT')
-        text_total_height = h1 + h2 + h3 + 6
-
-        img_w = col_image_w - 2
-        cap_width = options.get('cap_width', 200)
-        cap_height = options.get('cap_height', 88)
-        img_h = (img_w / cap_width) * cap_height if cap_width > 0 else 0
-        row_height = max(img_h + 2, text_total_height)
+        texts = _row_texts(item)
+        main_number, page_info, comment = texts
+        row_height = heights[i] if heights is not None else _row_height(pdf, safe_text, texts, col_text_w, img_h)
 
         if pdf.get_y() + row_height > pdf.h - pdf.b_margin:
             pdf.add_page()
@@ -115,20 +311,12 @@ def generate_pdf_report(items: List[Dict[str, Any]], options: Dict[str, Any]) ->
         # Column 1: index
         pdf.set_xy(pdf.l_margin, start_y)
         pdf.set_font("Helvetica", "", 10)
-        pdf.multi_cell(col_index_w, row_height, str(i + 1), align='C')
+        pdf.multi_cell(col_index_w, row_height, str(first_index + i + 1), align='C')
 
         # Column 2: image
         try:
-            base64_string = item.get("image_png_b64") or item.get("dataUrl", "")
-            if not base64_string or ',' not in base64_string:
-                raise ValueError("Invalid base64 data URL")
-            img_data = base64.b64decode(base64_string.split(',', 1)[1])
-            if not img_data:
-                raise ValueError("Empty image data after decoding")
-
-            img_stream: io.BytesIO = io.BytesIO(img_data)
-            pdf.image(img_stream, x=pdf.l_margin + col_index_w + 1,
-                        y=start_y + (row_height - img_h) / 2, w=img_w, h=img_h)
+            pdf.image(_image_name(pdf, item, embedded), x=pdf.l_margin + col_index_w + 1,
+                      y=start_y + (row_height - img_h) / 2, w=img_w, h=img_h)
         except Exception as e:
             logger.error(f"Failed to process image for PDF report: {e}")
             pdf.set_xy(pdf.l_margin + col_index_w + 1, start_y + 1)
@@ -151,5 +339,143 @@ def generate_pdf_report(items: List[Dict[str, Any]], options: Dict[str, Any]) ->
 
         pdf.set_y(start_y + row_height)
 
-    return pdf.output()
+    return pdf
+
+
+def generate_pdf_report(items: List[Dict[str, Any]], options: Dict[str, Any]) -> bytes:
+    """Отчёт целиком в памяти; для больших отчётов — write_pdf_report."""
+    return _build_pdf(items, options).output()
+
+
+# -----------------------
+# Параллельная вёрстка частями
+# -----------------------
+
+def _plan_chunks(heights: List[float], options: Dict[str, Any], workers: int) -> List[Tuple[int, int]]:
+    """
+    Делит строки отчёта на диапазоны [start, stop), по одному на процесс. Часть начинается
+    с новой страницы, поэтому границы частей — только начала страниц отчёта целиком
+    (_page_starts): склеенный отчёт разбит на страницы так же, как однопроцессный.
+    """
+    count = len(heights)
+    size = max(REPORT_CHUNK_MIN_ROWS, math.ceil(count / workers))
+    cuts = [0]
+    for start in _page_starts(heights, options):
+        if start - cuts[-1] >= size:
+            cuts.append(start)
+    cuts.append(count)
+    return list(zip(cuts, cuts[1:]))
 
+
+def _write_chunk(items: List[Dict[str, Any]], options: Dict[str, Any], first_index: int,
+                 heights: List[float], path: str) -> str:
+    """Часть отчёта (в процессе пула): с новой страницы, с шапкой таблицы, без номеров страниц."""
+    pdf = _build_pdf(items, options, first_index=first_index, title=first_index == 0, page_numbers=False,
+                     heights=heights)
+    with open(path, "wb") as fh:
+        _output_to_file(pdf, fh)
+    return path
+
+
+def _stamp_page_numbers(doc: "fitz.Document") -> None:
+    """"Page x/N" на каждой странице склеенного отчёта — там же и тем же шрифтом, что PDF.footer."""
+    ref = PDF()
+    k = ref.k
+    right = (ref.w - ref.r_margin - ref.c_margin) * k
+    baseline = (ref.h - FOOTER_Y + 0.5 * FOOTER_CELL_H) * k + 0.3 * FOOTER_FONT_SIZE
+    total = doc.page_count
+    for page in doc:
+        text = f"Page {page.number + 1}/{total}"
+        width = fitz.get_text_length(text, fontname="Helvetica-Oblique", fontsize=FOOTER_FONT_SIZE)
+        page.insert_text((right - width, baseline), text, fontname="Helvetica-Oblique", fontsize=FOOTER_FONT_SIZE)
+
+
+_XOBJECT_REF = re.compile(r"/([^\s/<>\[\]()]+)\s+(\d+)\s+0\s+R")
+
+
+def _merge_duplicate_images(doc: "fitz.Document", first_page: int, seen: Dict[str, int]) -> None:
+    """
+    Превью, повторяющиеся в разных частях, встраиваются каждой частью заново; ссылки словарей
+    ресурсов страниц начиная с first_page переводятся на первый экземпляр изображения
+    (ключ — md5 потока и словаря объекта), лишние копии удаляет doc.save(garbage=...).
+    """
+    visited = set()
+    for page in doc.pages(first_page):
+        kind, value = doc.xref_get_key(page.xref, "Resources")
+        target, prefix = (int(value.split()[0]), "") if kind == "xref" else (page.xref, "Resources/")
+        if (target, prefix) in visited:
+            continue
+        visited.add((target, prefix))
+        kind, value = doc.xref_get_key(target, prefix + "XObject")
+        if kind == "xref":
+            target, prefix = int(value.split()[0]), ""
+            value = doc.xref_object(target, compressed=True)
+        elif kind != "dict":
+            continue
+        for name, xref in _XOBJECT_REF.findall(value):
+            xref = int(xref)
+            h = hashlib.md5(doc.xref_stream_raw(xref) or b"")
+            h.update(doc.xref_object(xref, compressed=True).encode("latin-1", "replace"))
+            canon = seen.setdefault(h.hexdigest(), xref)
+            if canon != xref:
+                doc.xref_set_key(target, f"{prefix}XObject/{name}", f"{canon} 0 R")
+
+
+def _write_chunked(items: List[Dict[str, Any]], options: Dict[str, Any], fh: BinaryIO, workers: int) -> None:
+    tmp_dir = tempfile.mkdtemp(prefix="pdf_report_")
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            # Высоты строк нужны для разбивки на части до вёрстки — считаются в пуле
+            # по одним текстам строк и передаются частям, чтобы не считать их дважды
+            texts = [_row_texts(it) for it in items]
+            step = math.ceil(len(texts) / workers)
+            parts = [texts[s:s + step] for s in range(0, len(texts), step)]
+            heights = [h for part in pool.map(_row_heights, parts, [options] * len(parts)) for h in part]
+            chunks = _plan_chunks(heights, options, workers)
+            futures = [pool.submit(_write_chunk, items[start:stop], options, start, heights[start:stop],
+                                   os.path.join(tmp_dir, f"{n:04d}.pdf"))
+                       for n, (start, stop) in enumerate(chunks)]
+            paths = [f.result() for f in futures]
+
+        with fitz.open() as doc:
+            images: Dict[str, int] = {}
+            for path in paths:
+                with fitz.open(path) as part:
+                    first_page = doc.page_count
+                    if first_page == 0:
+                        doc.set_metadata(part.metadata)
+                    doc.insert_pdf(part)
+                _merge_duplicate_images(doc, first_page, images)
+            _stamp_page_numbers(doc)
+            doc.save(fh, garbage=1, deflate=True)
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+def _write_report(items: List[Dict[str, Any]], options: Dict[str, Any], fh: BinaryIO, workers: int) -> None:
+    if workers > 1 and len(items) >= 2 * REPORT_CHUNK_MIN_ROWS:
+        _write_chunked(items, options, fh, workers)
+    else:
+        _output_to_file(_build_pdf(items, options), fh)
+
+
+def write_pdf_report(items: List[Dict[str, Any]], options: Dict[str, Any],
+                     dest: Union[str, BinaryIO], workers: int = 1) -> None:
+    """
+    Пишет отчёт в файл dest (путь или открытый двоичный файл) по мере сериализации:
+    готовый документ не собирается в памяти ни в fpdf, ни у вызывающего кода.
+    workers > 1 — большие отчёты верстаются частями в пуле процессов и склеиваются;
+    нумерация "Page x/N", шапка таблицы и футер с версией сквозные.
+    """
+    if not isinstance(dest, str):
+        _write_report(items, options, dest, workers)
+        return
+    try:
+        with open(dest, "wb") as fh:
+            _write_report(items, options, fh, workers)
+    except Exception:
+        try:
+            os.remove(dest)
+        except OSError:
+            pass
+        raise
@@ -2,7 +2,14 @@ import csv
 import io
 import re
 import os
-from typing import List, Dict, Any, Optional, Tuple
+import json
+import heapq
+import tempfile
+from typing import List, Dict, Any, Optional, Tuple, Iterable, Iterator, TextIO
+
+# TXT: строк (после удаления дублей) в памяти не больше этого; сверх — сортированные
+# порции во временных файлах и их слияние (heapq.merge)
+TXT_SORT_RUN_ROWS = 200_000
 
 # --------------------------
 # ВСПОМОГАТЕЛЬНЫЕ ФУНКЦИИ
@@ -38,10 +45,7 @@ def _format_revision(file_name: str, rev_value: Optional[int]) -> str:
 # --------------------------
 # TXT-ОТЧЁТ
 # --------------------------
-def generate_txt_report(items: List[Dict[str, Any]], options: Dict[str, Any]) -> str:
-    rows: List[Tuple[str, str, str]] = []
-    seen: set = set()
-
+def _txt_rows(items: Iterable[Dict[str, Any]], options: Dict[str, Any]) -> Iterator[Tuple[str, str, str]]:
     for item in items:
         file_name = item.get("sourceFile", {}).get("name", "")
         if not file_name:
@@ -57,38 +61,92 @@ def generate_txt_report(items: List[Dict[str, Any]], options: Dict[str, Any]) ->
             continue
 
         rev_str = _format_revision(file_name, item.get("revision"))
-
-        key = (identifier, number_digits, rev_str)
-        if key in seen:
+        yield (identifier, number_digits, rev_str)
+
+def _txt_sort_key(t: Tuple[str, str, str]):
+    ident, num_str, rev = t
+    try:
+        num_int = int(num_str)
+    except ValueError:
+        num_int = 0
+    return (ident, num_int, rev)
+
+def _spill_run(rows: Dict[Tuple[str, str, str], int]) -> TextIO:
+    """Порция строк (строка -> порядковый номер первого появления), сортированная, во временном файле."""
+    run = tempfile.TemporaryFile("w+", encoding="utf-8")
+    for row, seq in sorted(rows.items(), key=lambda kv: (_txt_sort_key(kv[0]), kv[1])):
+        run.write(json.dumps([*_txt_sort_key(row), seq, row[1]], ensure_ascii=False))
+        run.write("\n")
+    run.seek(0)
+    return run
+
+def _merge_runs(runs: List[TextIO]) -> Iterator[Tuple[str, str, str]]:
+    """
+    Слияние порций в порядке (идентификатор, номер, ревизия, первое появление) — том же, что
+    у сортировки в памяти. Дубли из разных порций попадают в одну группу с равным ключом
+    сортировки и отбрасываются; остаётся самое раннее появление.
+    """
+    group = None
+    seen_in_group: set = set()
+    for ident, num_int, rev, _, num_str in heapq.merge(*(map(json.loads, run) for run in runs),
+                                                       key=lambda r: (r[0], r[1], r[2], r[3])):
+        key = (ident, num_int, rev)
+        if key != group:
+            group = key
+            seen_in_group = set()
+        if num_str in seen_in_group:
             continue
-        seen.add(key)
-        rows.append(key)
+        seen_in_group.add(num_str)
+        yield (ident, num_str, rev)
 
-    def _sort_key(t: Tuple[str, str, str]):
-        ident, num_str, rev = t
-        try:
-            num_int = int(num_str)
-        except ValueError:
-            num_int = 0
-        return (ident, num_int, rev)
+def write_txt_report(items: Iterable[Dict[str, Any]], options: Dict[str, Any], out: TextIO) -> None:
+    """
+    TXT-отчёт в файл out: уникальные (идентификатор, номер, ревизия), сортированные.
+    Память ограничена TXT_SORT_RUN_ROWS строками: сверх предела — внешняя сортировка слиянием.
+    """
+    rows: Dict[Tuple[str, str, str], int] = {}  # строка -> порядковый номер первого появления
+    runs: List[TextIO] = []
+    try:
+        for seq, row in enumerate(_txt_rows(items, options)):
+            if row in rows:
+                continue
+            rows[row] = seq
+            if len(rows) >= TXT_SORT_RUN_ROWS:
+                runs.append(_spill_run(rows))
+                rows = {}
+
+        if runs:
+            if rows:
+                runs.append(_spill_run(rows))
+                rows = {}
+            ordered: Iterable[Tuple[str, str, str]] = _merge_runs(runs)
+        else:
+            # dict сохраняет порядок первого появления, sorted устойчива — как раньше со списком
+            ordered = sorted(rows, key=_txt_sort_key)
 
-    rows.sort(key=_sort_key)
+        for n, (ident, num, rev) in enumerate(ordered):
+            out.write(f"\n{ident}\t{num}\t{rev}" if n else f"{ident}\t{num}\t{rev}")
+    finally:
+        for run in runs:
+            run.close()
 
-    return "\n".join(f"{ident}\t{num}\t{rev}" for ident, num, rev in rows)
+def generate_txt_report(items: List[Dict[str, Any]], options: Dict[str, Any]) -> str:
+    output = io.StringIO()
+    write_txt_report(items, options, output)
+    return output.getvalue()
 
 # --------------------------
 # CSV-ОТЧЁТ
 # --------------------------
-def generate_csv_report(items: List[Dict[str, Any]], options: Dict[str, Any]) -> str:
+def write_csv_report(items: Iterable[Dict[str, Any]], options: Dict[str, Any], output: TextIO) -> None:
     """
-    CSV с заголовком.
+    CSV с заголовком, строки пишутся в output по мере чтения items.
     По умолчанию: чистый CSV с разделителем ';'.
     Если options["excel_mode"] = True → Excel-friendly CSV (sep=; и Number/Revision как ="...").
     """
     excel_mode = bool(options.get("excel_mode", False))
     delimiter = ';'  # всегда ';' для Европы
 
-    output = io.StringIO()
     if excel_mode:
         output.write("sep=;\n")
 
@@ -101,7 +159,8 @@ def generate_csv_report(items: List[Dict[str, Any]], options: Dict[str, Any]) ->
     def _should_skip(identifier: str, number_digits: str, rev_str: str) -> bool:
         if not dedup:
             return False
-        key = (identifier, number_digits, rev_str)
+        # ключ одной строкой: в несколько раз компактнее кортежа из трёх строк на миллионах строк
+        key = f"{identifier}\t{number_digits}\t{rev_str}"
         if key in seen:
             return True
         seen.add(key)
@@ -138,4 +197,7 @@ def generate_csv_report(items: List[Dict[str, Any]], options: Dict[str, Any]) ->
             item.get("comment", ""),
         ])
 
+def generate_csv_report(items: List[Dict[str, Any]], options: Dict[str, Any]) -> str:
+    output = io.StringIO()
+    write_csv_report(items, options, output)
     return output.getvalue()
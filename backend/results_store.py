@@ -0,0 +1,299 @@
+import os
+import json
+import time
+import base64
+import sqlite3
+import hashlib
+import logging
+from typing import List, Dict, Any, Optional, Iterable, Iterator, Tuple
+
+from analysis_cache import default_cache_dir
+
+logger = logging.getLogger(__name__)
+
+STORE_FILE = "results.sqlite"
+DEFAULT_KEEP_RUNS = 10
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+# Строк за один fetchmany при потоковом чтении (экспорт)
+ITER_BATCH = 1000
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    created REAL NOT NULL,
+    files TEXT NOT NULL,
+    options TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS thumbnails (
+    sha256 TEXT PRIMARY KEY,
+    mime TEXT NOT NULL,
+    data BLOB NOT NULL
+);
+CREATE TABLE IF NOT EXISTS items (
+    id INTEGER PRIMARY KEY,
+    run_id INTEGER NOT NULL REFERENCES runs(id),
+    file_path TEXT NOT NULL,
+    file_name TEXT NOT NULL,
+    text TEXT NOT NULL,
+    composite_number TEXT NOT NULL,
+    page INTEGER,
+    grid TEXT,
+    revision INTEGER,
+    comment TEXT,
+    rect TEXT,
+    clip TEXT,
+    thumb TEXT REFERENCES thumbnails(sha256),
+    extra TEXT
+);
+CREATE INDEX IF NOT EXISTS items_number ON items(run_id, composite_number);
+CREATE INDEX IF NOT EXISTS items_file ON items(run_id, file_path, page);
+CREATE INDEX IF NOT EXISTS items_page ON items(run_id, page);
+CREATE INDEX IF NOT EXISTS items_revision ON items(run_id, revision);
+CREATE INDEX IF NOT EXISTS items_thumb ON items(thumb);
+"""
+
+# Поля элемента, хранящиеся в отдельных столбцах; остальные (поля OCR и т. п.) — JSON в extra
+_COLUMN_KEYS = {"text", "composite_number", "page", "grid", "revision", "comment", "rect", "clip",
+                "sourceFile", "image_png_b64", "image_path", "dataUrl", "id"}
+
+# Сортировки query: имя -> столбец (последний ключ — id, порядок строк стабилен между страницами)
+SORT_COLUMNS = {
+    "id": "id",
+    "number": "composite_number",
+    "file": "file_path",
+    "page": "page",
+    "revision": "revision",
+}
+
+_SELECT = ("SELECT items.id, file_path, file_name, text, composite_number, page, grid, revision, comment, "
+           "rect, clip, extra, thumbnails.mime, thumbnails.data FROM items")
+_SELECT_NO_THUMBS = ("SELECT id, file_path, file_name, text, composite_number, page, grid, revision, comment, "
+                     "rect, clip, extra, NULL, NULL FROM items")
+
+
+def default_store_path() -> str:
+    return os.path.join(default_cache_dir("results"), STORE_FILE)
+
+
+def _thumbnail_blob(item: Dict[str, Any]) -> Optional[Tuple[str, bytes]]:
+    """(mime, байты) превью элемента: из data URL или файла хранилища превью; None — превью нет."""
+    data_url = item.get("image_png_b64") or item.get("dataUrl") or ""
+    if data_url.startswith("data:") and "," in data_url:
+        header, payload = data_url.split(",", 1)
+        try:
+            return header[5:].split(";", 1)[0] or "image/png", base64.b64decode(payload)
+        except ValueError:
+            return None
+    path = item.get("image_path")
+    if path:
+        ext = os.path.splitext(path)[1].lower()
+        mime = {".jpg": "image/jpeg", ".jpeg": "image/jpeg", ".webp": "image/webp"}.get(ext, "image/png")
+        try:
+            with open(path, "rb") as f:
+                return mime, f.read()
+        except OSError:
+            return None
+    return None
+
+
+class ResultsStore:
+    """
+    Результаты анализа в локальной базе SQLite: один запуск (run) — набор находок по файлам.
+    Превью хранятся BLOB-ами, одинаковые — один раз (ключ — sha256). Индексы по номеру,
+    файлу, странице и ревизии позволяют отдавать интерфейсу отфильтрованные и отсортированные
+    страницы результатов (query), не пересылая весь массив находок.
+    Хранятся последние keep_runs запусков; более старые удаляются при начале нового.
+    """
+
+    def __init__(self, path: Optional[str] = None, keep_runs: int = DEFAULT_KEEP_RUNS):
+        self.path = path or default_store_path()
+        self.keep_runs = keep_runs
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self.conn = sqlite3.connect(self.path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(_SCHEMA)
+
+    def close(self) -> None:
+        self.conn.close()
+
+    def __enter__(self) -> "ResultsStore":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    # -----------------------
+    # Запись
+    # -----------------------
+
+    def begin_run(self, paths: List[str], options: Dict[str, Any]) -> int:
+        with self.conn:
+            cur = self.conn.execute(
+                "INSERT INTO runs (created, files, options) VALUES (?, ?, ?)",
+                (time.time(), json.dumps(paths, ensure_ascii=False),
+                 json.dumps(options, sort_keys=True, ensure_ascii=False)))
+        run_id = cur.lastrowid
+        self._prune(run_id)
+        return run_id
+
+    def add_items(self, run_id: int, items: Iterable[Dict[str, Any]]) -> None:
+        """Добавляет находки запуска; фиксируется вызовом commit (обычно — по готовности файла)."""
+        rows = []
+        thumbs = []
+        for it in items:
+            src = it.get("sourceFile") or {}
+            blob = _thumbnail_blob(it)
+            sha = None
+            if blob is not None:
+                sha = hashlib.sha256(blob[1]).hexdigest()
+                thumbs.append((sha, blob[0], blob[1]))
+            extra = {k: v for k, v in it.items() if k not in _COLUMN_KEYS}
+            rows.append((
+                run_id, src.get("path") or "", src.get("name") or "",
+                it.get("text") or "", it.get("composite_number") or it.get("text") or "",
+                it.get("page"), it.get("grid"), it.get("revision"), it.get("comment") or "",
+                json.dumps(it["rect"]) if it.get("rect") else None,
+                json.dumps(it["clip"]) if it.get("clip") else None,
+                sha, json.dumps(extra, ensure_ascii=False) if extra else None,
+            ))
+        if thumbs:
+            self.conn.executemany("INSERT OR IGNORE INTO thumbnails (sha256, mime, data) VALUES (?, ?, ?)", thumbs)
+        self.conn.executemany(
+            "INSERT INTO items (run_id, file_path, file_name, text, composite_number, page, grid, revision, "
+            "comment, rect, clip, thumb, extra) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+
+    def commit(self) -> None:
+        self.conn.commit()
+
+    def _prune(self, run_id: int) -> None:
+        old = [r[0] for r in self.conn.execute(
+            "SELECT id FROM runs WHERE id <= ? ORDER BY id DESC LIMIT -1 OFFSET ?", (run_id, self.keep_runs))]
+        if not old:
+            return
+        marks = ",".join("?" * len(old))
+        with self.conn:
+            self.conn.execute(f"DELETE FROM items WHERE run_id IN ({marks})", old)
+            self.conn.execute(f"DELETE FROM runs WHERE id IN ({marks})", old)
+            self.conn.execute("DELETE FROM thumbnails WHERE sha256 NOT IN "
+                              "(SELECT thumb FROM items WHERE thumb IS NOT NULL)")
+
+    # -----------------------
+    # Чтение
+    # -----------------------
+
+    def latest_run(self) -> Optional[int]:
+        row = self.conn.execute("SELECT MAX(id) FROM runs").fetchone()
+        return row[0] if row else None
+
+    def runs(self) -> List[Dict[str, Any]]:
+        out = []
+        for run_id, created, files in self.conn.execute("SELECT id, created, files FROM runs ORDER BY id DESC"):
+            count = self.conn.execute("SELECT COUNT(*) FROM items WHERE run_id = ?", (run_id,)).fetchone()[0]
+            out.append({"run_id": run_id, "created": created, "files": json.loads(files), "count": count})
+        return out
+
+    @staticmethod
+    def _where(run_id: int, filters: Dict[str, Any]) -> Tuple[str, List[Any]]:
+        """
+        Условия выборки:
+          number   — начало составного номера (по индексу, с учётом регистра);
+          text     — подстрока номера или найденного текста (без учёта регистра, перебор запуска);
+          file     — путь или имя исходного файла;
+          page     — номер страницы или [с, по];
+          revision — ревизия.
+        """
+        clauses = ["run_id = ?"]
+        args: List[Any] = [run_id]
+        number = filters.get("number")
+        if number:
+            clauses.append("composite_number >= ? AND composite_number < ?")
+            args += [number, number + "\U0010ffff"]
+        text = filters.get("text")
+        if text:
+            pattern = "%" + text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+            clauses.append("(composite_number LIKE ? ESCAPE '\\' OR text LIKE ? ESCAPE '\\')")
+            args += [pattern, pattern]
+        file = filters.get("file")
+        if file:
+            clauses.append("(file_path = ? OR file_name = ?)")
+            args += [file, file]
+        page = filters.get("page")
+        if isinstance(page, list) and len(page) == 2:
+            clauses.append("page BETWEEN ? AND ?")
+            args += [int(page[0]), int(page[1])]
+        elif page is not None:
+            clauses.append("page = ?")
+            args.append(int(page))
+        revision = filters.get("revision")
+        if revision is not None:
+            clauses.append("revision = ?")
+            args.append(int(revision))
+        return " AND ".join(clauses), args
+
+    @staticmethod
+    def _order(sort: str, desc: bool) -> str:
+        column = SORT_COLUMNS.get(sort)
+        if column is None:
+            raise ValueError(f"Unknown sort field: {sort}")
+        direction = "DESC" if desc else "ASC"
+        if column == "id":
+            return f"ORDER BY items.id {direction}"
+        return f"ORDER BY {column} {direction}, items.id {direction}"
+
+    def _select(self, run_id: int, filters: Dict[str, Any], sort: str, desc: bool,
+                thumbnails: bool, tail: str = "", tail_args: Tuple = ()) -> sqlite3.Cursor:
+        where, args = self._where(run_id, filters)
+        head = (_SELECT + " LEFT JOIN thumbnails ON thumbnails.sha256 = items.thumb") if thumbnails else _SELECT_NO_THUMBS
+        sql = f"{head} WHERE {where} {self._order(sort, desc)} {tail}"
+        return self.conn.execute(sql, [*args, *tail_args])
+
+    @staticmethod
+    def _row_item(row: Tuple) -> Dict[str, Any]:
+        (item_id, file_path, file_name, text, number, page, grid, revision, comment,
+         rect, clip, extra, mime, data) = row
+        item: Dict[str, Any] = {
+            "id": item_id,
+            "text": text,
+            "composite_number": number,
+            "page": page,
+            "grid": grid,
+            "image_png_b64": f"data:{mime};base64," + base64.b64encode(data).decode("ascii") if data else "",
+            "revision": revision,
+            "comment": comment,
+            "sourceFile": {"name": file_name, "path": file_path},
+            "rect": json.loads(rect) if rect else None,
+            "clip": json.loads(clip) if clip else None,
+        }
+        if extra:
+            item.update(json.loads(extra))
+        return item
+
+    def query(self, run_id: Optional[int] = None, filters: Optional[Dict[str, Any]] = None,
+              sort: str = "id", desc: bool = False, offset: int = 0, limit: int = DEFAULT_PAGE_SIZE,
+              thumbnails: bool = True) -> Dict[str, Any]:
+        """Страница результатов: {"run_id", "total", "offset", "items"}; limit не больше MAX_PAGE_SIZE."""
+        run_id = run_id or self.latest_run()
+        if run_id is None:
+            return {"run_id": None, "total": 0, "offset": 0, "items": []}
+        filters = filters or {}
+        where, args = self._where(run_id, filters)
+        total = self.conn.execute(f"SELECT COUNT(*) FROM items WHERE {where}", args).fetchone()[0]
+        limit = max(0, min(int(limit), MAX_PAGE_SIZE))
+        cur = self._select(run_id, filters, sort, desc, thumbnails, "LIMIT ? OFFSET ?", (limit, max(0, int(offset))))
+        return {"run_id": run_id, "total": total, "offset": offset, "items": [self._row_item(r) for r in cur]}
+
+    def iter_items(self, run_id: Optional[int] = None, filters: Optional[Dict[str, Any]] = None,
+                   sort: str = "id", desc: bool = False, thumbnails: bool = True) -> Iterator[Dict[str, Any]]:
+        """Все строки выборки по порядку, порциями по ITER_BATCH (для экспорта из базы)."""
+        run_id = run_id or self.latest_run()
+        if run_id is None:
+            return
+        cur = self._select(run_id, filters or {}, sort, desc, thumbnails)
+        while True:
+            rows = cur.fetchmany(ITER_BATCH)
+            if not rows:
+                return
+            for row in rows:
+                yield self._row_item(row)
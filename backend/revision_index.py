@@ -0,0 +1,112 @@
+import os
+import re
+import hashlib
+from typing import List, Dict, Any, Optional
+
+import fitz  # PyMuPDF
+
+from analysis_cache import AnalysisCache, default_cache_dir
+
+# Меняется при изменении отпечатка страницы или формата записей — старые записи перестают совпадать
+REVISION_INDEX_VERSION = 1
+DEFAULT_REVISION_MAX_BYTES = 256 * 1024 * 1024
+
+_REF = re.compile(r"(\d+) \d+ R")
+# Обратные ссылки (на родительский узел дерева страниц, на страницу аннотации) в отпечаток не входят:
+# через них обход дошёл бы до всего документа
+_BACK_REF = re.compile(r"/(?:Parent|P)\s+\d+ \d+ R")
+# Суффикс ревизии в имени файла — как в process_pdfs._parse_revision_from_filename
+_REVISION_SUFFIX = re.compile(r"_r?\d+$")
+
+
+def _object_digest(doc: fitz.Document, xref: int, memo: Dict[int, str]) -> str:
+    """Хэш объекта PDF вместе со всем, на что он ссылается; номера объектов в хэш не входят."""
+    digest = memo.get(xref)
+    if digest is not None:
+        return digest
+    memo[xref] = "cycle"  # ссылка на объект, который ещё обходится
+    h = hashlib.sha256(_resolve_refs(doc, doc.xref_object(xref, compressed=True), memo).encode("utf-8"))
+    if doc.xref_is_stream(xref):
+        h.update(doc.xref_stream_raw(xref))
+    memo[xref] = digest = h.hexdigest()
+    return digest
+
+
+def _resolve_refs(doc: fitz.Document, text: str, memo: Dict[int, str]) -> str:
+    return _REF.sub(lambda m: _object_digest(doc, int(m.group(1)), memo), _BACK_REF.sub("", text))
+
+
+def _page_key_value(doc: fitz.Document, xref: int, key: str, memo: Dict[int, str]) -> str:
+    """Значение ключа словаря страницы с разрешёнными ссылками; Resources наследуется от дерева страниц."""
+    kind, value = doc.xref_get_key(xref, key)
+    while kind == "null" and key == "Resources":
+        kind, parent = doc.xref_get_key(xref, "Parent")
+        if kind != "xref":
+            break
+        xref = int(parent.split()[0])
+        kind, value = doc.xref_get_key(xref, key)
+    return "" if kind == "null" else _resolve_refs(doc, value, memo)
+
+
+def page_fingerprints(doc: fitz.Document) -> List[str]:
+    """
+    Отпечатки страниц документа: геометрия страницы, поток содержимого, ресурсы (шрифты, картинки,
+    форм-объекты — со всеми вложенными объектами и потоками) и аннотации. Неизменённый лист
+    в следующей ревизии файла даёт тот же отпечаток, даже если номера объектов PDF отличаются.
+    Общие для страниц ресурсы хэшируются один раз на документ.
+    """
+    memo: Dict[int, str] = {}
+    out: List[str] = []
+    for page in doc:
+        h = hashlib.sha256(f"{tuple(page.rect)}|{tuple(page.mediabox)}|{page.rotation}".encode("ascii"))
+        h.update(page.read_contents())
+        for key in ("Resources", "Annots"):
+            h.update(f"|{key}|{_page_key_value(doc, page.xref, key, memo)}".encode("utf-8"))
+        out.append(h.hexdigest())
+    return out
+
+
+class RevisionIndex(AnalysisCache):
+    """
+    Результаты последней проанализированной ревизии каждого чертежа по страницам:
+    {"pages": {отпечаток страницы: [находки на ней]}}. Ключ — имя файла без суффикса ревизии
+    (_r01, _r02, ...) и значимые для результата опции. Страницы новой ревизии с известным
+    отпечатком не анализируются заново — находки и превью берутся из записи.
+    Хранение, атомарная запись и LRU-вытеснение — как у AnalysisCache.
+    """
+
+    def __init__(self, cache_dir: Optional[str] = None, max_bytes: int = DEFAULT_REVISION_MAX_BYTES):
+        super().__init__(cache_dir or default_cache_dir("revisions"), max_bytes)
+        self.files = 0
+        self.pages_reused = 0
+        self.pages_recomputed = 0
+
+    def drawing_key(self, file_path: str, result_options: Dict[str, Any]) -> str:
+        name = os.path.splitext(os.path.basename(file_path))[0]
+        if name.upper().startswith("EST-"):
+            name = name[4:]
+        name = _REVISION_SUFFIX.sub("", name).lower()
+        opts = repr(sorted(result_options.items()))
+        return hashlib.sha256(f"{REVISION_INDEX_VERSION}|{name}|{opts}".encode("utf-8")).hexdigest()
+
+    def previous_pages(self, key: str) -> Dict[str, List[Dict[str, Any]]]:
+        """Находки предыдущей ревизии по отпечаткам страниц (пусто, если записи нет)."""
+        entry = self.get(key)
+        pages = entry.get("pages") if isinstance(entry, dict) else None
+        return pages if isinstance(pages, dict) else {}
+
+    def save(self, key: str, fingerprints: List[str], items: List[Dict[str, Any]]) -> None:
+        """Запоминает находки документа по отпечаткам его страниц (вместо предыдущей ревизии)."""
+        by_page: Dict[int, List[Dict[str, Any]]] = {}
+        for it in items:
+            by_page.setdefault(it.get("page"), []).append(it)
+        self.put(key, {"pages": {fp: by_page.get(i + 1, []) for i, fp in enumerate(fingerprints)}})
+
+    def record(self, reused: int, recomputed: int) -> None:
+        self.files += 1
+        self.pages_reused += reused
+        self.pages_recomputed += recomputed
+
+    def stats(self) -> Dict[str, Any]:
+        return {"files": self.files, "pages_reused": self.pages_reused,
+                "pages_recomputed": self.pages_recomputed}
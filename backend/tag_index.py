@@ -0,0 +1,164 @@
+import os
+import json
+import time
+import sqlite3
+import logging
+from typing import List, Dict, Any, Optional, Iterable, Tuple
+
+from analysis_cache import default_cache_dir
+
+logger = logging.getLogger(__name__)
+
+INDEX_FILE = "tags.sqlite"
+DEFAULT_LOOKUP_LIMIT = 1000
+MAX_LOOKUP_LIMIT = 10000
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    id INTEGER PRIMARY KEY,
+    path TEXT NOT NULL UNIQUE,
+    name TEXT NOT NULL,
+    revision INTEGER,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    options TEXT NOT NULL,
+    indexed REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS refs (
+    number TEXT NOT NULL,
+    text TEXT NOT NULL,
+    file_id INTEGER NOT NULL REFERENCES files(id),
+    page INTEGER,
+    rect TEXT
+);
+CREATE INDEX IF NOT EXISTS refs_number ON refs(number);
+CREATE INDEX IF NOT EXISTS refs_text ON refs(text);
+CREATE INDEX IF NOT EXISTS refs_file ON refs(file_id);
+"""
+
+FileState = Tuple[int, int]
+
+
+def default_index_path() -> str:
+    return os.path.join(default_cache_dir("index"), INDEX_FILE)
+
+
+def file_state(path: str) -> Optional[FileState]:
+    """(размер, mtime в нс) файла — по ним определяется, что файл изменился; None — файла нет."""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_size, st.st_mtime_ns
+
+
+class TagIndex:
+    """
+    Обратный индекс номеров по всем проанализированным документам проекта:
+    номер -> (файл, ревизия, страница, рамка). Хранится в SQLite и обновляется пофайлово:
+    заново индексируются только добавленные и изменённые файлы (по размеру, mtime и опциям
+    анализа), удалённые убираются (remove_files, prune_missing). Поиск (lookup) — точный
+    или по началу номера, по индексу; ищется и составной номер (префикс файла + номер),
+    и сам найденный номер.
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path or default_index_path()
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self.conn = sqlite3.connect(self.path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(_SCHEMA)
+
+    def close(self) -> None:
+        self.conn.close()
+
+    def __enter__(self) -> "TagIndex":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    # -----------------------
+    # Обновление
+    # -----------------------
+
+    def stale(self, paths: Iterable[str], options_key: str) -> Dict[str, FileState]:
+        """Файлы из paths, которых нет в индексе или которые изменились: путь -> текущее состояние."""
+        out: Dict[str, FileState] = {}
+        for path in paths:
+            state = file_state(path)
+            if state is None:
+                logger.warning(f"File not found, not indexed: {path}")
+                continue
+            row = self.conn.execute("SELECT size, mtime_ns, options FROM files WHERE path = ?", (path,)).fetchone()
+            if row is None or tuple(row[:2]) != state or row[2] != options_key:
+                out[path] = state
+        return out
+
+    def replace_file(self, path: str, state: FileState, options_key: str,
+                     items: List[Dict[str, Any]]) -> None:
+        """Заменяет ссылки файла находками его анализа (state — состояние файла до анализа)."""
+        name = os.path.basename(path)
+        revision = next((it.get("revision") for it in items if it.get("revision") is not None), None)
+        with self.conn:
+            self._delete(path)
+            cur = self.conn.execute(
+                "INSERT INTO files (path, name, revision, size, mtime_ns, options, indexed) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (path, name, revision, state[0], state[1], options_key, time.time()))
+            file_id = cur.lastrowid
+            self.conn.executemany(
+                "INSERT INTO refs (number, text, file_id, page, rect) VALUES (?, ?, ?, ?, ?)",
+                [(it.get("composite_number") or it.get("text") or "", it.get("text") or "", file_id,
+                  it.get("page"), json.dumps(it["rect"]) if it.get("rect") else None) for it in items])
+
+    def _delete(self, path: str) -> bool:
+        row = self.conn.execute("SELECT id FROM files WHERE path = ?", (path,)).fetchone()
+        if row is None:
+            return False
+        self.conn.execute("DELETE FROM refs WHERE file_id = ?", (row[0],))
+        self.conn.execute("DELETE FROM files WHERE id = ?", (row[0],))
+        return True
+
+    def remove_files(self, paths: Iterable[str]) -> int:
+        with self.conn:
+            return sum(self._delete(p) for p in paths)
+
+    def prune_missing(self) -> List[str]:
+        """Убирает из индекса файлы, которых больше нет на диске; возвращает их пути."""
+        missing = [p for (p,) in self.conn.execute("SELECT path FROM files") if not os.path.exists(p)]
+        self.remove_files(missing)
+        return missing
+
+    # -----------------------
+    # Поиск
+    # -----------------------
+
+    def lookup(self, number: str, prefix: bool = False, offset: int = 0,
+               limit: int = DEFAULT_LOOKUP_LIMIT) -> Dict[str, Any]:
+        """
+        Ссылки на номер: {"total", "offset", "refs": [{"number", "text", "file", "name", "revision",
+        "page", "rect"}]}, по номеру, файлу и странице. prefix — все номера, начинающиеся с number.
+        """
+        if prefix:
+            where = "(number >= ? AND number < ?) OR (text >= ? AND text < ?)"
+            args: List[Any] = [number, number + "\U0010ffff"] * 2
+        else:
+            where = "number = ? OR text = ?"
+            args = [number, number]
+        total = self.conn.execute(f"SELECT COUNT(*) FROM refs WHERE {where}", args).fetchone()[0]
+        limit = max(0, min(int(limit), MAX_LOOKUP_LIMIT))
+        rows = self.conn.execute(
+            "SELECT number, text, path, name, revision, page, rect FROM "
+            f"(SELECT * FROM refs WHERE {where}) AS r JOIN files ON files.id = r.file_id "
+            "ORDER BY number, path, page LIMIT ? OFFSET ?", [*args, limit, max(0, int(offset))])
+        refs = [{"number": n, "text": t, "file": path, "name": name, "revision": rev, "page": page,
+                 "rect": json.loads(rect) if rect else None}
+                for n, t, path, name, rev, page, rect in rows]
+        return {"total": total, "offset": offset, "refs": refs}
+
+    def stats(self) -> Dict[str, int]:
+        files = self.conn.execute("SELECT COUNT(*) FROM files").fetchone()[0]
+        refs = self.conn.execute("SELECT COUNT(*) FROM refs").fetchone()[0]
+        return {"files": files, "refs": refs}
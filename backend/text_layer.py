@@ -0,0 +1,37 @@
+from typing import List, Optional, Tuple, Iterator
+
+import fitz  # PyMuPDF
+
+CharBox = Optional[Tuple[float, float, float, float]]
+
+
+def iter_block_chars(page: fitz.Page) -> Iterator[Tuple[str, List[CharBox]]]:
+    """
+    Текст каждого текстового блока страницы (как в get_text("blocks"): строки через "\n")
+    и параллельный список рамок символов (None для разделителей строк).
+    Извлечение выполняется один раз на страницу.
+    """
+    raw = page.get_text("rawdict")
+    for block in raw.get("blocks", []):
+        if block.get("type", 0) != 0:
+            continue
+        chars: List[str] = []
+        boxes: List[CharBox] = []
+        for line in block.get("lines", []):
+            for span in line.get("spans", []):
+                for ch in span.get("chars", []):
+                    chars.append(ch["c"])
+                    boxes.append(ch["bbox"])
+            chars.append("\n")
+            boxes.append(None)
+        if chars:
+            yield "".join(chars), boxes
+
+
+def span_rect(boxes: List[CharBox], start: int, end: int) -> Optional[fitz.Rect]:
+    """Объединённая рамка символов text[start:end]."""
+    rect = fitz.Rect()
+    for bbox in boxes[start:end]:
+        if bbox is not None:
+            rect |= bbox
+    return None if rect.is_empty else rect
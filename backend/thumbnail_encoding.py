@@ -0,0 +1,127 @@
+import io
+import base64
+from typing import Dict, Any, Optional
+
+import fitz  # PyMuPDF
+
+# Pillow нужен только для WebP, 1-бит/палитры и явного уровня сжатия PNG
+try:
+    from PIL import Image
+except ImportError:  # pragma: no cover - зависит от сборки
+    Image = None
+
+FORMATS = ("png", "jpeg", "webp")
+COLORSPACES = ("rgb", "gray", "mono", "palette")
+MIME_TYPES = {"png": "image/png", "jpeg": "image/jpeg", "webp": "image/webp"}
+EXTENSIONS = {"png": ".png", "jpeg": ".jpg", "webp": ".webp"}
+
+# Порог бинаризации для "mono": чертежи — тёмные линии на белом фоне
+MONO_THRESHOLD = 160
+PALETTE_COLORS = 16
+
+
+class ThumbnailOptions:
+    """
+    Параметры кодирования превью:
+      thumb_format          — png | jpeg | webp
+      thumb_colorspace      — rgb | gray | mono (1 бит) | palette (индексированные цвета)
+      thumb_dpi             — разрешение рендера
+      thumb_quality         — качество JPEG/WebP (1–100)
+      thumb_compress_level  — уровень сжатия PNG (0–9), по умолчанию — встроенный в PyMuPDF
+      thumb_store           — каталог для файлов превью (см. thumbnail_store.py);
+                              пусто — превью передаются как data URL
+    """
+
+    def __init__(self, data: Dict[str, Any]):
+        fmt = str(data.get("thumb_format") or "png").lower()
+        self.format: str = "jpeg" if fmt == "jpg" else fmt
+        self.colorspace: str = str(data.get("thumb_colorspace") or "rgb").lower()
+        self.dpi: int = int(data.get("thumb_dpi") or 150)
+        self.quality: int = int(data.get("thumb_quality") or 80)
+        level = data.get("thumb_compress_level")
+        self.compress_level: Optional[int] = None if level is None else int(level)
+        self.store_dir: str = str(data.get("thumb_store") or "")
+
+        if self.format not in FORMATS:
+            raise ValueError(f"Unknown thumbnail format: {self.format}")
+        if self.colorspace not in COLORSPACES:
+            raise ValueError(f"Unknown thumbnail colorspace: {self.colorspace}")
+
+    @property
+    def mime(self) -> str:
+        return MIME_TYPES[self.format]
+
+    @property
+    def ext(self) -> str:
+        return EXTENSIONS[self.format]
+
+    @property
+    def render_colorspace(self) -> fitz.Colorspace:
+        """Цветовое пространство рендера: всё, кроме rgb/palette, рендерится сразу в оттенках серого."""
+        return fitz.csRGB if self.colorspace in ("rgb", "palette") else fitz.csGRAY
+
+    def as_key(self) -> Dict[str, Any]:
+        """
+        Параметры, от которых зависят превью (для ключей кэша). Каталог хранилища не входит:
+        фронтенд задаёт его на время сессии, а наличие файлов проверяется при чтении записи;
+        важно только, превью — файлы или data URL.
+        """
+        return {
+            "format": self.format,
+            "colorspace": self.colorspace,
+            "dpi": self.dpi,
+            "quality": self.quality,
+            "compress_level": self.compress_level,
+            "store": bool(self.store_dir),
+        }
+
+
+def _needs_pillow(opts: ThumbnailOptions) -> bool:
+    return (opts.format == "webp" or opts.colorspace in ("mono", "palette")
+            or (opts.format == "png" and opts.compress_level is not None))
+
+
+def to_data_url(data: bytes, opts: ThumbnailOptions) -> str:
+    return f"data:{opts.mime};base64," + base64.b64encode(data).decode("utf-8")
+
+
+def encode_pil(img: "Image.Image", opts: ThumbnailOptions) -> bytes:
+    """Кодирует PIL-изображение согласно opts."""
+    if opts.colorspace == "gray":
+        img = img.convert("L")
+    elif opts.colorspace == "mono":
+        img = img.convert("L").point(lambda v: 255 if v > MONO_THRESHOLD else 0, "1")
+    elif opts.colorspace == "palette":
+        img = img.convert("RGB").quantize(colors=PALETTE_COLORS)
+    else:
+        img = img.convert("RGB")
+
+    buf = io.BytesIO()
+    if opts.format == "png":
+        kwargs = {} if opts.compress_level is None else {"compress_level": opts.compress_level}
+        img.save(buf, format="PNG", optimize=opts.compress_level == 9, **kwargs)
+    elif opts.format == "jpeg":
+        if img.mode in ("1", "P"):
+            img = img.convert("L")
+        img.save(buf, format="JPEG", quality=opts.quality)
+    else:
+        img.save(buf, format="WEBP", quality=opts.quality, lossless=opts.colorspace == "mono")
+    return buf.getvalue()
+
+
+def encode_pixmap(pix: fitz.Pixmap, opts: ThumbnailOptions) -> bytes:
+    """
+    Кодирует pixmap согласно opts. PNG/JPEG без постобработки кодируются средствами PyMuPDF,
+    остальные варианты — через Pillow.
+    """
+    pix.set_dpi(opts.dpi, opts.dpi)
+    if not _needs_pillow(opts):
+        if opts.format == "jpeg":
+            return pix.tobytes("jpg", jpg_quality=opts.quality)
+        return pix.tobytes("png")
+
+    if Image is None:
+        raise RuntimeError("Pillow is required for this thumbnail encoding. Please run 'pip install Pillow'.")
+    mode = "L" if pix.n == 1 else "RGB"
+    img = Image.frombytes(mode, (pix.width, pix.height), pix.samples)
+    return encode_pil(img, opts)
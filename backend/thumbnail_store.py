@@ -0,0 +1,68 @@
+import os
+import hashlib
+import logging
+import tempfile
+from typing import Dict, Optional
+
+from thumbnail_encoding import ThumbnailOptions, to_data_url
+
+logger = logging.getLogger(__name__)
+
+
+class ThumbnailStore:
+    """
+    Хранилище превью на диске: один файл на изображение, имя — sha256 содержимого.
+    Одинаковые превью хранятся один раз; запись атомарная, поэтому в один каталог
+    могут одновременно писать несколько процессов пула.
+    """
+
+    def __init__(self, root: str):
+        self.root = os.path.abspath(root)
+        os.makedirs(self.root, exist_ok=True)
+
+    def put(self, data: bytes, ext: str) -> str:
+        """Сохраняет изображение и возвращает абсолютный путь к файлу."""
+        path = os.path.join(self.root, hashlib.sha256(data).hexdigest() + ext)
+        if os.path.exists(path):
+            return path
+        fd, tmp_path = tempfile.mkstemp(dir=self.root, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except OSError:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise
+        return path
+
+
+_stores: Dict[str, ThumbnailStore] = {}
+
+
+def get_store(root: str) -> ThumbnailStore:
+    store = _stores.get(root)
+    if store is None:
+        store = _stores[root] = ThumbnailStore(root)
+    return store
+
+
+def thumbnail_fields(data: bytes, opts: ThumbnailOptions) -> Dict[str, str]:
+    """
+    Поля превью для элемента результата:
+      {"image_png_b64": data URL}                    — без хранилища;
+      {"image_png_b64": "", "image_path": путь}      — при opts.store_dir.
+    """
+    if opts.store_dir:
+        return {"image_png_b64": "", "image_path": get_store(opts.store_dir).put(data, opts.ext)}
+    return {"image_png_b64": to_data_url(data, opts)}
+
+
+def has_thumbnail(item: Dict[str, str]) -> bool:
+    """Есть ли у элемента превью (data URL или существующий файл в хранилище)."""
+    if item.get("image_png_b64"):
+        return True
+    path: Optional[str] = item.get("image_path")
+    return bool(path) and os.path.isfile(path)